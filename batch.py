@@ -0,0 +1,353 @@
+import argparse
+import csv
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import slp
+
+# headless batch runner - reads scenario definitions from a file and runs each
+# one as a sense-plan-act episode (slp.run_episode) without any input()
+# prompts, writing one JSON line of results per run as soon as it finishes
+# nothing is plotted unless a scenario asks for it with "plot"
+#
+#   python batch.py scenarios.jsonl -o results.jsonl
+#   python batch.py scenarios.jsonl -o results.jsonl --workers 8 --chunksize 16
+#
+# with --workers the episodes are spread over a process pool in chunks and
+# results are written as chunks finish (so not in input order) - every map is
+# generated once in the parent and handed to the workers in shared memory
+# rather than pickled with each task
+# scenarios without a map seed get one derived from --seed and their run
+# number, so results do not depend on the number of workers
+#
+# a scenario is a JSON object like
+#   {"id": "open-50", "map": {"type": "random", "rows": 50, "cols": 50, "p": 0.2, "seed": 3},
+#    "start": [0, 0, "south", "center"], "goal": "49,49,south,center", "vision": 3,
+#    "planner": "astar", "heuristic": "euclidean", "repeat": 10, "plot": "open-50.png"}
+# map types are random (p), clustered (density, cluster_size),
+# corridors (ncorridors, width) and rooms (room_size, door_width), all seeded,
+# and file (path, plus shape, dtype and offset for raw files and an optional
+# threshold - see slp.load_lattice), which is memory-mapped rather than
+# copied into shared memory by --workers
+# planner is astar, dstar, bidirectional, hierarchical (tiles), goal_tree
+# (one reverse search tree from the goal, slp.Goal_Tree_Cache) or arastar
+# (anytime, with optional "time_limit" seconds and / or "max_expansions" per
+# replan), heuristic is euclidean, chebyshev, field (the obstacle-aware
+# Cost_Field_Heuristic) or lut:<file> (a saved heuristic table)
+# optional "sensing" is rays, square or circle (default: the 8 rays of
+# update_knowledge) and "occlusion": true limits it to line of sight
+# "plan_reuse": true keeps the current plan and repairs the stretch new
+# obstacles break instead of replanning from scratch (slp.Plan_Cache)
+# "reachability": true ends the episode as soon as the known map cuts the
+# goal off, without searching (slp.Reachability_Index)
+# "stats": true adds the planner's counters and phase timers (slp.Planner_Stats)
+# to the result, "trace": <file> also writes the episode's phases as a Chrome
+# trace (flame chart) and "profile": <file> runs it under cProfile and saves
+# the pstats profile - use these on one chosen scenario, they slow it down
+# "repeat": n runs the scenario n times with map seeds seed, seed+1, ...
+#
+# accepted files: .json (one scenario, a list, or {"defaults": {...},
+# "scenarios": [...]}), .jsonl (one scenario per line, streamed), .yaml/.yml
+# (same layout as .json, needs PyYAML) and .csv (one scenario per row, with
+# map_<key> columns for the map, e.g. map_type, map_rows, map_p)
+
+# this function turns a "x,y,heading,angle" string or a list into a state tuple
+def parse_state(value):
+    if isinstance(value, str):
+        value = value.split(",")
+    x, y, h, a = [str(v).strip() for v in value]
+    if h not in slp.heading or a not in slp.angle:
+        raise ValueError("bad state {}".format(value))
+    return (int(x), int(y), h, a)
+
+# this function builds the occupancy grid described by a scenario's "map"
+def build_map(spec):
+    kind = spec.get('type', 'random')
+    if kind == 'file':
+        return slp.load_lattice(spec['path'], shape = spec.get('shape'), dtype = spec.get('dtype', 'uint8'),
+                                offset = int(spec.get('offset', 0)), threshold = spec.get('threshold'))
+    rows = int(spec['rows'])
+    cols = int(spec.get('cols', rows))
+    seed = spec.get('seed')
+    if kind == 'random':
+        p = float(spec.get('p', 0.2))
+        return slp.generate_state_lattice(rows, cols, [1 - p, p], seed = seed)
+    if kind == 'clustered':
+        return slp.generate_clustered_lattice(rows, cols, float(spec.get('density', 0.2)), int(spec.get('cluster_size', 5)), seed = seed)
+    if kind == 'corridors':
+        return slp.generate_corridor_lattice(rows, cols, int(spec.get('ncorridors', 4)), int(spec.get('width', 1)), seed = seed)
+    if kind == 'rooms':
+        return slp.generate_rooms_lattice(rows, cols, int(spec.get('room_size', 10)), int(spec.get('door_width', 2)), seed = seed)
+    raise ValueError("unknown map type {}".format(kind))
+
+# heuristic tables are loaded (memory-mapped) once per file
+loaded_tables = {}
+
+# this function returns the heuristic named by a scenario
+def build_heuristic(name, state_lattice):
+    if name == 'euclidean':
+        return slp.euclidean_distance
+    if name == 'chebyshev':
+        return slp.chebyshev_distance
+    if name == 'field':
+        return slp.Cost_Field_Heuristic(len(state_lattice), len(state_lattice[0]))
+    if name.startswith('lut:'):
+        filename = name[len('lut:'):]
+        if filename not in loaded_tables:
+            loaded_tables[filename] = slp.load_heuristic_table(filename)
+        return loaded_tables[filename]
+    raise ValueError("unknown heuristic {}".format(name))
+
+# this function converts a CSV cell to an int or float where it looks like one
+def csv_value(text):
+    for kind in (int, float):
+        try:
+            return kind(text)
+        except ValueError:
+            pass
+    return text
+
+# this function reads an on/off scenario option, which may be text in a CSV file
+def flag(value):
+    return value in (True, 1, 'true', 'yes')
+
+# this function yields the scenarios in a file, one dict at a time
+def read_scenarios(filename):
+    if filename.endswith('.jsonl'):
+        with open(filename) as f:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        return
+    if filename.endswith('.csv'):
+        with open(filename, newline = '') as f:
+            for row in csv.DictReader(f):
+                scenario = {'map' : {}}
+                for key, text in row.items():
+                    if text is None or text == '':
+                        continue
+                    if key.startswith('map_'):
+                        scenario['map'][key[len('map_'):]] = csv_value(text)
+                    elif key in ('start', 'goal', 'id', 'planner', 'heuristic', 'sensing', 'plot', 'trace', 'profile'):
+                        scenario[key] = text
+                    else:
+                        scenario[key] = csv_value(text)
+                yield scenario
+        return
+    with open(filename) as f:
+        if filename.endswith(('.yaml', '.yml')):
+            import yaml # optional, only needed for YAML scenario files
+            data = yaml.safe_load(f)
+        else:
+            data = json.load(f)
+    defaults = {}
+    if isinstance(data, dict) and 'scenarios' in data:
+        defaults = data.get('defaults', {})
+        data = data['scenarios']
+    if isinstance(data, dict):
+        data = [data]
+    for scenario in data:
+        merged = dict(defaults)
+        merged.update(scenario)
+        if 'map' in defaults and 'map' in scenario:
+            merged['map'] = dict(defaults['map'], **scenario['map'])
+        yield merged
+
+# this function expands "repeat" into one scenario per run, and gives runs
+# without a map seed a deterministic one derived from base_seed
+def expand_scenarios(scenarios, base_seed = 0):
+    run_number = 0
+    for number, scenario in enumerate(scenarios):
+        base_id = scenario.get('id', 'scenario-{}'.format(number))
+        repeat = int(scenario.get('repeat', 1))
+        for k in range(repeat):
+            run = dict(scenario)
+            run['map'] = dict(scenario.get('map', {}))
+            if repeat > 1:
+                run['id'] = '{}/{}'.format(base_id, k)
+                if run['map'].get('seed') is not None:
+                    run['map']['seed'] = int(run['map']['seed']) + k
+            else:
+                run['id'] = base_id
+            if run['map'].get('seed') is None:
+                run['map']['seed'] = int(np.random.SeedSequence([base_seed, run_number]).generate_state(1)[0])
+            run_number += 1
+            yield run
+
+# this function runs a single scenario and returns its JSON-ready result
+def run_scenario(scenario, state_lattice = None):
+    if state_lattice is None:
+        state_lattice = build_map(scenario['map'])
+    start = parse_state(scenario['start'])
+    goal = parse_state(scenario['goal'])
+    heuristic = build_heuristic(scenario.get('heuristic', 'euclidean'), state_lattice)
+    stats = None
+    if flag(scenario.get('stats')) or scenario.get('trace'):
+        stats = slp.Planner_Stats(trace = bool(scenario.get('trace')))
+    episode = slp.run_episode
+    if scenario.get('profile'):
+        episode = lambda *args, **kwargs: slp.profile_episode(scenario['profile'], *args, **kwargs)
+    result = episode(state_lattice, start, goal, int(scenario.get('vision', 1)),
+                     planner = scenario.get('planner', 'astar'), heuristic = heuristic,
+                     sensing = scenario.get('sensing'), occlusion = flag(scenario.get('occlusion')),
+                     stats = stats, time_limit = scenario.get('time_limit'),
+                     max_expansions = scenario.get('max_expansions'),
+                     plan_reuse = flag(scenario.get('plan_reuse')),
+                     reachability = flag(scenario.get('reachability')))
+    if scenario.get('trace'):
+        stats.write_trace(scenario['trace'])
+    if scenario.get('plot'):
+        plot_result(state_lattice, result, scenario['plot'])
+    record = {'id' : scenario['id'], 'seed' : scenario['map'].get('seed')}
+    record.update(result)
+    return record
+
+# this function saves the plot of an episode to a file
+def plot_result(state_lattice, result, filename):
+    slp.plt.switch_backend('Agg')
+    slp.plt.figure()
+    slp.plot_episode(state_lattice, result)
+    slp.plt.savefig(filename, bbox_inches = 'tight')
+    slp.plt.close()
+
+# this function runs scenarios one after another and streams their results
+# to 'out' as JSON Lines - a scenario that fails is reported with its error
+# and the batch goes on
+def run_batch(scenarios, out, base_seed = 0):
+    count = 0
+    for scenario in expand_scenarios(scenarios, base_seed):
+        out.write(json.dumps(safe_run_scenario(scenario)) + '\n')
+        out.flush()
+        count += 1
+    return count
+
+def safe_run_scenario(scenario, state_lattice = None):
+    try:
+        return run_scenario(scenario, state_lattice)
+    except Exception as err:
+        return {'id' : scenario.get('id'), 'error' : '{}: {}'.format(type(err).__name__, err)}
+
+# the maps a worker process has attached to, by shared memory block name
+attached_maps = {}
+
+# this function returns the read-only lattice behind a shared map handle
+# (name, shape, dtype), attaching to the block the first time it is seen
+def attach_map(handle):
+    name, shape, dtype = handle
+    if name not in attached_maps:
+        if len(attached_maps) >= 8: # let go of maps from earlier chunks
+            old = next(iter(attached_maps))
+            attached_maps.pop(old)[0].close()
+        # the parent owns the block and unlinks it - pool workers share the
+        # parent's resource tracker, so attaching here registers nothing new
+        block = shared_memory.SharedMemory(name = name)
+        state_lattice = np.ndarray(shape, dtype = dtype, buffer = block.buf)
+        state_lattice.flags.writeable = False
+        attached_maps[name] = (block, state_lattice)
+    return attached_maps[name][1]
+
+# this function runs in a worker - one chunk of (scenario, map handle) tasks
+def run_chunk(tasks):
+    return [safe_run_scenario(scenario, attach_map(handle) if handle is not None else None)
+            for scenario, handle in tasks]
+
+# this class keeps the maps of a parallel batch in shared memory - a map is
+# generated once per distinct map spec and freed when no queued or running
+# task uses it any more
+class Shared_Maps:
+    def __init__(self):
+        self.blocks = {} # map key -> [shared memory block, handle, tasks using it]
+
+    def acquire(self, spec):
+        if spec.get('type') == 'file': # workers map the file themselves
+            return None, None
+        key = json.dumps(spec, sort_keys = True)
+        if key not in self.blocks:
+            state_lattice = np.ascontiguousarray(build_map(spec))
+            block = shared_memory.SharedMemory(create = True, size = max(1, state_lattice.nbytes))
+            np.ndarray(state_lattice.shape, dtype = state_lattice.dtype, buffer = block.buf)[...] = state_lattice
+            self.blocks[key] = [block, (block.name, state_lattice.shape, state_lattice.dtype.str), 0]
+        self.blocks[key][2] += 1
+        return key, self.blocks[key][1]
+
+    def release(self, key):
+        self.blocks[key][2] -= 1
+        if self.blocks[key][2] == 0:
+            block = self.blocks.pop(key)[0]
+            block.close()
+            block.unlink()
+
+    def close(self):
+        for key in list(self.blocks):
+            self.blocks[key][2] = 1
+            self.release(key)
+
+# this function is the parallel version of run_batch - episodes go to a
+# ProcessPoolExecutor in chunks of 'chunksize', with at most two chunks per
+# worker in flight so huge scenario streams are never materialized, and the
+# results are streamed to 'out' as the chunks complete
+def run_batch_parallel(scenarios, out, workers, chunksize = 8, base_seed = 0):
+    shared = Shared_Maps()
+    pending = {} # future -> map keys of its tasks
+    count = 0
+    runs = expand_scenarios(scenarios, base_seed)
+    def submit_chunk(executor):
+        tasks = []
+        keys = []
+        for scenario in runs:
+            try:
+                key, handle = shared.acquire(scenario['map'])
+            except Exception:
+                key, handle = None, None # let the worker report the bad map
+            tasks.append((scenario, handle))
+            keys.append(key)
+            if len(tasks) == chunksize:
+                break
+        if tasks:
+            pending[executor.submit(run_chunk, tasks)] = keys
+        return bool(tasks)
+    try:
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            more = True
+            while more or pending:
+                while more and len(pending) < 2 * workers:
+                    more = submit_chunk(executor)
+                if not pending:
+                    break
+                done, _ = wait(list(pending), return_when = FIRST_COMPLETED)
+                for future in done:
+                    for key in pending.pop(future):
+                        if key is not None:
+                            shared.release(key)
+                    for record in future.result():
+                        out.write(json.dumps(record) + '\n')
+                        count += 1
+                out.flush()
+    finally:
+        shared.close()
+    return count
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Run state lattice planning scenarios without prompts.')
+    parser.add_argument('scenarios', help = 'scenario file (.json, .jsonl, .yaml, .yml or .csv)')
+    parser.add_argument('-o', '--output', help = 'JSON Lines results file (default: stdout)')
+    parser.add_argument('--workers', type = int, default = 1, help = 'worker processes (default: 1, no pool)')
+    parser.add_argument('--chunksize', type = int, default = 8, help = 'episodes per task sent to a worker')
+    parser.add_argument('--seed', type = int, default = 0, help = 'base seed for scenarios without a map seed')
+    args = parser.parse_args(argv)
+    out = open(args.output, 'w') if args.output else sys.stdout
+    try:
+        if args.workers > 1:
+            run_batch_parallel(read_scenarios(args.scenarios), out, args.workers, args.chunksize, args.seed)
+        else:
+            run_batch(read_scenarios(args.scenarios), out, args.seed)
+    finally:
+        if args.output:
+            out.close()
+
+if __name__ == '__main__':
+    main()
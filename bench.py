@@ -0,0 +1,370 @@
+import argparse
+import atexit
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import slp
+
+# benchmark suite - times the pieces of the planner over a sweep of map sizes,
+# obstacle densities and vision ranges, all on seeded maps, and writes the
+# results as JSON so two revisions can be compared
+#
+#   python bench.py -o before.json
+#   python bench.py -o after.json --baseline before.json --threshold 0.25
+#   python bench.py --compare before.json after.json
+#   python bench.py --quick
+#
+# benchmarks:
+#   build_state_lattice  the original per-cell random lattice
+#   generate_lattice     the vectorized generate_state_lattice
+#   state_graph          build_state_graph + assign_edges (the original dict graph)
+#   csr_graph            build_csr_state_graph
+#   graph_snapshot       loading a saved CSR graph snapshot, with the map check
+#   update_knowledge     one sensing step from the middle of the map
+#   update_knowledge_dict the same step on a plain dict graph, as in the baseline
+#   astar_search         one corner to corner plan with full knowledge of the map
+#   bidirectional_search the same plan with bidirectional_astar_search
+#   episode              a whole sense-plan-act run like main (slp.run_episode)
+#   fleet                --agents agents run in lockstep to two docks on one
+#                        map with shared knowledge (slp.run_fleet)
+#
+# every case reports the best and median wall time over --repeat runs (very
+# fast cases are looped and timed per call), the peak traced memory of one
+# extra run (tracemalloc, which also sees numpy buffers) and, for searches,
+# nodes expanded and expansions per second
+# with --baseline (or --compare) a case whose best time grew by more than
+# --threshold (a fraction) over the matching case is reported as a regression
+# and the exit status is 1
+
+# which of size, density and vision each benchmark depends on
+sweeps = {'build_state_lattice' : ('size', 'density'),
+          'generate_lattice' : ('size', 'density'),
+          'state_graph' : ('size',),
+          'csr_graph' : ('size',),
+          'graph_snapshot' : ('size',),
+          'update_knowledge' : ('size', 'density', 'vision'),
+          'update_knowledge_dict' : ('size', 'density', 'vision'),
+          'astar_search' : ('size', 'density'),
+          'bidirectional_search' : ('size', 'density'),
+          'episode' : ('size', 'density', 'vision'),
+          'fleet' : ('size', 'density', 'vision', 'agents')}
+
+# the largest map side each benchmark is run at by default - the original
+# lattice and dict graph builders, searches and full episodes take minutes
+# (and the dict graph gigabytes) at 1000x1000; raise these with --max-size name=side
+default_max_size = {'build_state_lattice' : 250,
+                    'state_graph' : 250,
+                    'update_knowledge_dict' : 250,
+                    'astar_search' : 250,
+                    'bidirectional_search' : 250,
+                    'episode' : 100,
+                    'fleet' : 50}
+
+# cases faster than this are run in a loop and timed per call
+min_timing = 0.01
+
+default_sizes = [10, 50, 100, 250, 500, 1000]
+default_densities = [0.1, 0.2, 0.3]
+default_visions = [1, 3]
+default_agents = [1, 10, 25]
+
+# this function returns the seeded map used by every benchmark of a case, with
+# the corner start and goal cells open
+def bench_lattice(size, density, seed):
+    state_lattice = slp.generate_state_lattice(size, size, [1 - density, density], seed = seed)
+    state_lattice[0, 0] = 0
+    state_lattice[size - 1, size - 1] = 0
+    return state_lattice
+
+# the functions below set up one benchmark case - each returns a function
+# that does the timed work once, on fresh state, and returns the number of
+# nodes expanded (or None when the benchmark does not search)
+
+def setup_build_state_lattice(size, density, vision, seed, agents):
+    def run():
+        np.random.seed(seed)
+        slp.build_state_lattice(size, size, [1 - density, density])
+    return run
+
+def setup_generate_lattice(size, density, vision, seed, agents):
+    def run():
+        slp.generate_state_lattice(size, size, [1 - density, density], seed = seed)
+    return run
+
+def setup_state_graph(size, density, vision, seed, agents):
+    state_lattice = bench_lattice(size, density, seed).tolist()
+    def run():
+        slp.assign_edges(state_lattice, slp.build_state_graph(state_lattice))
+    return run
+
+def setup_csr_graph(size, density, vision, seed, agents):
+    state_lattice = bench_lattice(size, density, seed)
+    def run():
+        slp.build_csr_state_graph(state_lattice)
+    return run
+
+def setup_graph_snapshot(size, density, vision, seed, agents):
+    state_lattice = bench_lattice(size, density, seed)
+    handle, filename = tempfile.mkstemp(suffix = '.slpg')
+    os.close(handle)
+    atexit.register(os.remove, filename)
+    slp.save_graph_snapshot(slp.build_csr_state_graph(state_lattice), state_lattice, filename)
+    def run():
+        slp.load_graph_snapshot(filename, state_lattice)
+    return run
+
+def setup_update_knowledge(size, density, vision, seed, agents):
+    state_lattice = bench_lattice(size, density, seed)
+    base_graph = slp.shared_base_graph(size, size)
+    state = slp.encode_state((size // 2, size // 2, slp.n, slp.c), size)
+    def run():
+        slp.update_knowledge(state, slp.Knowledge_Overlay(base_graph), state_lattice, vision)
+    return run
+
+# the original update_knowledge removes cells from the dict graph in place,
+# so the nodes and edges one step removes are saved once and put back after
+# every run - cheap next to extract_node, which scans the whole graph per cell
+def setup_update_knowledge_dict(size, density, vision, seed, agents):
+    state_lattice = bench_lattice(size, density, seed)
+    # a plain dict, so extract_node takes the baseline path rather than Indexed_State_Graph's
+    state_graph = dict(slp.assign_edges(state_lattice.tolist(), slp.build_state_graph(state_lattice.tolist())))
+    state = (size // 2, size // 2, slp.n, slp.c)
+    cells = set(slp.update_knowledge(state, slp.Knowledge_Overlay(slp.shared_base_graph(size, size)), state_lattice, vision, return_blocked = True)[1])
+    nodes = {node : dict(edges) for node, edges in state_graph.items() if (node[0], node[1]) in cells}
+    edges_in = [(node, nb, cost) for node, edges in state_graph.items() if (node[0], node[1]) not in cells
+                for nb, cost in edges.items() if (nb[0], nb[1]) in cells]
+    lattice_rows = state_lattice.tolist()
+    def run():
+        slp.update_knowledge(state, state_graph, lattice_rows, vision)
+        for node, edges in nodes.items():
+            state_graph[node] = dict(edges)
+        for (node, nb, cost) in edges_in:
+            state_graph[node][nb] = cost
+    return run
+
+# the corner to corner search problem on a fully known map
+def search_problem(size, density, seed):
+    state_lattice = bench_lattice(size, density, seed)
+    known = slp.Knowledge_Overlay(slp.shared_base_graph(size, size))
+    known.remove_cells(np.argwhere(state_lattice == 1))
+    start = slp.encode_state((0, 0, slp.s, slp.c), size)
+    goal = slp.encode_state((size - 1, size - 1, slp.s, slp.c), size)
+    heuristic = slp.Packed_Heuristic(slp.euclidean_distance, size)
+    return state_lattice, known, start, goal, heuristic
+
+def setup_astar_search(size, density, vision, seed, agents):
+    state_lattice, known, start, goal, heuristic = search_problem(size, density, seed)
+    def run():
+        frontier_stats = {}
+        result = slp.astar_search(start, goal, known, state_lattice, heuristic, return_nexp = True, frontier_stats = frontier_stats)
+        if result is None: # no path, every pop was an expansion attempt
+            return frontier_stats['pops']
+        return result[1]
+    return run
+
+def setup_bidirectional_search(size, density, vision, seed, agents):
+    state_lattice, known, start, goal, heuristic = search_problem(size, density, seed)
+    def run():
+        result = slp.bidirectional_astar_search(start, goal, known, state_lattice, heuristic, return_nexp = True)
+        return result[1] if result is not None else None
+    return run
+
+def setup_episode(size, density, vision, seed, agents):
+    state_lattice = bench_lattice(size, density, seed)
+    start = (0, 0, slp.s, slp.c)
+    goal = (size - 1, size - 1, slp.s, slp.c)
+    def run():
+        return slp.run_episode(state_lattice, start, goal, vision)['nodes_expanded']
+    return run
+
+# agents start on random open cells and head for one of the two far corners
+def setup_fleet(size, density, vision, seed, agents):
+    state_lattice = bench_lattice(size, density, seed)
+    state_lattice[0, size - 1] = 0
+    rng = np.random.default_rng(seed)
+    cells = np.argwhere(state_lattice == 0)
+    starts = cells[rng.integers(len(cells), size = agents)]
+    docks = [(size - 1, size - 1, slp.s, slp.c), (0, size - 1, slp.e, slp.c)]
+    fleet = [((int(x), int(y), slp.s, slp.c), docks[k % 2]) for k, (x, y) in enumerate(starts)]
+    def run():
+        return slp.run_fleet(state_lattice, fleet, vision)['nodes_expanded']
+    return run
+
+benchmarks = {'build_state_lattice' : setup_build_state_lattice,
+              'generate_lattice' : setup_generate_lattice,
+              'state_graph' : setup_state_graph,
+              'csr_graph' : setup_csr_graph,
+              'graph_snapshot' : setup_graph_snapshot,
+              'update_knowledge' : setup_update_knowledge,
+              'update_knowledge_dict' : setup_update_knowledge_dict,
+              'astar_search' : setup_astar_search,
+              'bidirectional_search' : setup_bidirectional_search,
+              'episode' : setup_episode,
+              'fleet' : setup_fleet}
+
+# this function times one case and returns its result record
+def measure(name, size, density, vision, seed, repeat, agents = 1):
+    run = benchmarks[name](size, density, vision, seed, agents)
+    started = time.perf_counter()
+    expansions = run()
+    number = 1
+    elapsed = time.perf_counter() - started
+    if elapsed < min_timing:
+        number = int(min_timing / max(elapsed, 1e-7)) + 1
+    times = []
+    for i in range(repeat):
+        started = time.perf_counter()
+        for j in range(number):
+            run()
+        times.append((time.perf_counter() - started) / number)
+    tracemalloc.start()
+    try:
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    record = {'bench' : name, 'size' : size, 'seed' : seed,
+              'time' : min(times), 'time_median' : float(np.median(times)),
+              'repeat' : repeat, 'number' : number, 'peak_memory' : peak_memory}
+    if 'density' in sweeps[name]:
+        record['density'] = density
+    if 'vision' in sweeps[name]:
+        record['vision'] = vision
+    if 'agents' in sweeps[name]:
+        record['agents'] = agents
+    if expansions is not None:
+        record['expansions'] = expansions
+        record['expansions_per_sec'] = expansions / min(times) if min(times) > 0 else None
+    return record
+
+# this function yields every (name, size, density, vision, agents) case of a
+# sweep, without repeating cases for parameters a benchmark does not depend on
+def bench_cases(names, sizes, densities, visions, max_size, agent_counts = (1,)):
+    for name in names:
+        limit = max_size.get(name)
+        for size in sizes:
+            if limit is not None and size > limit:
+                continue
+            for density in (densities if 'density' in sweeps[name] else densities[:1]):
+                for vision in (visions if 'vision' in sweeps[name] else visions[:1]):
+                    for agents in (agent_counts if 'agents' in sweeps[name] else agent_counts[:1]):
+                        yield (name, size, density, vision, agents)
+
+# this function returns the key that matches a case between two result files
+def case_key(record):
+    return (record['bench'], record['size'], record.get('density'), record.get('vision'), record.get('agents'), record['seed'])
+
+# this function compares two result sets and returns a list of
+# (record, baseline record, ratio) for every case slower than the threshold
+def find_regressions(baseline, results, threshold):
+    old = {case_key(record) : record for record in baseline['results']}
+    regressions = []
+    for record in results['results']:
+        before = old.get(case_key(record))
+        if before is None or before['time'] <= 0:
+            continue
+        ratio = record['time'] / before['time']
+        if ratio > 1 + threshold:
+            regressions.append((record, before, ratio))
+    return regressions
+
+# this function prints the regressions and returns the exit status
+def report_regressions(regressions, threshold):
+    for record, before, ratio in regressions:
+        print('REGRESSION {} size={} density={} vision={} agents={}: {:.4g}s -> {:.4g}s ({:+.0%})'.format(
+            record['bench'], record['size'], record.get('density'), record.get('vision'), record.get('agents'),
+            before['time'], record['time'], ratio - 1))
+    if regressions:
+        print('{} case(s) slower than the {:.0%} threshold'.format(len(regressions), threshold))
+        return 1
+    return 0
+
+# this function describes the machine and revision the results came from
+def environment():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True).stdout.strip()
+    except OSError:
+        revision = ''
+    return {'revision' : revision or None,
+            'python' : platform.python_version(),
+            'numpy' : np.__version__,
+            'platform' : platform.platform(),
+            'timestamp' : time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def parse_list(text, kind):
+    return [kind(value) for value in text.split(',') if value]
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the state lattice planner.')
+    parser.add_argument('-o', '--output', help = 'JSON results file')
+    parser.add_argument('--bench', default = ','.join(benchmarks), help = 'comma separated benchmarks to run')
+    parser.add_argument('--sizes', default = ','.join(map(str, default_sizes)), help = 'map sides, e.g. 10,100,1000')
+    parser.add_argument('--densities', default = ','.join(map(str, default_densities)), help = 'obstacle densities')
+    parser.add_argument('--visions', default = ','.join(map(str, default_visions)), help = 'vision ranges')
+    parser.add_argument('--agents', default = ','.join(map(str, default_agents)), help = 'fleet sizes for the fleet benchmark')
+    parser.add_argument('--seed', type = int, default = 0, help = 'map seed')
+    parser.add_argument('--repeat', type = int, default = 3, help = 'timed runs per case (the best is reported)')
+    parser.add_argument('--max-size', action = 'append', default = [], metavar = 'NAME=SIDE',
+                        help = 'largest map side for a benchmark (0 for no limit)')
+    parser.add_argument('--quick', action = 'store_true', help = 'small sweep for a smoke test')
+    parser.add_argument('--baseline', help = 'results file to check the new results against')
+    parser.add_argument('--compare', nargs = 2, metavar = ('OLD', 'NEW'), help = 'only compare two results files')
+    parser.add_argument('--threshold', type = float, default = 0.2, help = 'allowed slowdown before a case fails (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            results = json.load(f)
+        return report_regressions(find_regressions(baseline, results, args.threshold), args.threshold)
+
+    names = parse_list(args.bench, str)
+    for name in names:
+        if name not in benchmarks:
+            parser.error('unknown benchmark {}'.format(name))
+    sizes = parse_list(args.sizes, int)
+    densities = parse_list(args.densities, float)
+    visions = parse_list(args.visions, int)
+    agent_counts = parse_list(args.agents, int)
+    if args.quick:
+        sizes, densities, visions, agent_counts = [10, 50], densities[:1], visions[:1], agent_counts[:2]
+    max_size = dict(default_max_size)
+    for text in args.max_size:
+        name, side = text.split('=')
+        max_size[name] = int(side) or None
+
+    results = {'environment' : environment(),
+               'settings' : {'sizes' : sizes, 'densities' : densities, 'visions' : visions,
+                             'agents' : agent_counts, 'seed' : args.seed, 'repeat' : args.repeat},
+               'results' : []}
+    for name, size, density, vision, agents in bench_cases(names, sizes, densities, visions, max_size, agent_counts):
+        record = measure(name, size, density, vision, args.seed, args.repeat, agents)
+        results['results'].append(record)
+        line = '{:<20} size={:<5} density={:<5} vision={:<3} {:>10.4g}s {:>10.1f} KiB'.format(
+            name, size, record.get('density', '-'), record.get('vision', '-'), record['time'], record['peak_memory'] / 1024)
+        if 'agents' in record:
+            line += ' {:>5} agents'.format(record['agents'])
+        if record.get('expansions_per_sec'):
+            line += ' {:>10.0f} exp/s'.format(record['expansions_per_sec'])
+        print(line, flush = True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent = 1)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        return report_regressions(find_regressions(baseline, results, args.threshold), args.threshold)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,7 +1,17 @@
 import numpy as np
 import heapq
 import sys
+import time
+import contextlib
+import hashlib
+import json
+import os
+import struct
+import tempfile
 from scipy.spatial import distance
+from scipy import ndimage
+from scipy import sparse
+from scipy.sparse import csgraph
 import matplotlib.pylab as plt
 
 # agent wheel direction
@@ -51,9 +61,259 @@ def build_state_lattice(nrows, ncols, prob):
 
     return state_lattice
 
+# the functions below are the vectorized alternative to build_state_lattice
+# for big maps and reproducible benchmarks - each one makes the whole
+# occupancy grid in a few array operations from a seeded np.random.Generator
+# (seed can be an int, a Generator or None) and returns a compact uint8
+# ndarray, with the same 0 = open / 1 = blocked convention, that the rest of
+# the module accepts anywhere a list of lists lattice is used
+
+# uniform random obstacles, prob = [p open, p blocked] like build_state_lattice
+def generate_state_lattice(nrows, ncols, prob, seed = None):
+    rng = np.random.default_rng(seed)
+    return (rng.random((nrows, ncols)) < prob[1]).astype(np.uint8)
+
+# clustered obstacles - smoothed noise thresholded so that about 'density' of
+# the cells are blocked, in blobs roughly cluster_size cells across
+def generate_clustered_lattice(nrows, ncols, density, cluster_size = 5, seed = None):
+    rng = np.random.default_rng(seed)
+    noise = ndimage.uniform_filter(rng.random((nrows, ncols)), size = cluster_size, mode = 'wrap')
+    return (noise > np.quantile(noise, 1 - density)).astype(np.uint8)
+
+# corridors - a blocked map with ncorridors straight corridors of the given
+# width carved in each direction, so every horizontal corridor crosses every
+# vertical one
+def generate_corridor_lattice(nrows, ncols, ncorridors = 4, width = 1, seed = None):
+    rng = np.random.default_rng(seed)
+    state_lattice = np.ones((nrows, ncols), dtype = np.uint8)
+    for x in rng.integers(0, max(1, nrows - width + 1), size = ncorridors):
+        state_lattice[x:x + width, :] = 0
+    for y in rng.integers(0, max(1, ncols - width + 1), size = ncorridors):
+        state_lattice[:, y:y + width] = 0
+    return state_lattice
+
+# rooms - an open map split by walls every room_size cells, with one door of
+# door_width cells at a random spot in every wall segment between two rooms
+def generate_rooms_lattice(nrows, ncols, room_size = 10, door_width = 2, seed = None):
+    rng = np.random.default_rng(seed)
+    state_lattice = np.zeros((nrows, ncols), dtype = np.uint8)
+    wall_rows = np.arange(room_size, nrows, room_size)
+    wall_cols = np.arange(room_size, ncols, room_size)
+    state_lattice[wall_rows, :] = 1
+    state_lattice[:, wall_cols] = 1
+    span = max(1, room_size - door_width)
+    # doors in the horizontal walls, one per (wall row, room column)
+    room_starts = np.arange(0, ncols, room_size)
+    if len(wall_rows):
+        offsets = rng.integers(1, span, size = (len(wall_rows), len(room_starts))) if span > 1 else np.zeros((len(wall_rows), len(room_starts)), dtype = int)
+        for k in range(door_width):
+            cols = np.minimum(room_starts[None, :] + offsets + k, ncols - 1)
+            state_lattice[np.repeat(wall_rows, len(room_starts)), cols.ravel()] = 0
+    # doors in the vertical walls, one per (room row, wall column)
+    room_starts = np.arange(0, nrows, room_size)
+    if len(wall_cols):
+        offsets = rng.integers(1, span, size = (len(room_starts), len(wall_cols))) if span > 1 else np.zeros((len(room_starts), len(wall_cols)), dtype = int)
+        for k in range(door_width):
+            rows = np.minimum(room_starts[:, None] + offsets + k, nrows - 1)
+            state_lattice[rows.ravel(), np.tile(wall_cols, len(room_starts))] = 0
+    return state_lattice
+
+# the functions below read and write occupancy grids on disk as lattices with
+# the usual 0 = open / 1 = blocked cells - .npy files, PGM images (binary P5
+# or ASCII P2), PNG images (needs Pillow) and raw binary files
+# .npy, binary PGM and raw files are memory-mapped, so opening even a
+# 10k x 10k map reads nothing up front and the planner only pages in the
+# parts of the map that it senses and searches
+# grids that are not already 0/1 (images, or other dtypes) are thresholded
+# once, in row blocks, into a 0/1 .npy file in occupancy_cache_dir (a
+# directory under the system temp dir unless set otherwise, never the map's
+# own directory, which may be read only) that later loads map directly for as
+# long as it is newer than the source
+# in images dark pixels are obstacles (value < threshold, half the maximum
+# by default), in other grids high values are (value >= threshold, 0.5 by
+# default, e.g. occupancy probabilities, and 128 for uint8 grids such as
+# 0/255 masks) - bool grids and uint8 grids that only hold 0 and 1 are taken
+# as they are unless a threshold is given (for a memory-mapped uint8 map that
+# takes one scan, on the first open only, see is_binary_grid)
+occupancy_cache_dir = None
+
+# this function reads the header of a PGM file and returns
+# (magic, width, height, maxval, offset of the pixel data)
+# the header is read a byte at a time, since it may share its line with the
+# pixel data ('P5 20 30 255 <pixels>'), and ends with the single whitespace
+# byte after maxval
+def read_pgm_header(f):
+    magic = f.read(2)
+    if magic not in (b'P5', b'P2'):
+        raise ValueError('not a PGM file')
+    fields = []
+    token = b''
+    while len(fields) < 3:
+        byte = f.read(1)
+        if not byte:
+            raise ValueError('truncated PGM header')
+        if byte == b'#' and not token: # comment, to the end of the line
+            while byte not in (b'\n', b'\r', b''):
+                byte = f.read(1)
+        elif byte.isspace():
+            if token:
+                fields.append(token)
+                token = b''
+        else:
+            token += byte
+    return (magic, int(fields[0]), int(fields[1]), int(fields[2]), f.tell())
+
+# this function returns the path of a file cached for a map file in
+# occupancy_cache_dir, told apart by the map's absolute path and 'suffix'
+def occupancy_cache_file(filename, suffix):
+    cache_dir = occupancy_cache_dir or os.path.join(tempfile.gettempdir(), 'slp-occupancy')
+    os.makedirs(cache_dir, exist_ok = True)
+    source = os.path.abspath(filename)
+    return os.path.join(cache_dir, '{}-{}.{}'.format(os.path.basename(source),
+                        hashlib.sha256(source.encode()).hexdigest()[:16], suffix))
+
+# this function tells whether a cached file is newer than its map
+def cache_is_fresh(cache, filename):
+    return os.path.exists(cache) and os.path.getmtime(cache) >= os.path.getmtime(filename)
+
+# this function tells whether a memory-mapped uint8 grid only holds 0 and 1 -
+# found by a scan in row blocks that stops at the first other value, once,
+# and remembered by an empty marker file (a grid that is not 0/1 leaves its
+# thresholded copy behind instead, which tells the same on the next open)
+def is_binary_grid(grid, filename):
+    marker = occupancy_cache_file(filename, 'binary')
+    if cache_is_fresh(marker, filename):
+        return True
+    if cache_is_fresh(occupancy_cache_file(filename, 'occ128.npy'), filename):
+        return False
+    step = max(1, 2**24 // max(1, grid.shape[1]))
+    for row in range(0, grid.shape[0], step):
+        if grid[row:row + step].max(initial = 0) > 1:
+            return False
+    open(marker, 'wb').close()
+    return True
+
+# this function turns a grid into a 0/1 lattice, through the cached file for
+# memory-mapped grids
+def occupancy(grid, filename, threshold, dark_blocked = False):
+    if threshold is None and grid.dtype == np.bool_:
+        return grid
+    if threshold is None and grid.dtype == np.uint8:
+        if is_binary_grid(grid, filename) if isinstance(grid, np.memmap) else grid.max(initial = 0) <= 1:
+            return grid
+        threshold = 128
+    if threshold is None:
+        threshold = 0.5
+    def blocked(rows):
+        return ((rows < threshold) if dark_blocked else (rows >= threshold)).astype(np.uint8)
+    if not isinstance(grid, np.memmap):
+        return blocked(grid)
+    cache = occupancy_cache_file(filename, 'occ{}.npy'.format(threshold))
+    if not cache_is_fresh(cache, filename):
+        partial = '{}.{}.tmp'.format(cache, os.getpid()) # batch workers may build the same cache at once
+        out = np.lib.format.open_memmap(partial, mode = 'w+', dtype = np.uint8, shape = grid.shape)
+        step = max(1, 2**24 // max(1, grid.shape[1]))
+        for row in range(0, grid.shape[0], step):
+            out[row:row + step] = blocked(grid[row:row + step])
+        out.flush()
+        del out
+        os.replace(partial, cache)
+    return np.load(cache, mmap_mode = 'r')
+
+# this function opens a map file as a lattice (see above) - raw files need
+# shape = (rows, cols) and optionally dtype and a header offset in bytes
+# with mmap = False the whole map is read into memory instead
+def load_lattice(filename, shape = None, dtype = 'uint8', offset = 0, threshold = None, mmap = True):
+    lower = filename.lower()
+    if lower.endswith('.npy'):
+        return occupancy(np.load(filename, mmap_mode = 'r' if mmap else None), filename, threshold)
+    if lower.endswith(('.pgm', '.pnm')):
+        with open(filename, 'rb') as f:
+            magic, width, height, maxval, start = read_pgm_header(f)
+            if magic == b'P2' or not mmap:
+                data = f.read()
+        if threshold is None:
+            threshold = (maxval + 1) / 2
+        pixel = np.uint8 if maxval < 256 else np.dtype('>u2')
+        if magic == b'P2':
+            grid = np.array(data.split(), dtype = np.int64).reshape(height, width)
+        elif mmap:
+            grid = np.memmap(filename, dtype = pixel, mode = 'r', offset = start, shape = (height, width))
+        else:
+            grid = np.frombuffer(data, dtype = pixel, count = height * width).reshape(height, width)
+        return occupancy(grid, filename, threshold, dark_blocked = True)
+    if lower.endswith('.png'):
+        from PIL import Image # optional, only needed for PNG maps (which are compressed, so read whole)
+        image = Image.open(filename)
+        maxval = 65535 if image.mode.startswith('I') else 255
+        grid = np.asarray(image.convert('L') if maxval == 255 else image)
+        return occupancy(grid, filename, (maxval + 1) / 2 if threshold is None else threshold, dark_blocked = True)
+    if shape is None:
+        raise ValueError('raw map files need shape = (rows, cols)')
+    if mmap:
+        grid = np.memmap(filename, dtype = dtype, mode = 'r', offset = offset, shape = tuple(shape))
+    else:
+        grid = np.fromfile(filename, dtype = dtype, count = shape[0] * shape[1], offset = offset).reshape(shape)
+    return occupancy(grid, filename, threshold)
+
+# this function writes a lattice to a map file - .npy, .pgm (open cells
+# white, blocked cells black), .png (needs Pillow) or raw uint8 0/1 bytes
+def save_lattice(state_lattice, filename):
+    grid = np.asarray(state_lattice, dtype = np.uint8)
+    lower = filename.lower()
+    if lower.endswith('.npy'):
+        np.save(filename, grid)
+    elif lower.endswith(('.pgm', '.pnm')):
+        with open(filename, 'wb') as f:
+            f.write('P5\n{} {}\n255\n'.format(grid.shape[1], grid.shape[0]).encode())
+            f.write(((1 - grid) * 255).astype(np.uint8).tobytes())
+    elif lower.endswith('.png'):
+        from PIL import Image # optional, only needed for PNG maps
+        Image.fromarray(((1 - grid) * 255).astype(np.uint8)).save(filename)
+    else:
+        grid.tofile(filename)
+
+# this class is the dict-of-dicts state graph plus two indexes that make
+# blocking a cell cheap: 'cells' maps an (x,y) position to the nodes at it and
+# 'predecessors' maps a node to the set of nodes with an edge into it
+# the indexes are built on first use, after assign_edges has filled in the
+# edges, so the graph should not be edited by hand once a cell was removed
+class Indexed_State_Graph(dict):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.cells = None
+        self.predecessors = None
+
+    def build_index(self):
+        self.cells = {}
+        self.predecessors = {node : set() for node in self}
+        for node in self:
+            self.cells.setdefault((node[0], node[1]), []).append(node)
+            for neighbor in self[node]:
+                self.predecessors.setdefault(neighbor, set()).add(node)
+
+    # equivalent of the full scans in extract_node, but it only touches the
+    # edges into and out of the states at (x,y)
+    def remove_cell(self, x, y):
+        if self.cells is None:
+            self.build_index()
+        for node in self.cells.pop((x, y), []):
+            for neighbor in self[node]:
+                if neighbor in self.predecessors:
+                    self.predecessors[neighbor].discard(node)
+            for pred in self.predecessors.pop(node, ()):
+                if pred in self:
+                    self[pred].pop(node, None)
+            del self[node]
+
+    def get_predecessors(self, state):
+        if self.predecessors is None:
+            self.build_index()
+        return {pred : self[pred][state] for pred in self.predecessors.get(state, ())}
+
 # this function initializes ONLY the nodes in the state graph
 def build_state_graph(state_lattice):
-    state_graph = {}
+    state_graph = Indexed_State_Graph()
     # create all nodes
     for x in range(len(state_lattice[0])):
         for y in range(len(state_lattice)):
@@ -558,9 +818,18 @@ def assign_edges(state_lattice, state_graph):
                 state_graph[node][(node[0]-1, node[1]-1, s, l)] = 1
     return state_graph
 
+# this function checks whether the states at (x,y) are still in a state graph,
+# i.e. whether the cell is not (yet) known to be blocked
+def cell_in_graph(state_graph, x, y):
+    return (x, y, heading[0], angle[0]) in state_graph
+
 # this function is a helper functin to update_knowledge
 # it breaks all ties (neighbors) with nodes that are blocked
 def extract_node(x, y, state_graph):
+    # indexed, array-backed and implicit graphs know how to drop a cell themselves
+    if hasattr(state_graph, 'remove_cell'):
+        state_graph.remove_cell(x, y)
+        return state_graph
     # remove nodes with position (x,y)
     to_delete = []
     for node in state_graph:
@@ -579,45 +848,694 @@ def extract_node(x, y, state_graph):
         del state_graph[node][neighbor]
     return state_graph
 
+# motion primitives of the lattice - these are exactly the moves that
+# assign_edges spells out for a node in the middle of the state space, keyed by
+# (heading, wheel angle) with entries (dx, dy, new heading, new wheel angle, cost)
+# near the borders assign_edges simply drops the moves that leave the lattice
+motion_primitives = {
+    (n,c): [(0,0,n,c,0), (0,0,n,l,1), (0,0,n,r,1), (-1,0,n,c,1), (1,0,n,c,1)],
+    (n,l): [(0,0,n,l,0), (0,0,n,c,1), (-1,-1,w,l,1), (1,-1,e,l,1)],
+    (n,r): [(0,0,n,r,0), (0,0,n,c,1), (-1,1,e,r,1), (1,1,w,r,1)],
+    (s,c): [(0,0,s,c,0), (0,0,s,l,1), (0,0,s,r,1), (1,0,s,c,1), (-1,0,s,c,1)],
+    (s,l): [(0,0,s,l,0), (0,0,s,c,1), (1,1,e,l,1), (-1,1,w,l,1)],
+    (s,r): [(0,0,s,r,0), (0,0,s,c,1), (1,-1,w,r,1), (-1,-1,e,r,1)],
+    (e,c): [(0,0,e,c,0), (0,0,e,l,1), (0,0,e,r,1), (0,1,e,c,1), (0,-1,e,c,1)],
+    (e,l): [(0,0,e,l,0), (0,0,e,c,1), (-1,1,n,l,1), (-1,-1,s,l,1)],
+    (e,r): [(0,0,e,r,0), (0,0,e,c,1), (1,1,s,r,1), (1,-1,n,r,1)],
+    (w,c): [(0,0,w,c,0), (0,0,w,l,1), (0,0,w,r,1), (0,-1,w,c,1), (0,1,w,c,1)],
+    (w,l): [(0,0,w,l,0), (0,0,w,c,1), (1,-1,s,l,1), (1,1,n,l,1)],
+    (w,r): [(0,0,w,r,0), (0,0,w,c,1), (-1,-1,n,r,1), (-1,1,s,r,1)],
+}
+heading_index = {h : i for i, h in enumerate(heading)}
+angle_index = {a : i for i, a in enumerate(angle)}
+states_per_cell = len(heading) * len(angle)
+# the same primitives seen from the arrival side - keyed by the (heading, wheel
+# angle) a move ends in, with entries (dx, dy, heading, wheel angle, cost)
+# pointing back at the state the move starts from
+reverse_motion_primitives = {key : [] for key in motion_primitives}
+for (h, a), prims in motion_primitives.items():
+    for (dx, dy, h2, a2, cost) in prims:
+        reverse_motion_primitives[(h2, a2)].append((-dx, -dy, h, a, cost))
+
+# packed integer states - a state (x, y, heading, wheel angle) is encoded as
+# the single int ((x*ncols + y)*4 + heading index)*3 + wheel angle index, so
+# hashing and comparing states in the search is int work instead of tuple and
+# string work, and the 12 states of a cell are contiguous ids
+# the tuple form is only needed at the edges (input, printing, plotting)
+def encode_state(state, ncols):
+    return ((state[0] * ncols + state[1]) * len(heading) + heading_index[state[2]]) * len(angle) + angle_index[state[3]]
+
+def decode_state(sid, ncols):
+    cell, group = divmod(int(sid), states_per_cell)
+    x, y = divmod(cell, ncols)
+    return (x, y, heading[group // len(angle)], angle[group % len(angle)])
+
+# this function returns the (x,y) cell of a packed state
+def state_cell(sid, ncols):
+    return divmod(int(sid) // states_per_cell, ncols)
+
+# this function tells packed states apart from tuple / State states
+def is_packed(state):
+    return isinstance(state, (int, np.integer))
+
+# this class is a readable state for APIs - it behaves like the
+# (x, y, heading, wheel angle) tuple (indexing, equality, hashing) and
+# converts to and from the packed int form
+class State:
+    __slots__ = ('x', 'y', 'heading', 'angle')
+
+    def __init__(self, x, y, heading, angle):
+        self.x = x
+        self.y = y
+        self.heading = heading
+        self.angle = angle
+
+    @classmethod
+    def from_tuple(cls, state):
+        return cls(*state)
+
+    @classmethod
+    def decode(cls, sid, ncols):
+        return cls(*decode_state(sid, ncols))
+
+    def encode(self, ncols):
+        return encode_state(self, ncols)
+
+    def as_tuple(self):
+        return (self.x, self.y, self.heading, self.angle)
+
+    def __getitem__(self, i):
+        return self.as_tuple()[i]
+
+    def __iter__(self):
+        return iter(self.as_tuple())
+
+    def __len__(self):
+        return 4
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other) if isinstance(other, (State, tuple)) else NotImplemented
+
+    def __hash__(self):
+        return hash(self.as_tuple())
+
+    def __repr__(self):
+        return 'State({}, {}, {}, {})'.format(self.x, self.y, self.heading, self.angle)
+
+# this class is an array-backed alternative to the dict-of-dicts state graph
+# nodes are integer state ids ((x*ncols + y)*4 + heading)*3 + wheel angle, so
+# the 12 states of a cell are contiguous, and the edges live in three NumPy
+# arrays in compressed sparse row (CSR) form: the neighbors of node i are
+# indices[indptr[i]:indptr[i+1]] with step costs costs[indptr[i]:indptr[i+1]]
+# blocked cells are masked out instead of deleted, and the class answers the
+# same mapping protocol as the dict graph (graph[state][neighbor] = cost) so
+# astar_search, pathcost and update_knowledge work with it unchanged - states
+# may be given as tuples or as packed ints (the node ids themselves), and
+# lookups answer in the same form they were asked in
+class CSR_State_Graph:
+    def __init__(self, nrows, ncols):
+        self.nrows = nrows
+        self.ncols = ncols
+        self.num_nodes = nrows * ncols * states_per_cell
+        id_type = np.int32 if self.num_nodes < 2**31 else np.int64
+        # out-degree of every node is fixed by its (heading, wheel angle) and
+        # by which of its moves stay inside the lattice
+        X, Y = np.meshgrid(np.arange(nrows), np.arange(ncols), indexing = 'ij')
+        X = X.ravel()
+        Y = Y.ravel()
+        cells = np.arange(nrows * ncols, dtype = np.int64)
+        moves = {}
+        degree = np.zeros(self.num_nodes, dtype = np.int64)
+        for (h, a), prims in motion_primitives.items():
+            group = heading_index[h] * len(angle) + angle_index[a]
+            moves[group] = []
+            for (dx, dy, h2, a2, cost) in prims:
+                inside = (X + dx >= 0) & (X + dx < nrows) & (Y + dy >= 0) & (Y + dy < ncols)
+                moves[group].append((inside, dx * ncols + dy, heading_index[h2] * len(angle) + angle_index[a2], cost))
+                degree[cells[inside] * states_per_cell + group] += 1
+        self.indptr = np.zeros(self.num_nodes + 1, dtype = np.int64)
+        np.cumsum(degree, out = self.indptr[1:])
+        self.indices = np.empty(self.indptr[-1], dtype = id_type)
+        self.costs = np.empty(self.indptr[-1], dtype = np.uint8)
+        # fill the edges one primitive at a time, keeping the primitive order
+        # of motion_primitives within each node's row
+        for group, group_moves in moves.items():
+            filled = np.zeros(nrows * ncols, dtype = np.int64)
+            for (inside, offset, group2, cost) in group_moves:
+                src_cells = cells[inside]
+                pos = self.indptr[src_cells * states_per_cell + group] + filled[src_cells]
+                self.indices[pos] = (src_cells + offset) * states_per_cell + group2
+                self.costs[pos] = cost
+                filled[src_cells] += 1
+        # cells the agent knows to be blocked - their nodes are treated as deleted
+        self.blocked = np.zeros(nrows * ncols, dtype = bool)
+        # reverse (predecessor) adjacency, built on first use
+        self.rindptr = None
+        self.rindices = None
+        self.rcosts = None
+
+    def build_reverse_index(self):
+        order = np.argsort(self.indices, kind = 'stable')
+        sources = np.repeat(np.arange(self.num_nodes, dtype = self.indices.dtype), np.diff(self.indptr))
+        self.rindices = sources[order]
+        self.rcosts = self.costs[order]
+        self.rindptr = np.zeros(self.num_nodes + 1, dtype = np.int64)
+        np.cumsum(np.bincount(self.indices, minlength = self.num_nodes), out = self.rindptr[1:])
+
+    # conversions between (x, y, heading, wheel angle) tuples and state ids
+    def state_id(self, state):
+        return encode_state(state, self.ncols)
+
+    def state_of(self, sid):
+        return decode_state(sid, self.ncols)
+
+    def _valid(self, state):
+        if is_packed(state):
+            return 0 <= state < self.num_nodes and not self.blocked[state // states_per_cell]
+        return (0 <= state[0] < self.nrows and 0 <= state[1] < self.ncols
+                and not self.blocked[state[0] * self.ncols + state[1]])
+
+    # (neighbor id, cost) pairs of a node id, skipping blocked neighbors
+    def successor_ids(self, sid):
+        lo, hi = self.indptr[sid], self.indptr[sid + 1]
+        nbrs = self.indices[lo:hi]
+        keep = ~self.blocked[nbrs // states_per_cell]
+        return zip(nbrs[keep].tolist(), self.costs[lo:hi][keep].tolist())
+
+    # (predecessor id, cost) pairs of a node id, skipping blocked predecessors
+    def predecessor_ids(self, sid):
+        if self.rindptr is None:
+            self.build_reverse_index()
+        lo, hi = self.rindptr[sid], self.rindptr[sid + 1]
+        preds = self.rindices[lo:hi]
+        keep = ~self.blocked[preds // states_per_cell]
+        return zip(preds[keep].tolist(), self.rcosts[lo:hi][keep].tolist())
+
+    def get_predecessors(self, state):
+        if state not in self:
+            raise KeyError(state)
+        if is_packed(state):
+            return dict(self.predecessor_ids(state))
+        return {self.state_of(pred) : cost for pred, cost in self.predecessor_ids(self.state_id(state))}
+
+    # mapping protocol, so the object can stand in for the dict-of-dicts graph
+    def __getitem__(self, state):
+        if state not in self:
+            raise KeyError(state)
+        if is_packed(state):
+            return dict(self.successor_ids(state))
+        return {self.state_of(nb) : cost for nb, cost in self.successor_ids(self.state_id(state))}
+
+    def __contains__(self, state):
+        try:
+            return self._valid(state) and (is_packed(state) or (state[2] in heading_index and state[3] in angle_index))
+        except (TypeError, IndexError):
+            return False
+
+    def __iter__(self):
+        for cell in np.flatnonzero(~self.blocked).tolist():
+            for k in range(states_per_cell):
+                yield self.state_of(cell * states_per_cell + k)
+
+    def __len__(self):
+        return int(np.count_nonzero(~self.blocked)) * states_per_cell
+
+    # equivalent of extract_node - drop every state at (x,y) and every edge into it
+    def remove_cell(self, x, y):
+        if 0 <= x < self.nrows and 0 <= y < self.ncols:
+            self.blocked[x * self.ncols + y] = True
+
+    def remove_cells(self, cells):
+        cells = np.asarray(cells, dtype = np.int64).reshape(-1, 2)
+        self.blocked[cells[:, 0] * self.ncols + cells[:, 1]] = True
+
+    def nbytes(self):
+        return self.indptr.nbytes + self.indices.nbytes + self.costs.nbytes + self.blocked.nbytes
+
+# this function builds the CSR equivalent of
+# assign_edges(state_lattice, build_state_graph(state_lattice))
+def build_csr_state_graph(state_lattice):
+    return CSR_State_Graph(len(state_lattice), len(state_lattice[0]))
+
+# graph snapshots - a built CSR_State_Graph saved to a versioned binary file
+# so other processes can start planning on the same map without building it:
+# the file is the magic b'SLPGRAPH', the format version and header length
+# (two little endian uint32), a JSON header (map size, the SHA-256 of the
+# map it was built for, and the dtype, shape and offset of every array) and
+# then the CSR arrays (forward and reverse adjacency, costs, blocked cells),
+# each aligned to 64 bytes so loading just memory-maps them in place
+graph_snapshot_magic = b'SLPGRAPH'
+graph_snapshot_version = 1
+graph_snapshot_arrays = ('indptr', 'indices', 'costs', 'blocked', 'rindptr', 'rindices', 'rcosts')
+
+# this function fingerprints a map (its size and cells) for graph snapshots
+def map_checksum(state_lattice):
+    grid = np.asarray(state_lattice) # a memory-mapped map stays on disk
+    digest = hashlib.sha256('{}x{}'.format(*grid.shape).encode())
+    step = max(1, 2**24 // max(1, grid.shape[1]))
+    for row in range(0, grid.shape[0], step): # in row blocks, for memory-mapped maps
+        digest.update(np.ascontiguousarray(grid[row:row + step] == 1, dtype = np.uint8).tobytes())
+    return digest.hexdigest()
+
+# this function converts a dict-of-dicts graph (build_state_graph and
+# assign_edges, tuple states) to a CSR_State_Graph with the same edges -
+# cells with no states left in the graph (extract_node) become blocked
+def csr_from_state_graph(state_graph, nrows, ncols):
+    graph = CSR_State_Graph.__new__(CSR_State_Graph)
+    graph.nrows = nrows
+    graph.ncols = ncols
+    graph.num_nodes = nrows * ncols * states_per_cell
+    id_type = np.int32 if graph.num_nodes < 2**31 else np.int64
+    rows = [[] for _ in range(graph.num_nodes)]
+    present = np.zeros(nrows * ncols, dtype = bool)
+    for node, neighbors in state_graph.items():
+        if not (0 <= node[0] < nrows and 0 <= node[1] < ncols):
+            raise ValueError('state {} is outside the {}x{} map'.format(node, nrows, ncols))
+        sid = encode_state(node, ncols)
+        present[sid // states_per_cell] = True
+        rows[sid] = [(encode_state(neighbor, ncols), cost) for neighbor, cost in neighbors.items()]
+    graph.indptr = np.zeros(graph.num_nodes + 1, dtype = np.int64)
+    np.cumsum([len(row) for row in rows], out = graph.indptr[1:])
+    graph.indices = np.array([sid for row in rows for sid, cost in row], dtype = id_type)
+    graph.costs = np.array([cost for row in rows for sid, cost in row], dtype = np.uint8)
+    graph.blocked = ~present
+    graph.rindptr = graph.rindices = graph.rcosts = None
+    return graph
+
+# this function saves a state graph (CSR_State_Graph or a dict-of-dicts
+# graph) built for state_lattice as a snapshot - the reverse adjacency is
+# built first so predecessor queries on the loaded graph are free too
+def save_graph_snapshot(state_graph, state_lattice, filename):
+    nrows = len(state_lattice)
+    ncols = len(state_lattice[0])
+    if not isinstance(state_graph, CSR_State_Graph):
+        state_graph = csr_from_state_graph(state_graph, nrows, ncols)
+    if (state_graph.nrows, state_graph.ncols) != (nrows, ncols):
+        raise ValueError('the graph is {}x{} but the map is {}x{}'.format(state_graph.nrows, state_graph.ncols, nrows, ncols))
+    if state_graph.rindptr is None:
+        state_graph.build_reverse_index()
+    arrays = {}
+    offset = 0
+    for name in graph_snapshot_arrays:
+        array = np.ascontiguousarray(getattr(state_graph, name))
+        arrays[name] = {'dtype' : array.dtype.str, 'shape' : list(array.shape), 'offset' : offset}
+        offset += -(-array.nbytes // 64) * 64
+    header = json.dumps({'nrows' : nrows, 'ncols' : ncols, 'map_sha256' : map_checksum(state_lattice),
+                         'arrays' : arrays}).encode()
+    data_start = -(-(len(graph_snapshot_magic) + 8 + len(header)) // 64) * 64
+    with open(filename, 'wb') as f:
+        f.write(graph_snapshot_magic)
+        f.write(struct.pack('<II', graph_snapshot_version, len(header)))
+        f.write(header)
+        for name in graph_snapshot_arrays:
+            f.seek(data_start + arrays[name]['offset'])
+            f.write(np.ascontiguousarray(getattr(state_graph, name)).tobytes())
+        f.truncate(data_start + offset)
+
+# this function loads a graph snapshot as a CSR_State_Graph whose arrays are
+# memory-mapped from the file (the blocked cells copy on write, so
+# update_knowledge can still remove cells without touching the file)
+# with state_lattice given, a snapshot built for another map is rejected
+# with a ValueError - so is a file of another format version
+def load_graph_snapshot(filename, state_lattice = None):
+    with open(filename, 'rb') as f:
+        if f.read(len(graph_snapshot_magic)) != graph_snapshot_magic:
+            raise ValueError('{} is not a graph snapshot'.format(filename))
+        version, header_length = struct.unpack('<II', f.read(8))
+        if version != graph_snapshot_version:
+            raise ValueError('{} is a version {} graph snapshot, this code reads version {}'.format(filename, version, graph_snapshot_version))
+        header = json.loads(f.read(header_length).decode())
+    if state_lattice is not None:
+        if (len(state_lattice), len(state_lattice[0])) != (header['nrows'], header['ncols']) or map_checksum(state_lattice) != header['map_sha256']:
+            raise ValueError('{} was built for a different map'.format(filename))
+    data_start = -(-(len(graph_snapshot_magic) + 8 + header_length) // 64) * 64
+    graph = CSR_State_Graph.__new__(CSR_State_Graph)
+    graph.nrows = header['nrows']
+    graph.ncols = header['ncols']
+    graph.num_nodes = graph.nrows * graph.ncols * states_per_cell
+    graph.map_sha256 = header['map_sha256']
+    for name in graph_snapshot_arrays:
+        spec = header['arrays'][name]
+        shape = tuple(spec['shape'])
+        if int(np.prod(shape)) == 0:
+            array = np.zeros(shape, dtype = spec['dtype'])
+        else:
+            array = np.memmap(filename, dtype = spec['dtype'], mode = 'c' if name == 'blocked' else 'r',
+                              offset = data_start + spec['offset'], shape = shape)
+        setattr(graph, name, array)
+    return graph
+
+# this function generates the successors of a single state on demand from the
+# motion primitive table, instead of materializing every edge up front like
+# assign_edges - moves that leave the nrows x ncols lattice or land on a cell
+# in 'blocked' (a set of (x,y) positions) are dropped on the fly
+def lattice_successors(state, nrows, ncols, blocked = ()):
+    successors = {}
+    if (state[0], state[1]) in blocked:
+        return successors
+    for (dx, dy, h2, a2, cost) in motion_primitives[(state[2], state[3])]:
+        x2 = state[0] + dx
+        y2 = state[1] + dy
+        if 0 <= x2 < nrows and 0 <= y2 < ncols and (x2, y2) not in blocked:
+            successors[(x2, y2, h2, a2)] = cost
+    return successors
+
+# this function is the reverse of lattice_successors - the states with a move
+# into 'state', with the cost of that move
+def lattice_predecessors(state, nrows, ncols, blocked = ()):
+    predecessors = {}
+    if (state[0], state[1]) in blocked:
+        return predecessors
+    for (dx, dy, h2, a2, cost) in reverse_motion_primitives[(state[2], state[3])]:
+        x2 = state[0] + dx
+        y2 = state[1] + dy
+        if 0 <= x2 < nrows and 0 <= y2 < ncols and (x2, y2) not in blocked:
+            predecessors[(x2, y2, h2, a2)] = cost
+    return predecessors
+
+# this class wraps lattice_successors into an implicit state graph - it is a
+# callable that astar_search accepts in place of the state_graph dict, and it
+# keeps the agent's blocked cells so update_knowledge works with it as well
+# no edges are stored, so memory does not grow with the size of the map
+class Lattice_Successors:
+    def __init__(self, nrows, ncols, blocked = None):
+        self.nrows = nrows
+        self.ncols = ncols
+        self.blocked = set() if blocked is None else set(blocked)
+
+    def __call__(self, state):
+        return lattice_successors(state, self.nrows, self.ncols, self.blocked)
+
+    def __contains__(self, state):
+        return (0 <= state[0] < self.nrows and 0 <= state[1] < self.ncols
+                and (state[0], state[1]) not in self.blocked)
+
+    # equivalent of extract_node for the implicit graph
+    def remove_cell(self, x, y):
+        self.blocked.add((x, y))
+
+    def get_predecessors(self, state):
+        return lattice_predecessors(state, self.nrows, self.ncols, self.blocked)
+
+# this class is the implicit state graph over packed int states - the same
+# moves as Lattice_Successors, but every primitive is precomputed as an id
+# offset per (heading, wheel angle) group, so a successor is an int addition
+# plus a bounds check, and the blocked cells live in a flat bytearray
+# num_nodes lets astar_search use flat arrays for its closed set
+class Packed_Lattice_Successors:
+    def __init__(self, nrows, ncols, blocked = None):
+        self.nrows = nrows
+        self.ncols = ncols
+        self.num_nodes = nrows * ncols * states_per_cell
+        self.blocked = bytearray(nrows * ncols)
+        for (x, y) in (blocked or ()):
+            self.blocked[x * ncols + y] = 1
+        # per group: (dx, dy, cell offset, id offset, cost)
+        self.moves = [[] for _ in range(states_per_cell)]
+        self.reverse_moves = [[] for _ in range(states_per_cell)]
+        for (table, moves) in ((motion_primitives, self.moves), (reverse_motion_primitives, self.reverse_moves)):
+            for (h, a), prims in table.items():
+                group = heading_index[h] * len(angle) + angle_index[a]
+                for (dx, dy, h2, a2, cost) in prims:
+                    group2 = heading_index[h2] * len(angle) + angle_index[a2]
+                    moves[group].append((dx, dy, dx * ncols + dy, (dx * ncols + dy) * states_per_cell + group2 - group, cost))
+
+    def expand(self, sid, moves):
+        result = {}
+        cell, group = divmod(sid, states_per_cell)
+        if self.blocked[cell]:
+            return result
+        x, y = divmod(cell, self.ncols)
+        for (dx, dy, cell_offset, offset, cost) in moves[group]:
+            if 0 <= x + dx < self.nrows and 0 <= y + dy < self.ncols and not self.blocked[cell + cell_offset]:
+                result[sid + offset] = cost
+        return result
+
+    def __call__(self, sid):
+        return self.expand(sid, self.moves)
+
+    def get_predecessors(self, sid):
+        return self.expand(sid, self.reverse_moves)
+
+    # accepts packed ints and, for cell_in_graph, tuples
+    def __contains__(self, state):
+        if is_packed(state):
+            return 0 <= state < self.num_nodes and not self.blocked[state // states_per_cell]
+        return (0 <= state[0] < self.nrows and 0 <= state[1] < self.ncols
+                and not self.blocked[state[0] * self.ncols + state[1]])
+
+    def remove_cell(self, x, y):
+        if 0 <= x < self.nrows and 0 <= y < self.ncols:
+            self.blocked[x * self.ncols + y] = 1
+
+    # bulk remove_cell, writing through a numpy view of the bytearray
+    def remove_cells(self, cells):
+        cells = np.asarray(cells, dtype = np.int64).reshape(-1, 2)
+        inside = (cells[:, 0] >= 0) & (cells[:, 0] < self.nrows) & (cells[:, 1] >= 0) & (cells[:, 1] < self.ncols)
+        np.frombuffer(self.blocked, dtype = np.uint8)[cells[inside, 0] * self.ncols + cells[inside, 1]] = 1
+
+
+# this function builds an implicit state graph for the lattice, over packed
+# int states if packed = True
+def build_lazy_state_graph(state_lattice, packed = False):
+    if packed:
+        return Packed_Lattice_Successors(len(state_lattice), len(state_lattice[0]))
+    return Lattice_Successors(len(state_lattice), len(state_lattice[0]))
+
+# this function returns the {neighbor : step cost} successors of a state for
+# any of the state graph flavors - dict-of-dicts, CSR_State_Graph or a
+# successor function such as Lattice_Successors
+def get_successors(state_graph, state):
+    if callable(state_graph):
+        return state_graph(state)
+    return state_graph[state]
+
+# this function returns the {predecessor : step cost} map of a state - graphs
+# that keep a reverse adjacency answer directly, a plain dict-of-dicts graph
+# falls back to scanning every edge
+def get_predecessors(state_graph, state):
+    if hasattr(state_graph, 'get_predecessors'):
+        return state_graph.get_predecessors(state)
+    return {node : state_graph[node][state] for node in state_graph if state in state_graph[node]}
+
+# this class is the agent's knowledge as a copy-on-write layer over a shared
+# state graph - the base graph (dict, CSR_State_Graph or an implicit graph,
+# tuple or packed states) is never modified, the cells the agent has seen
+# blocked live in a small per-agent overlay set, and successors,
+# predecessors and membership are filtered through it on the fly
+# many agents or trials on the same map can share one built base graph, and
+# reset() forgets the agent's knowledge at O(overlay size)
+class Knowledge_Overlay:
+    def __init__(self, base_graph, ncols = None):
+        self.base = base_graph
+        self.ncols = getattr(base_graph, 'ncols', ncols)
+        self.num_nodes = getattr(base_graph, 'num_nodes', None)
+        # blocked cells - x*ncols + y when the width is known, else (x,y)
+        self.blocked = set()
+
+    def cell_key(self, x, y):
+        return x * self.ncols + y if self.ncols is not None else (x, y)
+
+    def state_key(self, state):
+        if is_packed(state):
+            return int(state) // states_per_cell
+        return self.cell_key(state[0], state[1])
+
+    def __call__(self, state):
+        blocked = self.blocked
+        if type(state) is int: # packed states, the hot path of the search
+            if state // states_per_cell in blocked:
+                return {}
+            successors = get_successors(self.base, state)
+            if not blocked:
+                return successors
+            return {nb : cost for nb, cost in successors.items() if nb // states_per_cell not in blocked}
+        if self.state_key(state) in blocked:
+            return {}
+        successors = get_successors(self.base, state)
+        if not blocked:
+            return successors
+        return {nb : cost for nb, cost in successors.items() if self.state_key(nb) not in blocked}
+
+    def get_predecessors(self, state):
+        if self.state_key(state) in self.blocked:
+            return {}
+        return {pred : cost for pred, cost in get_predecessors(self.base, state).items() if self.state_key(pred) not in self.blocked}
+
+    def __contains__(self, state):
+        return state in self.base and self.state_key(state) not in self.blocked
+
+    # equivalent of extract_node, it only touches the overlay
+    def remove_cell(self, x, y):
+        self.blocked.add(self.cell_key(x, y))
+
+    def remove_cells(self, cells):
+        self.blocked.update(self.cell_key(x, y) for (x, y) in cells)
+
+    def blocked_cells(self):
+        return [divmod(key, self.ncols) if self.ncols is not None else key for key in self.blocked]
+
+    def reset(self):
+        self.blocked.clear()
+
+# the obstacle-free implicit graphs over packed states, one per lattice size -
+# the agent's starting knowledge only depends on the size of the map, so
+# every episode on a map of that size shares the same base graph
+# at most shared_base_graph_limit sizes are kept (a long batch worker sees
+# many), the oldest one is dropped first - episodes already running keep theirs
+shared_base_graphs = {}
+shared_base_graph_limit = 8
+
+def shared_base_graph(nrows, ncols):
+    if (nrows, ncols) not in shared_base_graphs:
+        if len(shared_base_graphs) >= shared_base_graph_limit:
+            del shared_base_graphs[next(iter(shared_base_graphs))]
+        shared_base_graphs[(nrows, ncols)] = Packed_Lattice_Successors(nrows, ncols)
+    return shared_base_graphs[(nrows, ncols)]
+
 # this function updates the agent's state graph (agent's knowledge) about
 # obstacles in the state lattice - the agent can see adjacent (x,y) positions
-def update_knowledge(current_state, current_state_graph, state_lattice, vision):
+# with return_blocked = True it also returns the list of (x,y) cells that were
+# newly discovered to be blocked, for planners that repair their search
+# with a Planner_Stats as stats the sensing time and cell counts are recorded
+def update_knowledge(current_state, current_state_graph, state_lattice, vision, return_blocked = False, stats = None):
+    if stats is not None:
+        sensing_started = time.perf_counter()
     new_state_graph = current_state_graph
-    x = current_state[0]
-    y = current_state[1]
+    newly_blocked = []
+    # drop a blocked cell from the agent's graph, remembering it if it is news
+    def discover(bx, by):
+        if cell_in_graph(new_state_graph, bx, by):
+            newly_blocked.append((bx, by))
+        return extract_node(bx, by, new_state_graph)
+    if is_packed(current_state):
+        x, y = state_cell(current_state, len(state_lattice[0]))
+    else:
+        x = current_state[0]
+        y = current_state[1]
     for i in range(vision):
         # search south
         if (x + (i + 1) < len(state_lattice)):
             if state_lattice[x + (i + 1)][y] == 1:
-                new_state_graph = extract_node(x + (i + 1), y, new_state_graph)
+                new_state_graph = discover(x + (i + 1), y)
         # search north
         if (x - (i + 1)) >= 0:
             if state_lattice[x - (i + 1)][y] == 1:
-                new_state_graph = extract_node(x - (i + 1), y, new_state_graph)
+                new_state_graph = discover(x - (i + 1), y)
         # search east
         if (y + (i + 1)) < len(state_lattice[0]):
             if state_lattice[x][y + (i + 1)] == 1:
-                new_state_graph = extract_node(x, y + (i + 1), new_state_graph)
+                new_state_graph = discover(x, y + (i + 1))
         # search west
         if (y - (i + 1)) >= 0:
             if state_lattice[x][y - (i + 1)] == 1:
-                new_state_graph = extract_node(x, y - (i + 1), new_state_graph)
+                new_state_graph = discover(x, y - (i + 1))
         # search northwest
         if ((x - (i + 1)) >= 0) and ((y - (i + 1)) >= 0):
             if state_lattice[x - (i + 1)][y - (i + 1)] == 1:
-                new_state_graph = extract_node(x - (i + 1), y - (i + 1), new_state_graph)
+                new_state_graph = discover(x - (i + 1), y - (i + 1))
         # search northeast
         if ((x - (i + 1)) >= 0) and ((y + (i + 1)) < len(state_lattice[0])):
             if state_lattice[x - (i + 1)][y + (i + 1)] == 1:
-                new_state_graph = extract_node(x - (i + 1), y + (i + 1), new_state_graph)
+                new_state_graph = discover(x - (i + 1), y + (i + 1))
         # search southwest
         if ((x + (i + 1)) < len(state_lattice)) and ((y - (i + 1)) >= 0):
             if state_lattice[x + (i + 1)][y - (i + 1)] == 1:
-                new_state_graph = extract_node(x + (i + 1), y - (i + 1), new_state_graph)
+                new_state_graph = discover(x + (i + 1), y - (i + 1))
         # search southeast
         if ((x + (i + 1)) < len(state_lattice)) and ((y + (i + 1)) < len(state_lattice[0])):
             if state_lattice[x + (i + 1)][y + (i + 1)] == 1:
-                new_state_graph = extract_node(x + (i + 1), y + (i + 1), new_state_graph)
+                new_state_graph = discover(x + (i + 1), y + (i + 1))
+    if stats is not None:
+        stats.add_time('sensing', time.perf_counter() - sensing_started)
+        stats.count('sensing_calls')
+        stats.count('newly_blocked', len(newly_blocked))
+    if return_blocked:
+        return (new_state_graph, newly_blocked)
+    return new_state_graph
+
+# this function returns the window state_lattice[x0:x1, y0:y1] as an array,
+# slicing a list of lists row by row so the whole lattice is never converted
+def lattice_window(state_lattice, x0, x1, y0, y1):
+    if isinstance(state_lattice, np.ndarray):
+        return np.asarray(state_lattice[x0:x1, y0:y1])
+    return np.array([row[y0:y1] for row in state_lattice[x0:x1]], dtype = np.uint8).reshape(x1 - x0, y1 - y0)
+
+# this function finds, with array operations on one window of the lattice,
+# the blocked cells the agent at (x,y) can see within 'vision' cells
+# shape 'rays' is the 8 rays of update_knowledge, 'square' every cell within
+# vision in x and y, 'circle' every cell within Euclidean distance vision
+# and the 8 cells around the agent
+# with occlusion = True a cell is only seen if the straight line to it does
+# not pass through a blocked cell first
+# the result is an (n, 2) int array of blocked (x,y) cells
+def sense_blocked_cells(x, y, state_lattice, vision, shape = 'square', occlusion = False):
+    nrows = len(state_lattice)
+    ncols = len(state_lattice[0])
+    x0, x1 = max(0, x - vision), min(nrows, x + vision + 1)
+    y0, y1 = max(0, y - vision), min(ncols, y + vision + 1)
+    window = lattice_window(state_lattice, x0, x1, y0, y1) == 1
+    dx = np.arange(x0, x1)[:, None] - x
+    dy = np.arange(y0, y1)[None, :] - y
+    if shape == 'rays':
+        visible = (dx == 0) | (dy == 0) | (np.abs(dx) == np.abs(dy))
+    elif shape == 'circle': # plus the diagonal neighbors, where moves go even for vision 1
+        visible = (dx * dx + dy * dy <= vision * vision) | ((np.abs(dx) <= 1) & (np.abs(dy) <= 1))
+    elif shape == 'square':
+        visible = np.ones(window.shape, dtype = bool)
+    else:
+        raise ValueError("unknown sensing shape {}".format(shape))
+    visible = visible & ((dx != 0) | (dy != 0))
+    if occlusion:
+        # walk all lines of sight at once, one step per iteration, and hide
+        # the cells whose line crosses a blocked cell before reaching them
+        steps = np.maximum(np.abs(dx), np.abs(dy))
+        for k in range(1, vision):
+            on_line = steps > k
+            if not on_line.any():
+                break
+            # cells nearer than k steps are clamped to k = steps so every index stays in the window
+            frac = np.minimum(k, steps) / np.maximum(steps, 1)
+            lx = np.rint(x + dx * frac).astype(int) - x0
+            ly = np.rint(y + dy * frac).astype(int) - y0
+            visible &= ~(on_line & window[lx, ly])
+    hits = np.argwhere(visible & window)
+    hits[:, 0] += x0
+    hits[:, 1] += y0
+    return hits
+
+# this function removes a batch of cells from a state graph in one go, for
+# graphs that support it, and cell by cell with extract_node otherwise
+def extract_cells(cells, state_graph):
+    if hasattr(state_graph, 'remove_cells'):
+        state_graph.remove_cells(cells)
+        return state_graph
+    for (x, y) in cells:
+        state_graph = extract_node(x, y, state_graph)
+    return state_graph
+
+# this function is the vectorized alternative to update_knowledge for large
+# vision ranges - it senses a whole region at once with sense_blocked_cells,
+# keeps only the cells the agent did not know yet, and applies them to the
+# graph as one bulk update (same return values as update_knowledge)
+def update_knowledge_region(current_state, current_state_graph, state_lattice, vision, shape = 'square', occlusion = False, return_blocked = False, stats = None):
+    if stats is not None:
+        sensing_started = time.perf_counter()
+    if is_packed(current_state):
+        x, y = state_cell(current_state, len(state_lattice[0]))
+    else:
+        x = current_state[0]
+        y = current_state[1]
+    hits = sense_blocked_cells(x, y, state_lattice, vision, shape, occlusion)
+    newly_blocked = [(bx, by) for bx, by in hits.tolist() if cell_in_graph(current_state_graph, bx, by)]
+    new_state_graph = extract_cells(newly_blocked, current_state_graph)
+    if stats is not None:
+        stats.add_time('sensing', time.perf_counter() - sensing_started)
+        stats.count('sensing_calls')
+        stats.count('blocked_in_view', len(hits))
+        stats.count('newly_blocked', len(newly_blocked))
+    if return_blocked:
+        return (new_state_graph, newly_blocked)
     return new_state_graph
 
 # this function constructs a path that the agent follows through the state space
@@ -625,13 +1543,17 @@ def path(previous, s):
     '''
     'previous' is a dictionary chaining together the predecessor state that led
     to each state - 's' will be None for the initial state
-    otherwise, start from the last state 's' and recursively trace 'previous'
-    back to the initial state, constructing a list of states visited as we go
+    otherwise, start from the last state 's' and trace 'previous' back to the
+    initial state, constructing a list of states visited as we go
+    (a loop rather than recursion, so long paths on big maps do not hit the
+    recursion limit)
     '''
-    if s is None:
-        return []
-    else:
-        return path(previous, previous[s]) + [s]
+    states = []
+    while s is not None:
+        states.append(s)
+        s = previous[s]
+    states.reverse()
+    return states
 
 # this function calculates the total cost of the path that the agent takes
 def pathcost(path, step_costs):
@@ -641,25 +1563,218 @@ def pathcost(path, step_costs):
     '''
     cost = 0
     for s in range(len(path) - 1):
-        cost += step_costs[path[s]][path[s+1]]
+        cost += get_successors(step_costs, path[s])[path[s+1]]
     return cost
 
 # this class provides methods to initialize and edit the priority queue
 # that is used in A* search
+# by default it is a plain heapq, where a state whose cost drops is simply
+# pushed again and the old entry is left behind as a stale duplicate
+# with indexed = True it is an indexed binary heap instead: every state is on
+# the heap at most once, its position is tracked, and add() on a state that is
+# already queued is a real decrease-key - the positions are a dict that only
+# holds the queued states, so a search pays for what it touches, not the map
+# both modes count pushes, pops and decrease-keys and the peak heap size
 class Frontier_PQ:
-    def __init__(self, start, cost = 0):
+    def __init__(self, start, cost = 0, indexed = False):
         self.start = start
         # initialize dictionary - keys are states (x,y,h,a) and values are
         # minimum distances to those states from the start state
         self.states = dict({start : 0})
         self.q = [(0, start)] # initialize priority queue (cost, state)
+        self.indexed = indexed
+        if indexed:
+            self.pos = {start : 0} # position of each queued state in self.q
+        self.pushes = 1
+        self.pops = 0
+        self.decrease_keys = 0
+        self.peak_size = 1
     def add(self, state, cost): # add a (cost, state) tuple to the frontier
-        heapq.heappush(self.q, (cost, state))
+        if not self.indexed:
+            heapq.heappush(self.q, (cost, state))
+            self.pushes += 1
+            if len(self.q) > self.peak_size:
+                self.peak_size = len(self.q)
+            return
+        i = self.position(state)
+        if i < 0:
+            self.q.append((cost, state))
+            self.pos[state] = len(self.q) - 1
+            self.sift_up(len(self.q) - 1)
+            self.pushes += 1
+            if len(self.q) > self.peak_size:
+                self.peak_size = len(self.q)
+        elif (cost, state) < self.q[i]:
+            self.q[i] = (cost, state)
+            self.sift_up(i)
+            self.decrease_keys += 1
     def pop(self): # return the lowest cost (cost, state) tuple, and pop it off of the frontier
-        return heapq.heappop(self.q)
+        self.pops += 1
+        if not self.indexed:
+            return heapq.heappop(self.q)
+        top = self.q[0]
+        last = self.q.pop()
+        del self.pos[top[1]]
+        if self.q:
+            self.q[0] = last
+            self.pos[last[1]] = 0
+            self.sift_down(0)
+        return top
     # if a lower path cost to a state already on the frontier is found, it should be replaced
     def replace(self, state, cost):
         self.states[state] = cost
+    # counters of the queue operations so far
+    def stats(self):
+        return {'pushes' : self.pushes, 'pops' : self.pops, 'decrease_keys' : self.decrease_keys,
+                'peak_size' : self.peak_size}
+
+    # helpers for the indexed heap
+    def position(self, state):
+        return self.pos.get(state, -1)
+    def sift_up(self, i):
+        q, pos = self.q, self.pos
+        item = q[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if item < q[parent]:
+                q[i] = q[parent]
+                pos[q[i][1]] = i
+                i = parent
+            else:
+                break
+        q[i] = item
+        pos[item[1]] = i
+    def sift_down(self, i):
+        q, pos = self.q, self.pos
+        size = len(q)
+        item = q[i]
+        while True:
+            child = 2 * i + 1
+            if child >= size:
+                break
+            if child + 1 < size and q[child + 1] < q[child]:
+                child += 1
+            if q[child] < item:
+                q[i] = q[child]
+                pos[q[i][1]] = i
+                i = child
+            else:
+                break
+        q[i] = item
+        pos[item[1]] = i
+
+# above this many states the flat per-search arrays would cost more to
+# allocate than the hashing they save
+flat_state_limit = 2**25
+
+# this class is the closed set of A* search - states that were already
+# expanded - with O(1) membership tests
+# integer state ids in range(num_states) go into a preallocated bytearray,
+# anything else (the (x,y,h,a) tuples) falls back to a hash set
+class Closed_Set:
+    def __init__(self, num_states = None):
+        self.flags = bytearray(num_states) if num_states is not None else None
+        self.members = set() if num_states is None else None
+        self.count = 0
+    def add(self, state):
+        if self.flags is not None:
+            if not self.flags[state]:
+                self.flags[state] = 1
+                self.count += 1
+        elif state not in self.members:
+            self.members.add(state)
+            self.count += 1
+    def __contains__(self, state):
+        if self.flags is not None:
+            return self.flags[state] == 1
+        return state in self.members
+    def __len__(self):
+        return self.count
+
+# this class collects counters and phase timers for the planner - pass one as
+# stats = ... to astar_search, update_knowledge(_region) or run_episode to see
+# where a plan's time went (heap operations, stale pops, heuristic calls,
+# successor lookups, sensing)
+# without a stats object nothing is measured and the hot loops are unchanged
+# counters and timers are dicts of name -> number, searches keeps the stats of
+# each astar_search of an episode, and with trace = True every phase is also
+# kept as an event for write_trace
+class Planner_Stats:
+    def __init__(self, trace = False):
+        self.counters = {}
+        self.timers = {}
+        self.searches = []
+        self.events = [] if trace else None
+        self.origin = time.perf_counter()
+
+    def count(self, name, n = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def add_time(self, name, seconds):
+        self.timers[name] = self.timers.get(name, 0.0) + seconds
+
+    # returns 'function' wrapped to count its calls (counter name_calls) and
+    # add up its time (timer name)
+    def timed(self, name, function):
+        counters, timers, clock = self.counters, self.timers, time.perf_counter
+        calls = name + '_calls'
+        counters.setdefault(calls, 0)
+        timers.setdefault(name, 0.0)
+        def timed_function(*args):
+            started = clock()
+            result = function(*args)
+            timers[name] += clock() - started
+            counters[calls] += 1
+            return result
+        return timed_function
+
+    # times the body of a with block as phase 'name'
+    @contextlib.contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield self
+        finally:
+            elapsed = time.perf_counter() - started
+            self.add_time(name, elapsed)
+            if self.events is not None:
+                self.events.append((name, started - self.origin, elapsed))
+
+    # adds the counters and timers of another stats object (one search) to
+    # these ones (the episode)
+    def merge(self, other):
+        for name, n in other.counters.items():
+            if name.startswith('peak_'):
+                self.counters[name] = max(self.counters.get(name, 0), n)
+            else:
+                self.count(name, n)
+        for name, seconds in other.timers.items():
+            self.add_time(name, seconds)
+
+    def as_dict(self):
+        result = {'counters' : dict(self.counters), 'timers' : dict(self.timers)}
+        expansions = self.counters.get('expansions', 0)
+        if expansions and self.timers.get('search'):
+            result['expansions_per_sec'] = expansions / self.timers['search']
+        if self.searches:
+            result['searches'] = [search.as_dict() for search in self.searches]
+        return result
+
+    # writes the phase events as a Chrome trace event file, which
+    # chrome://tracing, Perfetto and speedscope show as a flame chart
+    def write_trace(self, filename):
+        events = [{'name' : name, 'ph' : 'X', 'pid' : 0, 'tid' : 0,
+                   'ts' : start * 1e6, 'dur' : elapsed * 1e6}
+                  for name, start, elapsed in self.events or ()]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, f)
+
+# stand-in for a Planner_Stats when instrumentation is off, its phases do nothing
+class No_Stats:
+    def phase(self, name):
+        return contextlib.nullcontext()
+
+no_stats = No_Stats()
 
 # this function calculates the heuristic for the A* search algorithm
 def euclidean_distance(current_state, goal):
@@ -668,15 +1783,478 @@ def euclidean_distance(current_state, goal):
     end_pos = (goal[0], goal[1])
     return distance.euclidean(start_pos, end_pos)
 
-def astar_search(start, goal, state_graph, state_lattice, heuristic, return_cost = False, return_nexp = False):
-    my_frontier = Frontier_PQ(start) # create a priority queue
-    visited = []
+# this function is an alternative heuristic - every move changes x and y by at
+# most one, so the Chebyshev distance never overestimates the cost to go
+# (the Euclidean distance can, on the diagonal moves) and it is consistent,
+# which the incremental planner below relies on
+def chebyshev_distance(current_state, goal):
+    return max(abs(current_state[0] - goal[0]), abs(current_state[1] - goal[1]))
+
+# this class adapts a heuristic written for (x,y,h,a) tuples to packed states
+# heuristics that only look at the position get just the (x,y) cell
+class Packed_Heuristic:
+    def __init__(self, heuristic, ncols):
+        self.heuristic = heuristic
+        self.ncols = ncols
+        self.position_only = heuristic in (euclidean_distance, chebyshev_distance)
+        self.goal = None
+        self.goal_state = None
+
+    def __call__(self, sid, goal):
+        if goal != self.goal:
+            self.goal = goal
+            self.goal_state = decode_state(goal, self.ncols)
+        if self.position_only:
+            return self.heuristic(divmod(sid // states_per_cell, self.ncols), self.goal_state)
+        return self.heuristic(decode_state(sid, self.ncols), self.goal_state)
+
+# this function precomputes, offline, the exact obstacle-free cost to go
+# between every pair of relative states within 'radius' cells, using the same
+# motion primitives as assign_edges - the result is a uint16 array indexed
+# [state (heading, angle) group, goal group, dx + radius, dy + radius] where
+# dx, dy is the position of the state relative to the goal and a group is
+# heading_index*3 + angle_index
+# it is a backward breadth first search run for all 12 goal states at once,
+# one vectorized relaxation per primitive and per step, on a window 'margin'
+# cells wider than the radius so the optimal maneuvers near the rim fit in it
+def build_heuristic_table(radius, margin = 4):
+    groups = states_per_cell
+    size = 2 * (radius + margin) + 1
+    unreached = np.iinfo(np.uint16).max
+    table = np.full((groups, groups, size, size), unreached, dtype = np.uint32)
+    center = radius + margin
+    for goal_group in range(groups):
+        table[goal_group, goal_group, center, center] = 0
+    moves = []
+    for (h, a), prims in motion_primitives.items():
+        group = heading_index[h] * len(angle) + angle_index[a]
+        for (dx, dy, h2, a2, cost) in prims:
+            if (dx, dy, h2, a2) != (0, 0, h, a): # self loops never help
+                moves.append((group, dx, dy, heading_index[h2] * len(angle) + angle_index[a2], cost))
+    changed = True
+    while changed:
+        changed = False
+        for (group, dx, dy, group2, cost) in moves:
+            # cells whose move by (dx, dy) stays inside the window
+            src = table[group, :, max(0, -dx):size - max(0, dx), max(0, -dy):size - max(0, dy)]
+            dst = table[group2, :, max(0, dx):size - max(0, -dx), max(0, dy):size - max(0, -dy)]
+            better = dst + cost < src
+            if better.any():
+                src[better] = dst[better] + cost
+                changed = True
+    table = np.minimum(table, unreached).astype(np.uint16)
+    return np.ascontiguousarray(table[:, :, margin:size - margin, margin:size - margin])
+
+# this function writes a heuristic table to a .npy file
+def save_heuristic_table(table, filename):
+    np.save(filename, table)
+
+# this class turns a heuristic table into an A* heuristic - the table is
+# memory-mapped, so loading it is instant and only the pages that queries
+# touch are read, and a query inside the radius is a single array index
+# states further away than the radius fall back to another heuristic
+class Heuristic_LUT:
+    def __init__(self, table, fallback = euclidean_distance):
+        if isinstance(table, str):
+            table = np.load(table, mmap_mode = 'r')
+        self.table = table
+        self.radius = (table.shape[2] - 1) // 2
+        self.fallback = fallback
+
+    def __call__(self, current_state, goal):
+        dx = current_state[0] - goal[0]
+        dy = current_state[1] - goal[1]
+        if -self.radius <= dx <= self.radius and -self.radius <= dy <= self.radius:
+            return int(self.table[heading_index[current_state[2]] * len(angle) + angle_index[current_state[3]],
+                                  heading_index[goal[2]] * len(angle) + angle_index[goal[3]],
+                                  dx + self.radius, dy + self.radius])
+        return self.fallback(current_state, goal)
+
+# this function loads a heuristic table saved with save_heuristic_table
+def load_heuristic_table(filename, fallback = euclidean_distance):
+    return Heuristic_LUT(filename, fallback)
+
+# the cost field functions below work on the grid padded with a blocked
+# border and flattened, so the 8 neighbors of a cell are fixed index offsets
+# and never fall off the grid
+
+# this function returns the flat offsets of the 8 neighbors of a cell in a
+# padded grid with 'cols' columns (before padding)
+def padded_offsets(cols):
+    width = cols + 2
+    return np.array([dx * width + dy for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx != 0 or dy != 0])
+
+def pad_grid(grid, fill):
+    return np.pad(grid, 1, constant_values = fill).ravel()
+
+def unpad_grid(flat, shape):
+    return flat.reshape(shape[0] + 2, shape[1] + 2)[1:-1, 1:-1].copy()
+
+# this function grows a 2D cost-to-go field from 'seeds' (cells whose value
+# is final) over the open cells one step a level, as a breadth first
+# wavefront - each cell is reached once, so a whole field costs one pass over
+# the cells it reaches, with one vectorized step per level
+# seeds may hold different values (a repair reseeds from the edge of the
+# invalidated region), and join the wavefront when it reaches their level
+def grow_cost_field(field, is_open, seeds, offsets):
+    seeds = seeds[np.argsort(field[seeds], kind = 'stable')]
+    seed_values = field[seeds]
+    next_seed = 0
+    frontier = seeds[:0]
+    level = 0
+    while len(frontier) or next_seed < len(seeds):
+        if not len(frontier):
+            level = seed_values[next_seed]
+        joining = next_seed + np.searchsorted(seed_values[next_seed:], level, side = 'right')
+        if joining > next_seed:
+            frontier = np.concatenate([frontier, seeds[next_seed:joining]])
+            next_seed = joining
+        neighbors = (frontier[:, None] + offsets).ravel()
+        neighbors = np.unique(neighbors[is_open[neighbors] & (field[neighbors] > level + 1)])
+        field[neighbors] = level + 1
+        frontier = neighbors
+        level += 1
+    return field
+
+# this function computes the obstacle-aware 2D cost to go to the goal cell
+# over the cells the agent does not know to be blocked - every lattice move
+# shifts x and y by at most one, so the 8-connected step count is a lower
+# bound on the lattice cost that, unlike the Euclidean distance, goes around
+# the walls the agent has seen
+def build_cost_field(goal, known_blocked):
+    rows, cols = known_blocked.shape
+    field = np.full((rows + 2) * (cols + 2), np.inf)
+    if not known_blocked[goal[0], goal[1]]:
+        goal_cell = (goal[0] + 1) * (cols + 2) + goal[1] + 1
+        field[goal_cell] = 0
+        grow_cost_field(field, pad_grid(~known_blocked, False), np.array([goal_cell]), padded_offsets(cols))
+    return unpad_grid(field, known_blocked.shape)
+
+# this function repairs a cost field after new_cells were blocked - distances
+# only grow, so starting from the new cells, level by level, the neighbors one
+# step further that have no other neighbor one step closer left are
+# invalidated, and only the invalidated cells are grown again, from the
+# valid cells around them
+def repair_cost_field(field, known_blocked, new_cells):
+    cols = known_blocked.shape[1]
+    offsets = padded_offsets(cols)
+    field = pad_grid(field, np.inf)
+    new_cells = np.asarray(list(new_cells), dtype = np.int64).reshape(-1, 2)
+    new_cells = (new_cells[:, 0] + 1) * (cols + 2) + new_cells[:, 1] + 1
+    new_cells = new_cells[np.isfinite(field[new_cells])]
+    # invalidated cells, keyed by the value they had
+    lost = {}
+    for value in np.unique(field[new_cells]).tolist():
+        lost[value] = [new_cells[field[new_cells] == value]]
+    field[new_cells] = np.inf
+    invalidated = [new_cells]
+    while lost:
+        value = min(lost)
+        cells = np.unique(np.concatenate(lost.pop(value)))
+        candidates = (cells[:, None] + offsets).ravel()
+        candidates = np.unique(candidates[field[candidates] == value + 1])
+        if not len(candidates):
+            continue
+        support = field[candidates[:, None] + offsets].min(axis = 1)
+        unsupported = candidates[support + 1 > value + 1]
+        if len(unsupported):
+            field[unsupported] = np.inf
+            lost.setdefault(value + 1, []).append(unsupported)
+            invalidated.append(unsupported)
+    invalidated = np.concatenate(invalidated)
+    # reseed from the valid cells next to the invalidated ones
+    seeds = (invalidated[:, None] + offsets).ravel()
+    seeds = np.unique(seeds[np.isfinite(field[seeds])])
+    grow_cost_field(field, pad_grid(~known_blocked, False), seeds, offsets)
+    return unpad_grid(field, known_blocked.shape)
+
+# this class is an A* heuristic backed by build_cost_field - one field per
+# goal cell is cached, keyed by (goal cell, knowledge version), and
+# block_cells (fed with the cells update_knowledge reports) bumps the version
+# and repairs the cached fields incrementally instead of rebuilding them
+# a heuristic call is then a dict hit and an array lookup
+# at most 'capacity' fields (one full grid each) are kept, the least recently
+# used one is dropped when another goal comes in
+class Cost_Field_Heuristic:
+    def __init__(self, nrows, ncols, known_blocked = None, capacity = 8):
+        if known_blocked is None:
+            known_blocked = np.zeros((nrows, ncols), dtype = bool)
+        self.known_blocked = np.array(known_blocked, dtype = bool)
+        self.capacity = capacity
+        self.version = 0
+        self.fields = {} # least recently used first
+        self.last = (None, None) # most recently used (key, field)
+
+    def field(self, goal):
+        key = ((goal[0], goal[1]), self.version)
+        if self.last[0] != key:
+            field = self.fields.pop(key, None)
+            if field is None:
+                field = build_cost_field(goal, self.known_blocked)
+                if len(self.fields) >= self.capacity:
+                    del self.fields[next(iter(self.fields))]
+            self.fields[key] = field
+            self.last = (key, field)
+        return self.last[1]
+
+    def block_cells(self, cells):
+        cells = [(x, y) for (x, y) in cells if not self.known_blocked[x, y]]
+        if not cells:
+            return
+        for (x, y) in cells:
+            self.known_blocked[x, y] = True
+        old_version = self.version
+        self.version += 1
+        repaired = {}
+        for (goal_cell, version), field in self.fields.items():
+            if version == old_version:
+                repaired[(goal_cell, self.version)] = repair_cost_field(field, self.known_blocked, cells)
+        self.fields = repaired
+        self.last = (None, None)
+
+    def __call__(self, current_state, goal):
+        return float(self.field(goal)[current_state[0], current_state[1]])
+
+# this class labels the strongly connected components of the agent's known
+# state graph (every state of a cell not known to be blocked, with the edges
+# of motion_primitives), so reachable(start, goal) is a comparison of two
+# labels - every move of the lattice can be undone by another one, so two
+# states are in the same component exactly when a path joins them
+# the first query labels the whole graph (one vectorized pass), after that
+# removing cells can only split components: block_cells (fed with the cells
+# update_knowledge reports) only notes, per component, the open states next
+# to the removed ones, and the next query that lands in such a component
+# checks whether it split by labeling the component's states in windows
+# around those states (see split) - a window starts 8 cells wider than them
+# and doubles while the pieces may still join outside it
+# a check usually costs a few thousand states per new obstacle, however large
+# the map, and only a split into large pieces, or a reconnection that needs a
+# long detour, grows a window towards the whole component
+class Reachability_Index:
+    def __init__(self, nrows, ncols, known_blocked = None):
+        self.nrows = nrows
+        self.ncols = ncols
+        self.num_nodes = nrows * ncols * states_per_cell
+        if known_blocked is None:
+            known_blocked = np.zeros((nrows, ncols), dtype = bool)
+        self.blocked = np.array(known_blocked, dtype = bool).ravel()
+        # per group: (dx, dy, id offset) of the moves that change cell
+        self.moves = [[] for _ in range(states_per_cell)]
+        for (h, a), prims in motion_primitives.items():
+            group = heading_index[h] * len(angle) + angle_index[a]
+            for (dx, dy, h2, a2, cost) in prims:
+                group2 = heading_index[h2] * len(angle) + angle_index[a2]
+                if (dx, dy, group2) != (0, 0, group):
+                    self.moves[group].append((dx, dy, (dx * ncols + dy) * states_per_cell + group2 - group))
+        self.labels = None # component of every state, -1 for blocked cells, labeled on first query
+        self.position = None # scratch: index of every state in the set being labeled
+        self.next_label = 0
+        self.seeds = {} # component -> open states next to cells removed from it since its last check
+        self.relabels = 0 # number of split checks
+        self.relabeled_states = 0 # states visited by them
+
+    # this function returns the edges between 'states' (a sorted array of open
+    # state ids) as indices into 'states', leaving out the edges to other states
+    def edges(self, states):
+        if self.position is None:
+            self.position = np.full(self.num_nodes, -1, dtype = np.int64)
+        self.position[states] = np.arange(len(states))
+        sources = []
+        targets = []
+        groups = states % states_per_cell
+        for group, moves in enumerate(self.moves):
+            positions = np.flatnonzero(groups == group)
+            x, y = np.divmod(states[positions] // states_per_cell, self.ncols)
+            for (dx, dy, offset) in moves:
+                inside = (x + dx >= 0) & (x + dx < self.nrows) & (y + dy >= 0) & (y + dy < self.ncols)
+                src = positions[inside]
+                dst = states[src] + offset
+                dst = self.position[dst]
+                keep = dst >= 0
+                sources.append(src[keep])
+                targets.append(dst[keep])
+        self.position[states] = -1
+        return np.concatenate(sources), np.concatenate(targets)
+
+    # this function gives 'states' fresh component labels
+    def label(self, states):
+        ncomponents, labels = self.local_labels(states)
+        self.labels[states] = labels + self.next_label
+        self.next_label += ncomponents
+        self.relabeled_states += len(states)
+
+    def label_all(self):
+        self.labels = np.full(self.num_nodes, -1, dtype = np.int64)
+        cells = np.flatnonzero(~self.blocked)
+        states = (cells[:, None] * states_per_cell + np.arange(states_per_cell)).ravel()
+        self.label(states)
+        self.seeds = {}
+
+    # the open neighbors of a state (the moves can all be undone, so they are
+    # its successors and its predecessors alike)
+    def neighbors(self, sid):
+        cell, group = divmod(sid, states_per_cell)
+        x, y = divmod(cell, self.ncols)
+        return [sid + offset for (dx, dy, offset) in self.moves[group]
+                if 0 <= x + dx < self.nrows and 0 <= y + dy < self.ncols and not self.blocked[cell + dx * self.ncols + dy]]
+
+    def block_cells(self, cells):
+        cells = np.asarray(list(cells), dtype = np.int64).reshape(-1, 2)
+        cells = cells[:, 0] * self.ncols + cells[:, 1]
+        cells = cells[~self.blocked[cells]]
+        if not len(cells):
+            return
+        self.blocked[cells] = True
+        if self.labels is None:
+            return
+        for cell in cells.tolist():
+            for sid in range(cell * states_per_cell, (cell + 1) * states_per_cell):
+                label = int(self.labels[sid])
+                if label != -1:
+                    self.seeds.setdefault(label, set()).update(self.neighbors(sid))
+                    self.labels[sid] = -1
+
+    # this function returns the component labels (0, 1, ...) of 'states' in
+    # the graph restricted to them
+    def local_labels(self, states):
+        sources, targets = self.edges(states)
+        adjacency = sparse.csr_matrix((np.ones(len(sources), dtype = np.int8), (sources, targets)), shape = (len(states), len(states)))
+        return csgraph.connected_components(adjacency, directed = True, connection = 'strong')
+
+    # this function labels the component's states in the window x0:x1, y0:y1
+    # on their own and returns (whether the seeds' pieces that reach the
+    # window's edge, and may go on outside it, are at most one, the states of
+    # the seeds' pieces that do not, and whether there is a piece that does)
+    def check_window(self, label, seeds, window):
+        x0, x1, y0, y1 = window
+        cells = (np.arange(x0, x1)[:, None] * self.ncols + np.arange(y0, y1)).ravel()
+        states = (cells[:, None] * states_per_cell + np.arange(states_per_cell)).ravel()
+        states = states[self.labels[states] == label]
+        self.relabeled_states += len(states)
+        ncomponents, pieces = self.local_labels(states)
+        sx, sy = np.divmod(states // states_per_cell, self.ncols)
+        on_edge = ((sx == x0) & (x0 > 0)) | ((sx == x1 - 1) & (x1 < self.nrows)) | ((sy == y0) & (y0 > 0)) | ((sy == y1 - 1) & (y1 < self.ncols))
+        open_pieces = np.zeros(ncomponents, dtype = bool)
+        open_pieces[pieces[on_edge]] = True
+        seed_pieces = np.unique(pieces[np.searchsorted(states, seeds)])
+        closed = [states[pieces == piece] for piece in seed_pieces[~open_pieces[seed_pieces]].tolist()]
+        return open_pieces[seed_pieces].sum() <= 1, closed, bool(open_pieces[seed_pieces].any())
+
+    # this function checks whether a component that lost cells split, and
+    # gives every piece that split off a new label
+    # the seeds are checked in clusters, each in a window 8 cells wider than
+    # them (doubled while it is not conclusive) - seeds whose piece does not
+    # reach the window's edge are in a whole component of their own, and when
+    # the rest are all in one piece no other split happened around them
+    # clusters whose windows overlap are merged and checked again, since a
+    # piece found whole in one window could otherwise also touch another
+    # cluster and hide a split from both
+    def split(self, label):
+        seeds = np.array(sorted(sid for sid in self.seeds.pop(label) if self.labels[sid] == label), dtype = np.int64)
+        self.relabels += 1
+        if not len(seeds):
+            return
+        def window(cluster, margin):
+            x, y = np.divmod(cluster // states_per_cell, self.ncols)
+            return (max(0, int(x.min()) - margin), min(self.nrows, int(x.max()) + margin + 1),
+                    max(0, int(y.min()) - margin), min(self.ncols, int(y.max()) + margin + 1))
+        def overlap(a, b):
+            return a[0] < b[1] and b[0] < a[1] and a[2] < b[3] and b[2] < a[3]
+        # one cluster per cell the seeds are in, to start with
+        clusters = [[group, 8, window(group, 8)] for group in np.split(seeds, np.flatnonzero(np.diff(seeds // states_per_cell)) + 1)]
+        results = {} # cluster id -> (closed pieces, whether it has an open piece)
+        pending = list(range(len(clusters)))
+        while pending:
+            k = pending.pop()
+            if clusters[k] is None:
+                continue
+            seeds_k, margin, box = clusters[k]
+            other = next((j for j, cluster in enumerate(clusters) if j != k and cluster is not None and overlap(box, cluster[2])), None)
+            if other is not None:
+                seeds_j, margin_j = clusters[other][:2]
+                merged = np.union1d(seeds_k, seeds_j)
+                margin = max(margin, margin_j)
+                clusters[k] = clusters[other] = None
+                results.pop(other, None)
+                clusters.append([merged, margin, window(merged, margin)])
+                pending.append(len(clusters) - 1)
+                continue
+            conclusive, closed, has_open = self.check_window(label, seeds_k, box)
+            if conclusive or box == (0, self.nrows, 0, self.ncols):
+                results[k] = (closed, has_open)
+            else:
+                clusters[k] = [seeds_k, margin * 2, window(seeds_k, margin * 2)]
+                pending.append(k)
+        closed = [piece for (pieces, has_open) in results.values() for piece in pieces]
+        if closed and not any(has_open for (pieces, has_open) in results.values()):
+            del closed[max(range(len(closed)), key = lambda i: len(closed[i]))] # every piece is whole, the largest keeps the label
+        for piece in closed:
+            self.labels[piece] = self.next_label
+            self.next_label += 1
+
+    # this function returns the component of a state (packed or tuple), -1 if
+    # its cell is known to be blocked
+    def component(self, state):
+        sid = state if is_packed(state) else encode_state(state, self.ncols)
+        if self.labels is None:
+            self.label_all()
+        label = int(self.labels[sid])
+        if label in self.seeds:
+            self.split(label)
+            label = int(self.labels[sid])
+        return label
+
+    # this function checks whether goal can be reached from start over the
+    # known state graph
+    def reachable(self, start, goal):
+        start_label = self.component(start)
+        goal_label = self.component(goal) # only checks goal's component, start's label stays valid
+        return start_label != -1 and start_label == goal_label
+
+# with indexed_frontier = True the frontier is an indexed heap with real
+# decrease-key (see Frontier_PQ), and if a frontier_stats dict is given it is
+# filled with the queue's counters when the search returns
+# with a Planner_Stats as stats the search also counts expansions, stale pops
+# (states popped again after they were expanded), relaxations, heuristic calls
+# and successor lookups, and times the heuristic, successor and heap phases
+def astar_search(start, goal, state_graph, state_lattice, heuristic, return_cost = False, return_nexp = False, indexed_frontier = False, frontier_stats = None, stats = None):
+    # integer state ids of an array-backed graph get a flat closed set, other
+    # states use hashing
+    num_states = getattr(state_graph, 'num_nodes', None) if is_packed(start) else None
+    if num_states is not None and num_states > flat_state_limit:
+        num_states = None
+    my_frontier = Frontier_PQ(start, indexed = indexed_frontier) # create a priority queue
+    visited = Closed_Set(num_states) # states that were already expanded
     prev = {start : None} # initialize prev dictionary (keys are successors, values are predecessors)
+    successors_of = get_successors
+    if stats is not None:
+        search_started = time.perf_counter()
+        heuristic = stats.timed('heuristic', heuristic)
+        successors_of = stats.timed('successors', get_successors)
+        my_frontier.add = stats.timed('frontier_push', my_frontier.add)
+        my_frontier.pop = stats.timed('frontier_pop', my_frontier.pop)
+    # this function records the search's counters, at both ways out of the search
+    def finish_search():
+        if frontier_stats is not None:
+            frontier_stats.update(my_frontier.stats())
+        if stats is not None:
+            stats.add_time('search', time.perf_counter() - search_started)
+            queue_counters = my_frontier.stats()
+            stats.count('searches')
+            stats.count('expansions', len(visited))
+            stats.count('stale_pops', queue_counters['pops'] - len(visited))
+            stats.count('relaxations', stats.counters.pop('frontier_push_calls'))
+            stats.counters.pop('frontier_pop_calls')
+            for name in ('pushes', 'pops', 'decrease_keys'):
+                stats.count(name, queue_counters[name])
+            stats.counters['peak_frontier'] = max(stats.counters.get('peak_frontier', 0), queue_counters['peak_size'])
+
     while (my_frontier.q): # while the priority queue is not empty
         x = my_frontier.pop() # pop state off of queue (with heapq it will be the lowest cost tuple)
         if x[1] not in visited: # if we haven't visited the state yet
-            visited.append(x[1])
+            visited.add(x[1])
             if x[1] == goal: # We found it!
+                finish_search()
                 if return_nexp: # return number of nodes expanded
                     solution_path = path(prev, x[1])
                     nexp = len(visited) # number of nodes expanded is the number of nodes visited
@@ -693,13 +2271,14 @@ def astar_search(start, goal, state_graph, state_lattice, heuristic, return_cost
                     else:
                         return path(prev, x[1])
             else: # we haven't found the goal yet...
-                for neighbor in state_graph[x[1]]:
+                successors = successors_of(state_graph, x[1]) # look the neighbors up once per expansion
+                for neighbor in successors:
                     if neighbor not in visited:
                         if neighbor not in prev:
                             # add neighbor as key and current state as value
                             prev[neighbor] = x[1] # x[1] is predecessor to neighbor
                         current_cost = my_frontier.states[x[1]]
-                        additional_cost = state_graph[x[1]][neighbor]
+                        additional_cost = successors[neighbor]
                         new_cost = current_cost + additional_cost
                         heuristic_score = heuristic(neighbor, goal)
                         astar_score = new_cost + heuristic_score
@@ -710,114 +2289,1192 @@ def astar_search(start, goal, state_graph, state_lattice, heuristic, return_cost
                             # update states dictionary if cheaper path is found
                             my_frontier.replace(neighbor, new_cost)
                             prev[neighbor] = x[1]
+    finish_search()
 
-# main function
-def main():
-    # define parameters (rows, columns, vision, start state, goal state, probability distribution)
-    # comment out either the user option or the hard coded option
-    # user (raw input option)
-    nrows = int(input("Number of Rows? (int) " ))
-    ncols = int(input("Number of Columns? (int) "))
-    agent_vision = int(input("Agent vision distance? (int) "))
-    start=[]
-    goal=[]
-    startInp = input("Start Position? X,Y,[north,south,east,west],[center,left,right] ")
-    startInp=startInp.split(",")
-    startInp[0]=int(startInp[0])
-    startInp[1]=int(startInp[1])
-    for i in heading:
-        if(startInp[2]==i):
-            startInp[2]=i
-    start=tuple(startInp)
-    goalInp = input("Goal Position? X,Y,[north,south,east,west],[center,left,right] ")
-    goalInp=goalInp.split(",")
-    goalInp[0]=int(goalInp[0])
-    goalInp[1]=int(goalInp[1])
-    for i in angle:
-        if(goalInp[2]==i):
-            goalInp[2]=i
-    goal=tuple(goalInp)
-    p1=float(input("Probability of an obstacle in any given location? (float between 0 and 1) "))
-    p2=1-p1
-    prob=[p2,p1]
+# this function is a bidirectional version of astar_search for long start to
+# goal distances - one search grows forward from 'start' over successors and
+# one grows backward from 'goal' over predecessors (the reverse of the same
+# motion primitives, see get_predecessors)
+# it is the meet in the middle variant (MM, Holte et al.): states are queued
+# by max(g + h, 2g), so neither side searches past half the path cost, and
+# the side with the lower queue top is expanded next
+# the backward side is guided by heuristic(start, state), the estimated cost
+# from the start to the state, so the heuristic has to be cheap for any pair
+# of states (euclidean_distance, chebyshev_distance, Heuristic_LUT - not
+# Cost_Field_Heuristic, which builds a field per goal)
+# the searches meet on full states (x, y, heading, angle) - being in the same
+# cell with another heading or wheel angle is not a meeting, since the
+# vehicle cannot turn on the spot - and every state one side reaches that the
+# other side has a cost for gives a candidate path of cost g_forward + g_backward
+# the search stops when both queue tops are no less than the best candidate,
+# a lower bound on any path not found yet, so with an admissible heuristic the
+# path is optimal like astar_search's (states whose cost drops after expansion
+# are reopened), and it returns the same values as astar_search with nexp the
+# expansions of both sides
+def bidirectional_astar_search(start, goal, state_graph, state_lattice, heuristic, return_cost = False, return_nexp = False):
+    g = ({start : 0}, {goal : 0}) # cost from start (forward) and to goal (backward)
+    prev = ({start : None}, {goal : None}) # forward: predecessor, backward: next state to the goal
+    h = ({}, {})
+    closed = (set(), set())
+    def priority(side, state):
+        if state not in h[side]:
+            h[side][state] = heuristic(state, goal) if side == 0 else heuristic(start, state)
+        return max(g[side][state] + h[side][state], 2 * g[side][state])
+    queues = ([(priority(0, start), start)], [(priority(1, goal), goal)])
+    expand = (get_successors, get_predecessors)
+    best_cost = 0 if start == goal else float('inf')
+    meet = start if start == goal else None
+    nexp = 0
+    while queues[0] and queues[1]:
+        # drop stale entries (expanded states, or costs that were improved since)
+        for side in (0, 1):
+            q = queues[side]
+            while q and (q[0][1] in closed[side] or q[0][0] != priority(side, q[0][1])):
+                heapq.heappop(q)
+        if not queues[0] or not queues[1]:
+            break
+        if min(queues[0][0][0], queues[1][0][0]) >= best_cost:
+            break
+        side = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+        other = 1 - side
+        state = heapq.heappop(queues[side])[1]
+        closed[side].add(state)
+        nexp += 1
+        neighbors = expand[side](state_graph, state)
+        for neighbor in neighbors:
+            new_cost = g[side][state] + neighbors[neighbor]
+            if neighbor not in g[side] or new_cost < g[side][neighbor]:
+                g[side][neighbor] = new_cost
+                prev[side][neighbor] = state
+                closed[side].discard(neighbor) # reopen
+                heapq.heappush(queues[side], (priority(side, neighbor), neighbor))
+                if neighbor in g[other] and new_cost + g[other][neighbor] < best_cost:
+                    best_cost = new_cost + g[other][neighbor]
+                    meet = neighbor
+    if meet is None:
+        return None
+    # forward half up to the meeting state, then the backward half to the goal
+    solution_path = path(prev[0], meet)
+    state = prev[1][meet]
+    while state is not None:
+        solution_path.append(state)
+        state = prev[1][state]
+    if return_nexp:
+        if return_cost:
+            return (solution_path, pathcost(solution_path, state_graph), nexp)
+        return (solution_path, nexp)
+    if return_cost:
+        return (solution_path, pathcost(solution_path, state_graph))
+    return solution_path
 
-    # Hard coded option
-    '''nrows = 10
-    ncols = 10
-    prob = [0.7, 0.3]
-    start = (0,0,s,c)
-    goal = (9,9,s,c)
-    agent_vision = 5'''
+# this class restricts a packed state graph to the cells of one tile, for the
+# searches that refine a hierarchical plan inside a tile
+class Tile_View:
+    def __init__(self, state_graph, ncols, bounds):
+        self.graph = state_graph
+        self.ncols = ncols
+        self.bounds = bounds
 
-    # construct state lattice and state graph
-    state_lattice = build_state_lattice(nrows, ncols, prob)
-    state_graph_init = build_state_graph(state_lattice)
-    state_graph_complete = assign_edges(state_lattice, state_graph_init)
-    agent_state_graph = state_graph_complete # agent starts by thinking entire state space is free
+    def inside(self, sid):
+        x0, x1, y0, y1 = self.bounds
+        x, y = divmod(sid // states_per_cell, self.ncols)
+        return x0 <= x < x1 and y0 <= y < y1
 
-    # in the case that the randomization blocked our start or goal states
-    # we unblock them ;)
-    if(state_lattice[start[0]][start[1]]==1):
-        state_lattice[start[0]][start[1]]=0
-    if(state_lattice[goal[0]][goal[1]]==1):
-        state_lattice[goal[0]][goal[1]]=0
+    def __call__(self, sid):
+        return {state : cost for state, cost in get_successors(self.graph, sid).items() if self.inside(state)}
+
+# this class is a hierarchical planner (HPA*, Botea, Mueller and Schaeffer)
+# for big maps - the lattice is cut into tile_size x tile_size tiles, every
+# open stretch of the border between two tiles gets one entrance (the
+# straight, wheels centered moves across the border at its middle cells,
+# forward and in reverse), and the costs between the
+# entrance states of a tile are found by a breadth first search inside the
+# tile and cached
+# plan() searches this small abstract graph first and then refines only the
+# tiles along the abstract route with astar_search inside each tile, so the
+# search effort grows with the number of tiles crossed rather than the number
+# of states - plans are close to optimal but not guaranteed optimal, and when
+# the abstract graph has no route (an opening too tight for the one entrance
+# per stretch) it falls back to a flat astar_search, so no plan is missed
+# states are packed ints and state_graph may be any packed lattice graph (the
+# agent's Knowledge_Overlay in run_episode); when cells get blocked tell the
+# planner with block_cells, which drops the cached costs of the tiles (and
+# borders) containing them only, to be recomputed when a plan needs them
+class Tile_Planner:
+    def __init__(self, state_graph, nrows, ncols, tile_size = 16):
+        self.graph = state_graph
+        self.nrows = nrows
+        self.ncols = ncols
+        self.tile_size = tile_size
+        self.borders = {} # (tile, neighbor tile) -> [(exit state, entry state, cost)]
+        self.tile_nodes = {} # tile -> (entry states, {exit state : {entry state : cost}})
+        self.tile_edges = {} # tile -> {entry state : {exit state : cost}}
+        self.tiles_computed = 0
+        # unit cost moves per (heading, angle) group as (dx, dy, new group),
+        # forward and reversed, for the breadth first searches
+        self.moves = {}
+        for (table, key) in ((motion_primitives, 'forward'), (reverse_motion_primitives, 'reverse')):
+            moves = [[] for _ in range(states_per_cell)]
+            for (h, a), prims in table.items():
+                group = heading_index[h] * len(angle) + angle_index[a]
+                for (dx, dy, h2, a2, cost) in prims:
+                    if cost > 0:
+                        moves[group].append((dx, dy, heading_index[h2] * len(angle) + angle_index[a2]))
+            self.moves[key] = moves
+        self.move_shifts = {}
+
+    def tile_of(self, sid):
+        x, y = state_cell(sid, self.ncols)
+        return (x // self.tile_size, y // self.tile_size)
+
+    def bounds(self, tile):
+        x0 = tile[0] * self.tile_size
+        y0 = tile[1] * self.tile_size
+        return (x0, min(self.nrows, x0 + self.tile_size), y0, min(self.ncols, y0 + self.tile_size))
+
+    # the moves across the border between 'tile' and the tile to its south
+    # (side 0) or east (side 1) - for each open stretch of border cells, the
+    # moves from its middle cell pair into the other tile, both ways
+    def border(self, tile, side):
+        key = (tile, side)
+        if key in self.borders:
+            return self.borders[key]
+        x0, x1, y0, y1 = self.bounds(tile)
+        other = (tile[0] + 1, tile[1]) if side == 0 else (tile[0], tile[1] + 1)
+        transitions = []
+        if (side == 0 and x1 < self.nrows) or (side == 1 and y1 < self.ncols):
+            # cell pairs (a in tile, b in other) along the border
+            if side == 0:
+                pairs = [((x1 - 1, y), (x1, y)) for y in range(y0, y1)]
+            else:
+                pairs = [((x, y1 - 1), (x, y1)) for x in range(x0, x1)]
+            runs = []
+            for i, (a, b) in enumerate(pairs):
+                if cell_in_graph(self.graph, *a) and cell_in_graph(self.graph, *b):
+                    if runs and runs[-1][-1] == i - 1:
+                        runs[-1].append(i)
+                    else:
+                        runs.append([i])
+            for run in runs:
+                a, b = pairs[run[len(run) // 2]]
+                for (cell, target) in ((a, other), (b, tile)):
+                    first = (cell[0] * self.ncols + cell[1]) * states_per_cell
+                    # straight moves (wheels centered) only, to keep the abstract graph small
+                    for sid in range(first, first + states_per_cell, len(angle)):
+                        for succ, cost in get_successors(self.graph, sid).items():
+                            if self.tile_of(succ) == target:
+                                transitions.append((sid, succ, cost))
+        self.borders[key] = transitions
+        return transitions
+
+    # the entry states of a tile and the moves out of its exit states
+    def nodes(self, tile):
+        if tile in self.tile_nodes:
+            return self.tile_nodes[tile]
+        transitions = []
+        for (neighbor, side) in ((tile, 0), (tile, 1), ((tile[0] - 1, tile[1]), 0), ((tile[0], tile[1] - 1), 1)):
+            if neighbor[0] >= 0 and neighbor[1] >= 0:
+                transitions.extend(self.border(neighbor, side))
+        entries = set()
+        exits = {}
+        for (u, v, cost) in transitions:
+            if self.tile_of(v) == tile:
+                entries.add(v)
+            if self.tile_of(u) == tile:
+                exits.setdefault(u, {})[v] = cost
+        self.tile_nodes[tile] = (entries, exits)
+        return self.tile_nodes[tile]
+
+    # breadth first search inside a tile from each of 'sources' at once (all
+    # moves but the free self loops cost 1) - returns the cost array
+    # [source, group, x - x0, y - y0], -1 where unreachable
+    def tile_distances(self, tile, sources, direction = 'forward'):
+        x0, x1, y0, y1 = self.bounds(tile)
+        free = np.array([[cell_in_graph(self.graph, x, y) for y in range(y0, y1)] for x in range(x0, x1)], dtype = bool)
+        dist = np.full((len(sources), states_per_cell, x1 - x0, y1 - y0), -1, dtype = np.int32)
+        frontier = np.zeros(dist.shape, dtype = bool)
+        for i, sid in enumerate(sources):
+            cell, group = divmod(sid, states_per_cell)
+            x, y = divmod(cell, self.ncols)
+            frontier[i, group, x - x0, y - y0] = free[x - x0, y - y0]
+        dist[frontier] = 0
+        shifts = self.shifts(direction, x1 - x0, y1 - y0)
+        step = 0
+        while frontier.any():
+            step += 1
+            reached = np.zeros(dist.shape, dtype = bool)
+            active = frontier.any(axis = (0, 2, 3))
+            for (group, group2, target, source) in shifts:
+                if active[group]:
+                    reached[(slice(None), group2) + target] |= frontier[(slice(None), group) + source]
+            frontier = reached & free & (dist < 0)
+            dist[frontier] = step
+        return dist
+
+    # the moves of tile_distances as (group, new group, target slices,
+    # source slices) for a tile of nx x ny cells
+    def shifts(self, direction, nx, ny):
+        key = (direction, nx, ny)
+        if key not in self.move_shifts:
+            shifts = []
+            for group, moves in enumerate(self.moves[direction]):
+                for (dx, dy, group2) in moves:
+                    if abs(dx) < nx and abs(dy) < ny:
+                        shifts.append((group, group2,
+                                       (slice(max(0, dx), nx + min(0, dx)), slice(max(0, dy), ny + min(0, dy))),
+                                       (slice(max(0, -dx), nx + min(0, -dx)), slice(max(0, -dy), ny + min(0, -dy)))))
+            self.move_shifts[key] = shifts
+        return self.move_shifts[key]
+
+    # the cost of reaching each of 'targets' in a cost array from tile_distances
+    def costs_to(self, tile, dist, targets):
+        x0, y0 = self.bounds(tile)[::2]
+        costs = {}
+        for sid in targets:
+            cell, group = divmod(sid, states_per_cell)
+            x, y = divmod(cell, self.ncols)
+            d = dist[group, x - x0, y - y0]
+            if d >= 0:
+                costs[sid] = int(d)
+        return costs
+
+    # the cached costs from each entry state of a tile to its exit states
+    def edges(self, tile):
+        if tile in self.tile_edges:
+            return self.tile_edges[tile]
+        entries, exits = self.nodes(tile)
+        entries = sorted(entries)
+        edges = {}
+        if entries and exits:
+            dist = self.tile_distances(tile, entries)
+            for i, entry in enumerate(entries):
+                edges[entry] = self.costs_to(tile, dist[i], exits)
+        self.tile_edges[tile] = edges
+        self.tiles_computed += 1
+        return edges
+
+    # forget the cached costs that depend on the given (x,y) cells
+    def block_cells(self, cells):
+        for (x, y) in cells:
+            tile = (x // self.tile_size, y // self.tile_size)
+            self.tile_edges.pop(tile, None)
+            x0, x1, y0, y1 = self.bounds(tile)
+            if x in (x0, x1 - 1) or y in (y0, y1 - 1):
+                # a border cell - the entrances of the tile and its neighbors change
+                for key in ((tile, 0), (tile, 1), ((tile[0] - 1, tile[1]), 0), ((tile[0], tile[1] - 1), 1)):
+                    self.borders.pop(key, None)
+                for neighbor in (tile, (tile[0] - 1, tile[1]), (tile[0] + 1, tile[1]), (tile[0], tile[1] - 1), (tile[0], tile[1] + 1)):
+                    self.tile_nodes.pop(neighbor, None)
+                    self.tile_edges.pop(neighbor, None)
+
+    # plans from start to goal (packed states), with the same return values
+    # as astar_search - nexp counts the abstract and the refining expansions
+    def plan(self, start, goal, heuristic, return_cost = False, return_nexp = False):
+        start_tile = self.tile_of(start)
+        goal_tile = self.tile_of(goal)
+        # connect start and goal to the entrances of their tiles
+        targets = list(self.nodes(start_tile)[1])
+        if goal_tile == start_tile:
+            targets.append(goal)
+        start_edges = self.costs_to(start_tile, self.tile_distances(start_tile, [start])[0], targets)
+        goal_entries = self.nodes(goal_tile)[0]
+        goal_costs = self.costs_to(goal_tile, self.tile_distances(goal_tile, [goal], 'reverse')[0], goal_entries)
+
+        def abstract_successors(node):
+            if node == start:
+                return start_edges
+            tile = self.tile_of(node)
+            successors = dict(self.nodes(tile)[1].get(node, {}))
+            successors.update(self.edges(tile).get(node, {}))
+            if tile == goal_tile and node in goal_costs:
+                successors[goal] = goal_costs[node]
+            return successors
+
+        abstract = astar_search(start, goal, abstract_successors, None, heuristic, return_nexp = True)
+        if abstract is None: # no route through the entrances, search the whole graph
+            return astar_search(start, goal, self.graph, None, heuristic, return_cost = return_cost, return_nexp = return_nexp)
+        route, nexp = abstract
+        # refine: crossings are single moves, the legs inside a tile are searched in the tile
+        solution_path = [start]
+        for u, v in zip(route, route[1:]):
+            if self.tile_of(u) != self.tile_of(v):
+                solution_path.append(v)
+                continue
+            leg = astar_search(u, v, Tile_View(self.graph, self.ncols, self.bounds(self.tile_of(u))), None, heuristic, return_nexp = True)
+            if leg is None: # the cached tile costs were stale, search the whole graph
+                return astar_search(start, goal, self.graph, None, heuristic, return_cost = return_cost, return_nexp = return_nexp)
+            solution_path.extend(leg[0][1:])
+            nexp += leg[1]
+        if return_nexp:
+            if return_cost:
+                return (solution_path, pathcost(solution_path, self.graph), nexp)
+            return (solution_path, nexp)
+        if return_cost:
+            return (solution_path, pathcost(solution_path, self.graph))
+        return solution_path
+
+# this function tells whether a heuristic never overestimates the lattice cost
+# to go - chebyshev_distance, Cost_Field_Heuristic and a Heuristic_LUT whose
+# fallback is admissible do, euclidean_distance does not (a diagonal move
+# costs 1 but covers sqrt(2)), and other heuristics can say so with an
+# 'admissible' attribute
+def is_admissible(heuristic):
+    if isinstance(heuristic, Packed_Heuristic):
+        return is_admissible(heuristic.heuristic)
+    if isinstance(heuristic, Heuristic_LUT):
+        return is_admissible(heuristic.fallback)
+    return heuristic is chebyshev_distance or isinstance(heuristic, Cost_Field_Heuristic) or getattr(heuristic, 'admissible', False)
+
+# this function is an anytime planner (ARA*, Likhachev, Gordon and Thrun) for
+# when some plan is needed within a deadline - it first searches with the
+# heuristic inflated by 'epsilon', which finds a solution after few
+# expansions, then lowers the weight by 'epsilon_step' at a time down to 1 and
+# improves the solution, reusing the g values and the frontier of the earlier
+# iterations instead of starting over (only the states whose cost dropped
+# after they were expanded are queued again)
+# the search stops when the weight reaches 1 (the plan is optimal) or when the
+# budget runs out - time_limit seconds of wall clock and / or max_expansions
+# expanded states - and returns the best plan found so far, with the same
+# return values as astar_search (nexp counts the expansions of every iteration)
+# if the budget runs out before the goal is reached it returns the path to the
+# reached state that looks closest to the goal, so the agent can still make
+# progress, and None only when the goal is unreachable
+# if a solutions list is given, one dict per plan found is appended to it
+# with the plan's cost, the weight, its suboptimality bound (the plan costs at
+# most bound times the optimum), the expansions so far and the time it took,
+# and 'complete' False for a partial plan
+# the bound only holds for an admissible heuristic, so it is None unless
+# is_admissible(heuristic) - with the default euclidean_distance, which
+# overestimates diagonal moves, no bound is claimed
+def ara_star_search(start, goal, state_graph, state_lattice, heuristic, epsilon = 3.0, epsilon_step = 0.5, time_limit = None, max_expansions = None, return_cost = False, return_nexp = False, solutions = None):
+    started = time.perf_counter()
+    deadline = started + time_limit if time_limit is not None else None
+    g = {start : 0}
+    prev = {start : None}
+    h = {} # heuristic values, computed once per state for all iterations
+    def key(state):
+        if state not in h:
+            h[state] = heuristic(state, goal)
+        return g[state] + epsilon * h[state]
+    open_q = [(key(start), start)] # heap with lazy deletion - stale entries are skipped
+    closed = set() # states expanded in this iteration
+    incons = set() # states whose cost dropped after they were expanded
+    nexp = 0
+    best = None # (path, cost, bound) of the best complete plan so far
+    out_of_budget = False
+    bounded = is_admissible(heuristic)
+
+    # lowest g + h over the states still to be expanded, for the bound
+    def lower_bound():
+        values = [g[state] + h[state] for f, state in open_q if f == key(state) and state not in closed]
+        values.extend(g[state] + h[state] for state in incons)
+        return min(values) if values else None
+
+    # record the plan to the goal as it stands now
+    def publish():
+        solution_path = path(prev, goal)
+        solution_cost = pathcost(solution_path, state_graph)
+        low = lower_bound()
+        if not bounded:
+            bound = None
+        elif low is None: # nothing left to expand, the cost is exact
+            bound = 1.0
+        elif low <= 0:
+            bound = epsilon
+        else:
+            bound = min(epsilon, max(1.0, g[goal] / low))
+        if solutions is not None:
+            solutions.append({'cost' : solution_cost, 'epsilon' : epsilon, 'bound' : bound,
+                              'expansions' : nexp, 'time' : time.perf_counter() - started,
+                              'complete' : True})
+        return (solution_path, solution_cost, bound)
+
+    while True:
+        # improve the current solution with the current weight
+        while open_q:
+            f, state = open_q[0]
+            if state in closed or f != key(state): # stale entry
+                heapq.heappop(open_q)
+                continue
+            if goal in g and key(goal) <= f:
+                break
+            if nexp > 0 and ((max_expansions is not None and nexp >= max_expansions) or
+                             (deadline is not None and time.perf_counter() >= deadline)):
+                out_of_budget = True
+                break
+            heapq.heappop(open_q)
+            closed.add(state)
+            nexp += 1
+            successors = get_successors(state_graph, state)
+            for neighbor in successors:
+                new_cost = g[state] + successors[neighbor]
+                if neighbor not in g or new_cost < g[neighbor]:
+                    g[neighbor] = new_cost
+                    prev[neighbor] = state
+                    if neighbor in closed:
+                        incons.add(neighbor)
+                    else:
+                        heapq.heappush(open_q, (key(neighbor), neighbor))
+        if goal in g and (best is None or g[goal] <= best[1]):
+            best = publish()
+        if out_of_budget or goal not in g or epsilon <= 1:
+            break
+        # lower the weight, queue the inconsistent states again and re-key the frontier
+        epsilon = max(1.0, epsilon - epsilon_step)
+        queued = {state for f, state in open_q if state not in closed} | incons
+        open_q = [(key(state), state) for state in queued]
+        heapq.heapify(open_q)
+        closed = set()
+        incons = set()
+
+    if best is not None:
+        solution_path, solution_cost = best[0], best[1]
+    else:
+        if not out_of_budget: # the whole reachable space was searched
+            return None
+        # no plan to the goal yet - head for the reached state nearest to it by the heuristic
+        reached = [state for state in g if state != start]
+        nearest = min(reached, key = lambda state: (h.get(state, float('inf')), g[state]))
+        solution_path = path(prev, nearest)
+        solution_cost = pathcost(solution_path, state_graph)
+        if solutions is not None:
+            solutions.append({'cost' : solution_cost, 'epsilon' : epsilon, 'bound' : None,
+                              'expansions' : nexp, 'time' : time.perf_counter() - started,
+                              'complete' : False})
+    if return_nexp:
+        if return_cost:
+            return (solution_path, solution_cost, nexp)
+        return (solution_path, nexp)
+    if return_cost:
+        return (solution_path, solution_cost)
+    return solution_path
+
+# this class keeps the agent's current plan between replans and repairs it
+# instead of planning from scratch - when new knowledge breaks the plan, only
+# the broken stretch is searched again, from the last valid state before it
+# to a state 'lookahead' steps past it (room to get the heading and wheels
+# back onto the old plan), and the rest of the plan is kept
+# a repair is a budgeted A* (ara_star_search with weight 1 and at most
+# max_expansions expansions) and is given up - repair returns None and the
+# caller should replan fully - when it finds no way back onto the plan or the
+# detour costs more than repair_bound times the stretch it replaces
+# a plan that new knowledge did not break is handed back as it is and counted
+# in 'reuses', 'repairs' only counts plans that needed a search
+# states are packed ints or tuples, whatever the plan was made of
+class Plan_Cache:
+    def __init__(self, repair_bound = 3.0, lookahead = 4, max_expansions = 20000):
+        self.repair_bound = repair_bound
+        self.lookahead = lookahead
+        self.max_expansions = max_expansions
+        self.plan = None
+        self.step_costs = None
+        self.repairs = 0
+        self.reuses = 0
+        self.failed_repairs = 0
+        self.last_nexp = 0 # expansions of the last repair, successful or not
+        self.last_reused = False # whether the last plan handed back was reused unchanged
+
+    # remember a plan and the cost of each of its steps
+    def set(self, plan, state_graph):
+        self.plan = list(plan)
+        self.step_costs = [get_successors(state_graph, a)[b] for a, b in zip(plan, plan[1:])]
+
+    # index of the first step of 'plan' from 'begin' on that the graph no longer has
+    def first_invalid(self, plan, state_graph, begin = 0):
+        for k in range(begin, len(plan) - 1):
+            if plan[k + 1] not in get_successors(state_graph, plan[k]):
+                return k
+        return None
+
+    # returns the cached plan from 'state' on, repaired against state_graph,
+    # as (path, cost, nodes expanded) like astar_search, or None
+    def repair(self, state, state_graph, state_lattice, heuristic):
+        self.last_nexp = 0
+        self.last_reused = False
+        if self.plan is None or state not in self.plan:
+            return None
+        i = self.plan.index(state)
+        plan = self.plan[i:]
+        step_costs = self.step_costs[i:]
+        k = self.first_invalid(plan, state_graph)
+        if k is None:
+            self.reuses += 1
+            self.last_reused = True
+            return (plan, sum(step_costs), 0)
+        while k is not None:
+            # skip the blocked stretch, then go 'lookahead' steps further
+            j = k + 1
+            while j < len(plan) - 1 and plan[j] not in state_graph:
+                j += 1
+            j = min(j + self.lookahead, len(plan) - 1)
+            if plan[j] not in state_graph:
+                self.failed_repairs += 1
+                return None
+            result = ara_star_search(plan[k], plan[j], state_graph, state_lattice, heuristic, epsilon = 1.0,
+                                     max_expansions = self.max_expansions, return_cost = True, return_nexp = True)
+            if result is not None:
+                self.last_nexp += result[2]
+            if result is None or result[0][-1] != plan[j] or result[1] > self.repair_bound * max(1, sum(step_costs[k:j])):
+                self.failed_repairs += 1
+                return None
+            detour = result[0]
+            detour_costs = [get_successors(state_graph, a)[b] for a, b in zip(detour, detour[1:])]
+            plan = plan[:k] + detour + plan[j + 1:]
+            step_costs = step_costs[:k] + detour_costs + step_costs[j:]
+            k = self.first_invalid(plan, state_graph, k + len(detour) - 1)
+        self.repairs += 1
+        self.plan = plan
+        self.step_costs = step_costs
+        return (plan, sum(step_costs), self.last_nexp)
+
+# this function is a backward Dijkstra search from 'goal' over the
+# predecessors of the state graph (the reverse motion primitives, see
+# get_predecessors) - it returns the cost to go to the goal of every state
+# that can reach it, the next state on a cheapest path from each of them
+# (None for the goal) and the number of states it expanded
+def reverse_dijkstra(goal, state_graph):
+    cost_to_go = {goal : 0}
+    next_state = {goal : None}
+    expanded = set()
+    queue = [(0, goal)]
+    while queue:
+        cost, state = heapq.heappop(queue)
+        if state in expanded:
+            continue
+        expanded.add(state)
+        for pred, step_cost in get_predecessors(state_graph, state).items():
+            new_cost = cost + step_cost
+            if new_cost < cost_to_go.get(pred, np.inf):
+                cost_to_go[pred] = new_cost
+                next_state[pred] = state
+                heapq.heappush(queue, (new_cost, pred))
+    return cost_to_go, next_state, len(expanded)
+
+# this class answers many starts heading to the same goals (a fleet sharing
+# a few docks) - one reverse_dijkstra tree is kept per goal, and a plan from
+# any start is read off the tree by following the next state pointers, with
+# no search
+# at most 'capacity' trees are kept, the least recently used one is dropped
+# when another goal comes in
+# block_cells (fed with the cells update_knowledge reports) marks every tree
+# as built on older knowledge - removing cells only makes cost to go higher,
+# so a stale tree still gives a cheapest plan for a start whose pointer chain
+# avoids the cells now known blocked, and the tree is built again only when
+# the chain runs into one
+# the graph is the agent's knowledge object (e.g. a Knowledge_Overlay), which
+# update_knowledge changes in place
+class Goal_Tree_Cache:
+    def __init__(self, state_graph, capacity = 8):
+        self.graph = state_graph
+        self.capacity = capacity
+        self.trees = {} # goal -> (cost to go, next state, knowledge version), least recently used first
+        self.version = 0
+        self.builds = 0
+        self.hits = 0
+        self.evictions = 0
+        self.last_nexp = 0 # expansions of the tree built by the last plan, 0 if none was
+
+    def block_cells(self, cells):
+        if len(cells):
+            self.version += 1
+
+    # this function returns the tree of a goal, building it if needed
+    def tree(self, goal):
+        entry = self.trees.pop(goal, None)
+        if entry is None:
+            cost_to_go, next_state, nexp = reverse_dijkstra(goal, self.graph)
+            entry = (cost_to_go, next_state, self.version)
+            self.builds += 1
+            self.last_nexp += nexp
+            if len(self.trees) >= self.capacity:
+                del self.trees[next(iter(self.trees))]
+                self.evictions += 1
+        else:
+            self.hits += 1
+        self.trees[goal] = entry
+        return entry
+
+    def follow(self, start, next_state):
+        solution_path = []
+        s = start
+        while s is not None:
+            solution_path.append(s)
+            s = next_state[s]
+        return solution_path
+
+    # returns the same values as astar_search, where nexp is the expansions of
+    # the tree built for this plan (0 when a cached tree answered it)
+    def plan(self, start, goal, return_cost = False, return_nexp = False):
+        self.last_nexp = 0
+        cost_to_go, next_state, version = self.tree(goal)
+        if start in cost_to_go:
+            solution_path = self.follow(start, next_state)
+            if version != self.version and any(state not in self.graph for state in solution_path):
+                del self.trees[goal]
+                cost_to_go, next_state, version = self.tree(goal)
+                self.hits -= 1
+                solution_path = self.follow(start, next_state) if start in cost_to_go else None
+        else: # knowledge only loses cells, a start cut off from the goal stays cut off
+            solution_path = None
+        if solution_path is None:
+            return None
+        if return_nexp:
+            if return_cost:
+                return (solution_path, cost_to_go[start], self.last_nexp)
+            return (solution_path, self.last_nexp)
+        if return_cost:
+            return (solution_path, cost_to_go[start])
+        return solution_path
+
+    def stats(self):
+        return {'trees' : len(self.trees), 'builds' : self.builds, 'hits' : self.hits, 'evictions' : self.evictions}
+
+# this class is an incremental replanner (D* Lite, Koenig and Likhachev) for
+# the sense-plan-act loop in main - it searches backwards from the goal and
+# keeps its g/rhs values between replans, so when update_knowledge reports
+# newly blocked cells only the part of the search tree that depended on them
+# is repaired instead of running a fresh astar_search from the agent
+# g[s] is the cost to go from s that the search has settled on and rhs[s] is
+# the one step lookahead min over successors s' of cost(s,s') + g[s']
+# the heuristic should be consistent (chebyshev_distance, the default, is) for
+# the repaired plans to stay optimal
+# states may be tuples or packed ints, the planner works in whichever form the
+# goal is given in (a tuple heuristic is wrapped for packed states)
+class DStar_Lite:
+    def __init__(self, start, goal, state_graph, state_lattice, heuristic = None):
+        self.start = start
+        self.goal = goal
+        self.state_graph = state_graph
+        self.nrows = len(state_lattice)
+        self.ncols = len(state_lattice[0])
+        self.packed = is_packed(goal)
+        if heuristic is None:
+            heuristic = Packed_Heuristic(chebyshev_distance, self.ncols) if self.packed else chebyshev_distance
+        self.heuristic = heuristic
+        self.km = 0 # key modifier, grows as the agent moves
+        self.last = start
+        self.g = {}
+        self.rhs = {goal : 0}
+        self.U = {} # states on the queue and their current keys
+        self.q = []
+        self.nexp = 0 # nodes expanded by the last replan
+        self.total_nexp = 0
+        self.nexp_per_replan = []
+        self.push(goal)
+
+    def key(self, state):
+        best = min(self.g.get(state, float('inf')), self.rhs.get(state, float('inf')))
+        return (best + self.heuristic(state, self.start) + self.km, best)
+
+    def push(self, state):
+        k = self.key(state)
+        self.U[state] = k
+        heapq.heappush(self.q, (k, state))
+
+    # drop queue entries that were superseded or removed
+    def top(self):
+        while self.q and self.U.get(self.q[0][1]) != self.q[0][0]:
+            heapq.heappop(self.q)
+        return self.q[0] if self.q else ((float('inf'), float('inf')), None)
+
+    def update_vertex(self, state):
+        if state != self.goal:
+            best = float('inf')
+            if state in self.state_graph:
+                for succ, cost in get_successors(self.state_graph, state).items():
+                    if succ != state:
+                        best = min(best, cost + self.g.get(succ, float('inf')))
+            self.rhs[state] = best
+        self.U.pop(state, None)
+        if self.g.get(state, float('inf')) != self.rhs.get(state, float('inf')):
+            self.push(state)
+
+    def compute_shortest_path(self):
+        nexp = 0
+        while True:
+            k_old, u = self.top()
+            g_start = self.g.get(self.start, float('inf'))
+            rhs_start = self.rhs.get(self.start, float('inf'))
+            if u is None or (k_old >= self.key(self.start) and rhs_start == g_start):
+                break
+            k_new = self.key(u)
+            if k_old < k_new: # the key went stale as the agent moved
+                self.push(u)
+                continue
+            heapq.heappop(self.q)
+            del self.U[u]
+            nexp += 1
+            g_u = self.g.get(u, float('inf'))
+            rhs_u = self.rhs.get(u, float('inf'))
+            if g_u > rhs_u: # overconsistent - settle it
+                self.g[u] = rhs_u
+                for pred in get_predecessors(self.state_graph, u):
+                    self.update_vertex(pred)
+            else: # underconsistent - a blocked cell made it more expensive
+                self.g[u] = float('inf')
+                self.update_vertex(u)
+                for pred in get_predecessors(self.state_graph, u):
+                    self.update_vertex(pred)
+        return nexp
+
+    # tell the planner about cells that were removed from the state graph -
+    # their own states are gone and every state with a move into them must
+    # recompute its rhs value
+    def update_cells(self, blocked_cells):
+        for (x, y) in blocked_cells:
+            for h in heading:
+                for a in angle:
+                    state = self.as_key((x, y, h, a))
+                    self.g.pop(state, None)
+                    self.rhs.pop(state, None)
+                    self.U.pop(state, None)
+                    for pred in lattice_predecessors((x, y, h, a), self.nrows, self.ncols):
+                        pred = self.as_key(pred)
+                        if pred in self.state_graph:
+                            self.update_vertex(pred)
+
+    def as_key(self, state):
+        return encode_state(state, self.ncols) if self.packed else state
+
+    # follow the cheapest successors from the start to the goal
+    def extract_path(self):
+        if self.g.get(self.start, float('inf')) == float('inf'):
+            return None
+        solution_path = [self.start]
+        state = self.start
+        while state != self.goal:
+            best, best_cost = None, float('inf')
+            for succ, cost in get_successors(self.state_graph, state).items():
+                if succ != state and cost + self.g.get(succ, float('inf')) < best_cost:
+                    best, best_cost = succ, cost + self.g.get(succ, float('inf'))
+            if best is None or len(solution_path) > len(self.g):
+                return None
+            solution_path.append(best)
+            state = best
+        return solution_path
+
+    # plan from the agent's current state after it learned about blocked_cells,
+    # returning the same tuples as astar_search
+    def replan(self, start, blocked_cells = (), return_cost = False, return_nexp = False):
+        if start != self.start:
+            self.km += self.heuristic(self.last, start)
+            self.last = start
+            self.start = start
+        self.update_cells(blocked_cells)
+        self.nexp = self.compute_shortest_path()
+        self.total_nexp += self.nexp
+        self.nexp_per_replan.append(self.nexp)
+        solution_path = self.extract_path()
+        if solution_path is None:
+            return None
+        result = (solution_path,)
+        if return_cost:
+            result += (pathcost(solution_path, self.state_graph),)
+        if return_nexp:
+            result += (self.nexp,)
+        return result if len(result) > 1 else solution_path
+
+# this function returns the map with the cells of 'states' (start and goal
+# states) open - the map itself when they already are, else a copy
+def open_cells(state_lattice, states):
+    if all(state_lattice[state[0]][state[1]] != 1 for state in states):
+        return state_lattice
+    if isinstance(state_lattice, np.memmap):
+        # a private copy-on-write mapping of a map file, only the pages written to are copied
+        state_lattice = np.memmap(state_lattice.filename, dtype = state_lattice.dtype, mode = 'c', offset = state_lattice.offset,
+                                  shape = state_lattice.shape, order = 'F' if np.isfortran(state_lattice) else 'C')
+    else:
+        state_lattice = np.array(state_lattice, dtype = np.uint8)
+    for state in states:
+        state_lattice[state[0], state[1]] = 0
+    return state_lattice
+
+# this function runs one sense-plan-act episode - the agent starts at 'start'
+# thinking the whole state space is free, senses its surroundings with
+# update_knowledge, plans with 'planner' ('astar' or 'dstar') and follows the
+# plan until the next planned state turns out to be blocked, then senses and
+# replans, until it reaches 'goal' or finds out there is no path
+# 'heuristic' is a tuple heuristic for the A* plans (heuristics with a
+# block_cells method, like Cost_Field_Heuristic, are told about new obstacles)
+# start and goal cells that happen to be blocked are treated as open, on a
+# copy of the lattice, and the result is a dict of the episode's plans and
+# statistics with states in tuple form
+# the agent's knowledge is a Knowledge_Overlay over base_graph, by default the
+# shared obstacle-free graph for the map size, so the base is never rebuilt
+# or modified between episodes
+# 'sensing' picks how the agent looks around: None is the 8 rays of
+# update_knowledge, 'rays', 'square' or 'circle' use the vectorized
+# update_knowledge_region (with line of sight when occlusion = True)
+# planner 'hierarchical' plans with a Tile_Planner over the agent's knowledge,
+# planner 'goal_tree' follows a Goal_Tree_Cache tree grown back from the goal,
+# planner 'bidirectional' plans with bidirectional_astar_search and planner
+# 'arastar' plans with ara_star_search under a budget of time_limit
+# seconds and / or max_expansions per replan and follows the best plan it had
+# when the budget ran out - a partial plan that ends no closer to the goal by
+# the heuristic than the agent already is (a local minimum, where budgeted
+# searches would send the agent back and forth) is replaced by a search
+# without the budget - and the result then also lists each plan's
+# suboptimality bound ('plan_bounds', None for a partial plan, and for every
+# plan unless the heuristic is admissible, see is_admissible - pass
+# chebyshev_distance to get bounds)
+# with plan_reuse = True (not for 'dstar', which repairs its own search) a
+# Plan_Cache keeps the current plan and only the stretch that new obstacles
+# broke is searched again, with a full replan when the repair fails - the
+# result then counts full plans in 'astar_plans', repairs in 'plan_repairs'
+# and plans kept unchanged in 'plan_reuses', and 'plans' holds the plan after
+# each of them
+# with reachability = True a Reachability_Index tracks which states the agent
+# still believes connected to the goal, so a goal cut off by new obstacles ends
+# the episode without a search (the result then also has 'reachability_relabels')
+# with a Planner_Stats as stats the episode's sense, plan and move phases are
+# timed, every search's stats are collected (stats.searches) and added up, and
+# the result gets a 'stats' entry
+def run_episode(state_lattice, start, goal, vision, planner = 'astar', heuristic = euclidean_distance, base_graph = None, sensing = None, occlusion = False, stats = None, time_limit = None, max_expansions = None, plan_reuse = False, reachability = False):
+    started = time.perf_counter()
+    phases = stats if stats is not None else no_stats
+    nrows = len(state_lattice)
+    ncols = len(state_lattice[0])
+    state_lattice = open_cells(state_lattice, [start, goal])
+    # the agent plans over packed int states (see encode_state) on an implicit
+    # graph with the same edges as assign_edges(state_lattice, build_state_graph(state_lattice))
+    if base_graph is None:
+        base_graph = shared_base_graph(nrows, ncols)
+    agent_state_graph = Knowledge_Overlay(base_graph) # agent starts by thinking entire state space is free
+    packed_heuristic = Packed_Heuristic(heuristic, ncols)
 
     # define important variables to keep track of
-    agent_location = start # variable to keep track of agent's location
+    goal_id = encode_state(goal, ncols) # packed goal state
+    agent_location = encode_state(start, ncols) # variable to keep track of agent's location
     agent_path = [] # list to document agent's path
     total_cost = 0 # total cost of agent's path
     total_nodes_expanded = 0 # number of nodes expanded in A* search
-    astar_plans = 0 # number of A* plans that the agent makes
+    nodes_expanded_per_replan = []
+    plan_costs = []
+    plan_bounds = []
     store_astar_plans = [] # store each A* plan to graph later
-    graph_bool = True # boolean to keep track of whether path to goal was reached - for graphing purposes
+    reached = True # whether the agent got to the goal
+    dstar = None # incremental planner, created on the first plan when planner == 'dstar'
+    tile_planner = Tile_Planner(agent_state_graph, nrows, ncols) if planner == 'hierarchical' else None # hierarchical planner
+    plan_cache = Plan_Cache() if plan_reuse and planner != 'dstar' else None # keeps and repairs the current plan
+    reach_index = Reachability_Index(nrows, ncols) if reachability else None # connected components of the known graph
+    goal_trees = Goal_Tree_Cache(agent_state_graph, capacity = 1) if planner == 'goal_tree' else None # reverse search tree from the goal
 
     # the process of making A* plans and maneuvering through the state space
     while True:
-        if agent_location == goal:
-            print("************************\nAGENT REACHED GOAL STATE\n************************")
+        if agent_location == goal_id:
             agent_path.append(agent_location)
             break
         # update agent's knowledge based on current location
-        agent_state_graph = update_knowledge(agent_location, agent_state_graph, state_lattice, agent_vision)
+        with phases.phase('sense'):
+            if sensing is None:
+                agent_state_graph, new_blocked = update_knowledge(agent_location, agent_state_graph, state_lattice, vision, return_blocked = True, stats = stats)
+            else:
+                agent_state_graph, new_blocked = update_knowledge_region(agent_location, agent_state_graph, state_lattice, vision, sensing, occlusion, return_blocked = True, stats = stats)
+            if hasattr(heuristic, 'block_cells'):
+                heuristic.block_cells(new_blocked)
+            if tile_planner is not None:
+                tile_planner.block_cells(new_blocked)
+            if reach_index is not None:
+                reach_index.block_cells(new_blocked)
+            if goal_trees is not None:
+                goal_trees.block_cells(new_blocked)
         # make new A* plan based on updated knowledge
-        astar_result = astar_search(agent_location, goal, agent_state_graph, state_lattice, euclidean_distance, return_cost = True, return_nexp = True)
+        with phases.phase('plan'):
+            search_stats = Planner_Stats() if stats is not None else None
+            astar_result = None
+            unreachable = reach_index is not None and not reach_index.reachable(agent_location, goal_id)
+            if plan_cache is not None and not unreachable:
+                astar_result = plan_cache.repair(agent_location, agent_state_graph, state_lattice, packed_heuristic)
+                total_nodes_expanded += plan_cache.last_nexp if astar_result is None else 0
+            if unreachable: # no search can find a path, leave astar_result as None
+                if search_stats is not None:
+                    search_stats.count('proved_unreachable')
+            elif astar_result is not None:
+                if search_stats is not None:
+                    search_stats.count('plan_reuses' if plan_cache.last_reused else 'plan_repairs')
+                    search_stats.count('expansions', astar_result[2])
+            elif planner == 'dstar':
+                if dstar is None:
+                    dstar = DStar_Lite(agent_location, goal_id, agent_state_graph, state_lattice)
+                replan_started = time.perf_counter()
+                astar_result = dstar.replan(agent_location, new_blocked, return_cost = True, return_nexp = True)
+                if search_stats is not None:
+                    search_stats.add_time('search', time.perf_counter() - replan_started)
+                    search_stats.count('searches')
+                    search_stats.count('expansions', astar_result[2] if astar_result else 0)
+            elif planner == 'arastar':
+                solutions = []
+                replan_started = time.perf_counter()
+                astar_result = ara_star_search(agent_location, goal_id, agent_state_graph, state_lattice, packed_heuristic,
+                                               time_limit = time_limit, max_expansions = max_expansions,
+                                               return_cost = True, return_nexp = True, solutions = solutions)
+                if astar_result is not None and not solutions[-1]['complete'] and \
+                   packed_heuristic(astar_result[0][-1], goal_id) >= packed_heuristic(agent_location, goal_id):
+                    # the partial plan gets no closer to the goal (a local minimum
+                    # of the heuristic), following it could go back and forth forever
+                    partial_nexp = astar_result[2]
+                    solutions = []
+                    astar_result = ara_star_search(agent_location, goal_id, agent_state_graph, state_lattice, packed_heuristic,
+                                                   return_cost = True, return_nexp = True, solutions = solutions)
+                    if astar_result is not None:
+                        astar_result = (astar_result[0], astar_result[1], astar_result[2] + partial_nexp)
+                    if search_stats is not None:
+                        search_stats.count('unbudgeted_replans')
+                if solutions:
+                    plan_bounds.append(solutions[-1]['bound'])
+                if search_stats is not None:
+                    search_stats.add_time('search', time.perf_counter() - replan_started)
+                    search_stats.count('searches')
+                    search_stats.count('expansions', astar_result[2] if astar_result else 0)
+                    search_stats.count('anytime_solutions', len(solutions))
+            elif planner == 'hierarchical':
+                replan_started = time.perf_counter()
+                astar_result = tile_planner.plan(agent_location, goal_id, packed_heuristic, return_cost = True, return_nexp = True)
+                if search_stats is not None:
+                    search_stats.add_time('search', time.perf_counter() - replan_started)
+                    search_stats.count('searches')
+                    search_stats.count('expansions', astar_result[2] if astar_result else 0)
+            elif planner == 'goal_tree':
+                replan_started = time.perf_counter()
+                astar_result = goal_trees.plan(agent_location, goal_id, return_cost = True, return_nexp = True)
+                if search_stats is not None:
+                    search_stats.add_time('search', time.perf_counter() - replan_started)
+                    search_stats.count('searches')
+                    search_stats.count('expansions', astar_result[2] if astar_result else 0)
+            elif planner == 'bidirectional':
+                replan_started = time.perf_counter()
+                astar_result = bidirectional_astar_search(agent_location, goal_id, agent_state_graph, state_lattice, packed_heuristic, return_cost = True, return_nexp = True)
+                if search_stats is not None:
+                    search_stats.add_time('search', time.perf_counter() - replan_started)
+                    search_stats.count('searches')
+                    search_stats.count('expansions', astar_result[2] if astar_result else 0)
+            else:
+                astar_result = astar_search(agent_location, goal_id, agent_state_graph, state_lattice, packed_heuristic, return_cost = True, return_nexp = True, stats = search_stats)
+        if stats is not None: # sensing counts (newly_blocked, ...) went to stats directly
+            stats.merge(search_stats)
+            stats.searches.append(search_stats)
         if(astar_result == None): # if A* returns None, there is no path to the goal state
-            print("************************\nNO POSSIBLE PATH TO GOAL\n************************")
-            graph_bool = False
+            reached = False
             break
         # assign A* information to variables
         path, cost, nodes_expanded = astar_result[0], astar_result[1], astar_result[2]
+        if plan_cache is not None:
+            plan_cache.set(path, agent_state_graph)
         # document A* planned path
         store_astar_plans.append(path)
         # update statistics
-        astar_plans += 1
+        plan_costs.append(cost)
+        nodes_expanded_per_replan.append(nodes_expanded)
         total_cost += cost
         total_nodes_expanded += nodes_expanded
         # navigate agent based on current A* plan
-        for state in path:
-            # agent senses blocked nodes right in front of it (the next planned state)
-            if state_lattice[state[0]][state[1]] == 1: # can't go there!
-                break
-            # move agent along path
+        with phases.phase('move'):
+            for state in path:
+                # agent senses blocked nodes right in front of it (the next planned state)
+                sx, sy = state_cell(state, ncols)
+                if state_lattice[sx][sy] == 1: # can't go there!
+                    break
+                # move agent along path
+                else:
+                    agent_location = state
+                    agent_path.append(agent_location)
+
+    result = {'start' : tuple(start),
+              'goal' : tuple(goal),
+              'nrows' : nrows,
+              'ncols' : ncols,
+              'vision' : vision,
+              'planner' : planner,
+              'sensing' : sensing or 'rays',
+              'reached' : reached,
+              'astar_plans' : len(store_astar_plans) - (plan_cache.repairs + plan_cache.reuses if plan_cache is not None else 0),
+              'plans' : [[decode_state(state, ncols) for state in plan] for plan in store_astar_plans],
+              'plan_costs' : plan_costs,
+              'agent_path' : [decode_state(state, ncols) for state in agent_path],
+              'total_cost' : total_cost,
+              'nodes_expanded' : total_nodes_expanded,
+              'nodes_expanded_per_replan' : nodes_expanded_per_replan,
+              'wall_time' : time.perf_counter() - started}
+    if planner == 'arastar':
+        result['plan_bounds'] = plan_bounds
+    if reach_index is not None:
+        result['reachability_relabels'] = reach_index.relabels
+    if plan_cache is not None:
+        result['plan_repairs'] = plan_cache.repairs
+        result['plan_reuses'] = plan_cache.reuses
+        result['failed_repairs'] = plan_cache.failed_repairs
+    if stats is not None:
+        result['stats'] = stats.as_dict()
+    return result
+
+# this function runs one episode (same arguments as run_episode) under
+# cProfile and saves the profile to 'filename' in pstats format, for
+# python -m pstats, snakeviz or a flame graph tool like flameprof
+def profile_episode(filename, *args, **kwargs):
+    import cProfile # only needed when profiling
+    profiler = cProfile.Profile()
+    result = profiler.runcall(run_episode, *args, **kwargs)
+    profiler.dump_stats(filename)
+    return result
+
+# this function steps many agents in lockstep on one map - 'agents' is a list
+# of (start, goal) state tuples, and each tick every agent still on its way
+# senses around it, then the agents that need a plan replan, then every agent
+# takes one step along its plan
+# all agents share one Knowledge_Overlay (and one heuristic, so a
+# Cost_Field_Heuristic's fields are shared too): an obstacle any agent sees is
+# known to all of them from that tick on, and the base graph is never copied
+# an agent replans when it has no plan or the rest of its plan crosses a cell
+# found blocked in the tick - the replans of a tick are done after all the
+# sensing, so each is made with everything the fleet saw that tick, but each
+# is its own search and shares no work with the others, except with planner
+# 'goal_tree', where one Goal_Tree_Cache tree per goal answers every agent
+# heading there (the other planners are 'astar' and 'bidirectional', any
+# other name is a ValueError)
+# agents do not block each other - several can be in the same cell
+# with reachability = True a shared Reachability_Index fails an agent whose
+# goal is cut off without a search
+# with a Planner_Stats as stats the sensing of every agent and the counters of
+# the A* searches are added up in it, and the result gets a 'stats' entry
+# the result has one dict per agent (reached, its path and cost, number of
+# plans and nodes expanded) and one per tick with the agents still moving,
+# the replans and their expansions, the time spent sensing, planning and
+# moving and the tick's throughput in agent steps and replans per second
+def run_fleet(state_lattice, agents, vision, planner = 'astar', heuristic = euclidean_distance, base_graph = None, sensing = None, occlusion = False, reachability = False, max_ticks = None, stats = None):
+    if planner not in ('astar', 'bidirectional', 'goal_tree'):
+        raise ValueError("unknown fleet planner {}".format(planner))
+    started = time.perf_counter()
+    nrows = len(state_lattice)
+    ncols = len(state_lattice[0])
+    state_lattice = open_cells(state_lattice, [state for agent in agents for state in agent])
+    if base_graph is None:
+        base_graph = shared_base_graph(nrows, ncols)
+    known_graph = Knowledge_Overlay(base_graph) # shared knowledge of the fleet
+    packed_heuristic = Packed_Heuristic(heuristic, ncols)
+    goal_trees = Goal_Tree_Cache(known_graph, capacity = len(agents)) if planner == 'goal_tree' else None
+    reach_index = Reachability_Index(nrows, ncols) if reachability else None
+
+    locations = [encode_state(start, ncols) for (start, goal) in agents]
+    goals = [encode_state(goal, ncols) for (start, goal) in agents]
+    agent_paths = [[location] for location in locations]
+    plans = [None] * len(agents) # current plan of each agent and its position on it
+    plan_steps = [0] * len(agents)
+    path_costs = [0] * len(agents)
+    nplans = [0] * len(agents)
+    nodes_expanded = [0] * len(agents)
+    reached = [locations[k] == goals[k] for k in range(len(agents))]
+    active = [k for k in range(len(agents)) if not reached[k]]
+    ticks = []
+
+    while active and (max_ticks is None or len(ticks) < max_ticks):
+        tick_started = time.perf_counter()
+        # every agent senses, all into the shared knowledge
+        new_blocked = []
+        for k in active:
+            if sensing is None:
+                known_graph, cells = update_knowledge(locations[k], known_graph, state_lattice, vision, return_blocked = True, stats = stats)
             else:
-                agent_location = state
-                agent_path.append(agent_location)
+                known_graph, cells = update_knowledge_region(locations[k], known_graph, state_lattice, vision, sensing, occlusion, return_blocked = True, stats = stats)
+            new_blocked.extend(cells)
+        for listener in (heuristic, goal_trees, reach_index):
+            if hasattr(listener, 'block_cells'):
+                listener.block_cells(new_blocked)
+        sense_time = time.perf_counter() - tick_started
 
-    # print out results
-    print('AGENT SUMMARY: ')
-    print('Start State: ', start)
-    print('Goal State: ', goal)
-    print('State Space Dimensions: {} x {} units'.format(nrows, ncols))
-    print('Agent Vision: ', agent_vision)
-    print('*************************************')
-    print('Number of A* plans = ', astar_plans)
-    print('Agent Path: ')
-    for i in range(len(agent_path)):
-        print(agent_path[i])
-    print('Total Path Cost = ', total_cost)
-    print('Total Number of Nodes Expanded = ', total_nodes_expanded)
+        # replan the agents whose plan is missing or now crosses a blocked cell
+        plan_started = time.perf_counter()
+        new_cells = {x * ncols + y for (x, y) in new_blocked}
+        replanning = [k for k in active if plans[k] is None or
+                      (new_cells and any(state // states_per_cell in new_cells for state in plans[k][plan_steps[k]:]))]
+        tick_expansions = 0
+        failed = []
+        for k in replanning:
+            if reach_index is not None and not reach_index.reachable(locations[k], goals[k]):
+                plan_result = None
+            elif planner == 'goal_tree':
+                plan_result = goal_trees.plan(locations[k], goals[k], return_nexp = True)
+            elif planner == 'bidirectional':
+                plan_result = bidirectional_astar_search(locations[k], goals[k], known_graph, state_lattice, packed_heuristic, return_nexp = True)
+            else:
+                plan_result = astar_search(locations[k], goals[k], known_graph, state_lattice, packed_heuristic, return_nexp = True, stats = stats)
+            if plan_result is None: # no path to this agent's goal
+                failed.append(k)
+                continue
+            plans[k], plan_steps[k] = plan_result[0], 0
+            nplans[k] += 1
+            nodes_expanded[k] += plan_result[1]
+            tick_expansions += plan_result[1]
+        plan_time = time.perf_counter() - plan_started
 
-    # graph results
+        # every agent takes one step, unless the next state turns out to be blocked
+        move_started = time.perf_counter()
+        moved = 0
+        still_active = []
+        for k in active:
+            if k in failed:
+                continue
+            plan, step = plans[k], plan_steps[k]
+            if step + 1 < len(plan):
+                sx, sy = state_cell(plan[step + 1], ncols)
+                if state_lattice[sx][sy] == 1: # can't go there, replan next tick
+                    plans[k] = None
+                else:
+                    path_costs[k] += get_successors(known_graph, plan[step])[plan[step + 1]]
+                    locations[k] = plan[step + 1]
+                    agent_paths[k].append(locations[k])
+                    plan_steps[k] += 1
+                    moved += 1
+            if locations[k] == goals[k]:
+                reached[k] = True
+            else:
+                still_active.append(k)
+        move_time = time.perf_counter() - move_started
+
+        tick_time = time.perf_counter() - tick_started
+        ticks.append({'tick' : len(ticks),
+                      'active' : len(active),
+                      'newly_blocked' : len(new_blocked),
+                      'replans' : len(replanning),
+                      'expansions' : tick_expansions,
+                      'sense_time' : sense_time,
+                      'plan_time' : plan_time,
+                      'move_time' : move_time,
+                      'wall_time' : tick_time,
+                      'steps_per_sec' : moved / tick_time if tick_time > 0 else None,
+                      'replans_per_sec' : len(replanning) / plan_time if plan_time > 0 else None})
+        active = still_active
+
+    results = [{'start' : tuple(start),
+                'goal' : tuple(goal),
+                'reached' : reached[k],
+                'agent_path' : [decode_state(state, ncols) for state in agent_paths[k]],
+                'total_cost' : path_costs[k],
+                'plans' : nplans[k],
+                'nodes_expanded' : nodes_expanded[k]} for k, (start, goal) in enumerate(agents)]
+    result = {'nrows' : nrows,
+              'ncols' : ncols,
+              'vision' : vision,
+              'planner' : planner,
+              'sensing' : sensing or 'rays',
+              'agents' : results,
+              'reached' : sum(reached),
+              'ticks' : ticks,
+              'replans' : sum(nplans),
+              'nodes_expanded' : sum(nodes_expanded),
+              'known_blocked' : len(known_graph.blocked),
+              'wall_time' : time.perf_counter() - started}
+    if goal_trees is not None:
+        result['goal_trees'] = goal_trees.stats()
+    if stats is not None:
+        result['stats'] = stats.as_dict()
+    return result
+
+# this function plots an episode returned by run_episode on the current
+# matplotlib figure - the lattice, every A* plan, the agent's path and the
+# start and goal states
+def plot_episode(state_lattice, result):
+    start = result['start']
+    goal = result['goal']
 
     # graph state lattice
     slx0 = []
@@ -838,20 +3495,20 @@ def main():
     # graph A* plans
     plan_number = 0
     color_list = ['b','g','r','c','m','y','turquoise', 'purple']
-    for plan in store_astar_plans:
+    for plan in result['plans']:
         x = []
         y = []
         for state in plan:
             x.append(state[0])
             y.append(state[1])
-        color_choice = color_list[plan_number]
+        color_choice = color_list[plan_number % len(color_list)]
         plt.plot(x,y, 'o-', color = color_choice, label = 'A* Plan ' + str(plan_number))
         plan_number += 1
 
     # graph actual agent path
     x = []
     y = []
-    agent_path_copy = agent_path[1:len(agent_path)-1]
+    agent_path_copy = result['agent_path'][1:len(result['agent_path'])-1]
     for state in agent_path_copy:
         x.append(state[0])
         y.append(state[1])
@@ -863,15 +3520,94 @@ def main():
     plt.grid(True)
 
     # if there's no path to goal, indicate in graph
-    if graph_bool == False:
+    if not result['reached']:
         plt.title("No path to goal", fontsize = 16)
 
     # add labels and a legend
     plt.xlabel("x", fontsize=12)
     plt.ylabel("y", fontsize=12)
     plt.legend(loc = 'upper center', bbox_to_anchor = (0.5,1.15), ncol = 6)
+
+# main function
+# planner is 'astar' for a fresh A* search on every replan or 'dstar' for the
+# incremental DStar_Lite planner
+def main(planner = 'astar', time_limit = None):
+    # define parameters (rows, columns, vision, start state, goal state, probability distribution)
+    # comment out either the user option or the hard coded option
+    # user (raw input option)
+    nrows = int(input("Number of Rows? (int) " ))
+    ncols = int(input("Number of Columns? (int) "))
+    agent_vision = int(input("Agent vision distance? (int) "))
+    start=[]
+    goal=[]
+    startInp = input("Start Position? X,Y,[north,south,east,west],[center,left,right] ")
+    startInp=startInp.split(",")
+    startInp[0]=int(startInp[0])
+    startInp[1]=int(startInp[1])
+    for i in heading:
+        if(startInp[2]==i):
+            startInp[2]=i
+    start=tuple(startInp)
+    goalInp = input("Goal Position? X,Y,[north,south,east,west],[center,left,right] ")
+    goalInp=goalInp.split(",")
+    goalInp[0]=int(goalInp[0])
+    goalInp[1]=int(goalInp[1])
+    for i in angle:
+        if(goalInp[2]==i):
+            goalInp[2]=i
+    goal=tuple(goalInp)
+    p1=float(input("Probability of an obstacle in any given location? (float between 0 and 1) "))
+    p2=1-p1
+    prob=[p2,p1]
+
+    # Hard coded option
+    '''nrows = 10
+    ncols = 10
+    prob = [0.7, 0.3]
+    start = (0,0,s,c)
+    goal = (9,9,s,c)
+    agent_vision = 5'''
+
+    # construct state lattice
+    state_lattice = build_state_lattice(nrows, ncols, prob)
+
+    # in the case that the randomization blocked our start or goal states
+    # we unblock them ;)
+    if(state_lattice[start[0]][start[1]]==1):
+        state_lattice[start[0]][start[1]]=0
+    if(state_lattice[goal[0]][goal[1]]==1):
+        state_lattice[goal[0]][goal[1]]=0
+
+    # the process of making A* plans and maneuvering through the state space
+    result = run_episode(state_lattice, start, goal, agent_vision, planner, time_limit = time_limit)
+    if result['reached']:
+        print("************************\nAGENT REACHED GOAL STATE\n************************")
+    else:
+        print("************************\nNO POSSIBLE PATH TO GOAL\n************************")
+
+    # print out results
+    print('AGENT SUMMARY: ')
+    print('Start State: ', start)
+    print('Goal State: ', goal)
+    print('State Space Dimensions: {} x {} units'.format(nrows, ncols))
+    print('Agent Vision: ', agent_vision)
+    print('*************************************')
+    print('Number of A* plans = ', result['astar_plans'])
+    print('Agent Path: ')
+    for state in result['agent_path']:
+        print(state)
+    print('Total Path Cost = ', result['total_cost'])
+    print('Total Number of Nodes Expanded = ', result['nodes_expanded'])
+    if planner in ('dstar', 'arastar', 'bidirectional', 'hierarchical', 'goal_tree'):
+        print('Nodes Expanded per Replan = ', result['nodes_expanded_per_replan'])
+    if planner == 'arastar':
+        print('Suboptimality Bound per Replan = ', result['plan_bounds'])
+
+    # graph results
+    plot_episode(state_lattice, result)
     # show this shit!
     plt.show()
 
 if __name__ == '__main__':
-    main()
+    # python slp.py [astar|dstar|bidirectional|hierarchical|arastar [time limit per replan in seconds]]
+    main(sys.argv[1] if len(sys.argv) > 1 else 'astar', float(sys.argv[2]) if len(sys.argv) > 2 else None)
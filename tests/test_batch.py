@@ -0,0 +1,33 @@
+import io
+import json
+
+import batch
+
+# a parallel batch must give the same results as the serial one, whatever the
+# number of workers (only the order and the timings may differ)
+
+scenarios = [
+    {'id' : 'random', 'map' : {'type' : 'random', 'rows' : 12, 'cols' : 12, 'p' : 0.2},
+     'start' : [0, 0, 'south', 'center'], 'goal' : '11,11,south,center', 'vision' : 2, 'repeat' : 5},
+    {'id' : 'rooms', 'map' : {'type' : 'rooms', 'rows' : 16, 'cols' : 16, 'room_size' : 8, 'seed' : 4},
+     'start' : [1, 1, 'east', 'center'], 'goal' : [14, 14, 'east', 'center'], 'vision' : 3,
+     'planner' : 'dstar', 'heuristic' : 'chebyshev', 'repeat' : 3},
+    {'id' : 'bad-map', 'map' : {'type' : 'nope', 'rows' : 5},
+     'start' : [0, 0, 'south', 'center'], 'goal' : [4, 4, 'south', 'center']},
+]
+
+def results(run):
+    out = io.StringIO()
+    count = run(out)
+    records = [json.loads(line) for line in out.getvalue().splitlines()]
+    assert count == len(records)
+    for record in records:
+        record.pop('wall_time', None)
+    return sorted(records, key = lambda record: record['id'])
+
+def test_parallel_batch_equals_serial_batch():
+    serial = results(lambda out: batch.run_batch(scenarios, out, base_seed = 7))
+    assert len(serial) == 9
+    assert 'error' in serial[0] and all('error' not in record for record in serial[1:])
+    for workers, chunksize in ((2, 1), (3, 4)):
+        assert results(lambda out: batch.run_batch_parallel(scenarios, out, workers, chunksize, base_seed = 7)) == serial
@@ -0,0 +1,38 @@
+import random
+
+import pytest
+
+import slp
+
+# a fleet shares what its agents see, but each agent must still end up where
+# it would on its own
+
+def fleet_scenario(n, seed, nagents):
+    rng = random.Random(seed)
+    state_lattice = slp.generate_state_lattice(n, n, (0.8, 0.2), seed = seed)
+    agents = [((rng.randrange(n), rng.randrange(n), rng.choice(slp.heading), slp.angle[0]),
+               (rng.randrange(n), rng.randrange(n), rng.choice(slp.heading), slp.angle[0])) for _ in range(nagents)]
+    return slp.open_cells(state_lattice, [state for agent in agents for state in agent]), agents
+
+def test_fleet_agents_match_single_agent_episodes():
+    for seed in range(6):
+        state_lattice, agents = fleet_scenario(14, seed, 5)
+        for planner in ('astar', 'bidirectional', 'goal_tree'):
+            # vision over the whole map: every plan is made knowing every obstacle
+            fleet = slp.run_fleet(state_lattice, agents, 14, planner = planner, sensing = 'square')
+            for (start, goal), agent in zip(agents, fleet['agents']):
+                alone = slp.run_episode(state_lattice, start, goal, 14, sensing = 'square')
+                assert (agent['reached'], agent['total_cost']) == (alone['reached'], alone['total_cost']), (seed, planner)
+            # short vision: plans differ with what was seen, the outcome does not
+            fleet = slp.run_fleet(state_lattice, agents, 1, planner = planner)
+            for (start, goal), agent in zip(agents, fleet['agents']):
+                assert agent['reached'] == slp.run_episode(state_lattice, start, goal, 1)['reached'], (seed, planner)
+                states = [slp.encode_state(state, 14) for state in agent['agent_path']]
+                assert agent['total_cost'] == slp.pathcost(states, slp.shared_base_graph(14, 14))
+                assert all(state_lattice[x][y] == 0 for (x, y, h, a) in agent['agent_path'])
+
+def test_fleet_rejects_other_planners():
+    state_lattice, agents = fleet_scenario(6, 0, 2)
+    for planner in ('dstar', 'hierarchical', 'arastar', 'nope'):
+        with pytest.raises(ValueError):
+            slp.run_fleet(state_lattice, agents, 1, planner = planner)
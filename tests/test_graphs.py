@@ -0,0 +1,164 @@
+import copy
+
+import numpy as np
+
+import slp
+
+# the graph backends must agree edge for edge with the dict-of-dicts graph
+# of build_state_graph and assign_edges, before and after cells are removed
+
+def dict_graph(n, seed):
+    state_lattice = slp.generate_state_lattice(n, n, (0.8, 0.2), seed = seed)
+    return state_lattice, slp.assign_edges(state_lattice, slp.build_state_graph(state_lattice))
+
+def assert_same_graph(csr, state_graph):
+    assert set(csr) == set(state_graph)
+    for node in state_graph:
+        assert csr[node] == state_graph[node], node
+        assert csr[slp.encode_state(node, csr.ncols)] == {slp.encode_state(s, csr.ncols) : c for s, c in state_graph[node].items()}
+        assert csr.get_predecessors(node) == slp.get_predecessors(state_graph, node), node
+
+# the same check for graphs that are not iterable - every state of the map,
+# tuple or packed as the graph takes them, with the removed cells left out
+def assert_same_successors(graph, state_graph, n, packed):
+    for sid in range(n * n * slp.states_per_cell):
+        node = slp.decode_state(sid, n)
+        state = sid if packed else node
+        assert (state in graph) == (node in state_graph), node
+        if node in state_graph:
+            successors = state_graph[node]
+            predecessors = slp.get_predecessors(state_graph, node)
+            if packed:
+                successors = {slp.encode_state(s, n) : c for s, c in successors.items()}
+                predecessors = {slp.encode_state(s, n) : c for s, c in predecessors.items()}
+            assert slp.get_successors(graph, state) == successors, node
+            assert slp.get_predecessors(graph, state) == predecessors, node
+
+def removed_cells(state_lattice):
+    return [tuple(cell) for cell in np.argwhere(np.asarray(state_lattice) == 1).tolist()]
+
+def test_csr_graph_equals_dict_graph():
+    for n, seed in ((2, 0), (5, 1), (9, 2)):
+        state_lattice, state_graph = dict_graph(n, seed)
+        assert_same_graph(slp.build_csr_state_graph(state_lattice), state_graph)
+
+def test_csr_graph_equals_dict_graph_after_removing_cells():
+    state_lattice, state_graph = dict_graph(8, 3)
+    csr = slp.build_csr_state_graph(state_lattice)
+    cells = [tuple(cell) for cell in np.argwhere(np.asarray(state_lattice) == 1).tolist()]
+    for (x, y) in cells[:len(cells) // 2]:
+        state_graph = slp.extract_node(x, y, state_graph)
+        csr.remove_cell(x, y)
+    csr.remove_cells(cells[len(cells) // 2:])
+    state_graph = slp.extract_cells(cells[len(cells) // 2:], state_graph)
+    assert_same_graph(csr, state_graph)
+    assert_same_graph(slp.csr_from_state_graph(state_graph, 8, 8), state_graph)
+
+def test_graph_snapshot_round_trip(tmp_path):
+    state_lattice, state_graph = dict_graph(7, 4)
+    csr = slp.build_csr_state_graph(state_lattice)
+    state_graph = slp.extract_cells([(1, 2), (3, 3)], state_graph)
+    csr.remove_cells([(1, 2), (3, 3)])
+    for graph in (csr, state_graph):
+        filename = str(tmp_path / 'graph.slpg')
+        slp.save_graph_snapshot(graph, state_lattice, filename)
+        loaded = slp.load_graph_snapshot(filename, state_lattice)
+        if graph is csr:
+            for name in slp.graph_snapshot_arrays:
+                assert np.array_equal(getattr(loaded, name), getattr(csr, name)), name
+        assert_same_graph(loaded, state_graph)
+        # removing cells from the loaded graph leaves the file as it was
+        loaded.remove_cell(0, 0)
+        assert not slp.load_graph_snapshot(filename).blocked[0]
+    other = np.array(state_lattice)
+    other[0, 0] = 1 - other[0, 0]
+    try:
+        slp.load_graph_snapshot(filename, other)
+    except ValueError:
+        pass
+    else:
+        assert False, 'a snapshot of another map was loaded'
+
+def same_partition(a, b):
+    assert np.array_equal(a == -1, b == -1)
+    pairs = set(zip(a[a != -1].tolist(), b[b != -1].tolist()))
+    return len(pairs) == len(set(a[a != -1].tolist())) == len(set(b[b != -1].tolist()))
+
+def test_reachability_index_equals_fresh_labeling():
+    rng = np.random.default_rng(5)
+    for n in (6, 12, 30):
+        index = slp.Reachability_Index(n, n)
+        index.label_all()
+        graph = slp.Packed_Lattice_Successors(n, n)
+        known_blocked = np.zeros((n, n), dtype = bool)
+        for step in range(8):
+            cells = [tuple(cell) for cell in rng.integers(0, n, size = (n, 2)).tolist()]
+            for cell in cells:
+                known_blocked[cell] = True
+            graph.remove_cells(cells)
+            index.block_cells(cells)
+            # queries check the components they land in, the rest are checked here
+            for _ in range(20):
+                start, goal = rng.integers(0, n * n * slp.states_per_cell, size = 2).tolist()
+                if n <= 12:
+                    assert index.reachable(start, goal) == (start in graph and goal in graph and slp.astar_search(start, goal, graph, None, lambda s, g: 0) is not None)
+            for label in list(index.seeds):
+                if label in index.seeds:
+                    index.split(label)
+            fresh = slp.Reachability_Index(n, n, known_blocked)
+            fresh.label_all()
+            assert same_partition(index.labels, fresh.labels), (n, step)
+
+def test_lazy_successors_equal_dict_graph():
+    for n, seed in ((2, 0), (5, 1), (8, 3)):
+        state_lattice, state_graph = dict_graph(n, seed)
+        graph = slp.build_lazy_state_graph(state_lattice)
+        assert_same_successors(graph, state_graph, n, packed = False)
+        cells = removed_cells(state_lattice)
+        state_graph = slp.extract_cells(cells, state_graph)
+        for (x, y) in cells:
+            graph = slp.extract_node(x, y, graph)
+        assert_same_successors(graph, state_graph, n, packed = False)
+        assert_same_successors(slp.Lattice_Successors(n, n, cells), state_graph, n, packed = False)
+
+def test_packed_successors_equal_dict_graph():
+    for n, seed in ((2, 0), (5, 1), (8, 3)):
+        state_lattice, state_graph = dict_graph(n, seed)
+        graph = slp.build_lazy_state_graph(state_lattice, packed = True)
+        assert_same_successors(graph, state_graph, n, packed = True)
+        cells = removed_cells(state_lattice)
+        state_graph = slp.extract_cells(cells, state_graph)
+        graph.remove_cell(*cells[0])
+        graph.remove_cells(cells[1:] + [(-1, 0), (n, n)]) # cells off the map are ignored
+        assert_same_successors(graph, state_graph, n, packed = True)
+        assert_same_successors(slp.Packed_Lattice_Successors(n, n, cells), state_graph, n, packed = True)
+        for sid in range(0, n * n * slp.states_per_cell, 7): # the packed encoding round-trips
+            assert slp.encode_state(slp.decode_state(sid, n), n) == sid
+
+def test_knowledge_overlay_equals_rebuilt_graph():
+    for n, seed in ((5, 1), (8, 3)):
+        state_lattice, state_graph = dict_graph(n, seed)
+        state_lattice = slp.open_cells(state_lattice, [(0, 0, 'north', 'center')]) # where the agent senses from
+        bases = [(slp.Packed_Lattice_Successors(n, n), True), (slp.build_csr_state_graph(state_lattice), True),
+                 (slp.build_csr_state_graph(state_lattice), False), (slp.Lattice_Successors(n, n), False),
+                 (slp.assign_edges(state_lattice, slp.build_state_graph(state_lattice)), False)]
+        for base, packed in bases[1:3]:
+            base.build_reverse_index() # built on first use otherwise, which is not a change
+        before = [copy.deepcopy(base) for base, packed in bases]
+        cells = removed_cells(state_lattice)
+        # the graph the agent would have rebuilt with its knowledge
+        rebuilt = slp.extract_cells(cells, slp.assign_edges(state_lattice, slp.build_state_graph(state_lattice)))
+        for (base, packed), copied in zip(bases, before):
+            overlay = slp.Knowledge_Overlay(base, n)
+            overlay, newly_blocked = slp.update_knowledge_region(slp.encode_state((0, 0, 'north', 'center'), n), overlay, state_lattice, n, return_blocked = True)
+            assert sorted(newly_blocked) == sorted(cells)
+            assert_same_successors(overlay, rebuilt, n, packed)
+            # the shared base graph is left as it was
+            if isinstance(base, dict):
+                assert base == copied
+            else:
+                assert vars(base).keys() == vars(copied).keys()
+                for name, value in vars(base).items():
+                    assert np.array_equal(value, vars(copied)[name]) if isinstance(value, np.ndarray) else value == vars(copied)[name], name
+            overlay.reset()
+            assert_same_successors(overlay, state_graph, n, packed)
@@ -0,0 +1,49 @@
+import os
+
+import numpy as np
+
+import slp
+
+# map files must load as the same 0/1 lattice whatever their format
+
+def test_map_formats_round_trip(tmp_path):
+    state_lattice = np.asarray(slp.generate_state_lattice(9, 13, (0.7, 0.3), seed = 2), dtype = np.uint8)
+    for name in ('map.npy', 'map.pgm', 'map.raw'):
+        filename = str(tmp_path / name)
+        slp.save_lattice(state_lattice, filename)
+        for mmap in (True, False):
+            loaded = slp.load_lattice(filename, shape = state_lattice.shape, mmap = mmap)
+            assert np.array_equal(loaded, state_lattice), (name, mmap)
+
+def test_pgm_header_on_one_line(tmp_path):
+    state_lattice = np.asarray(slp.generate_state_lattice(4, 6, (0.5, 0.5), seed = 1), dtype = np.uint8)
+    filename = str(tmp_path / 'map.pgm')
+    with open(filename, 'wb') as f:
+        f.write(b'P5 6 4 # a comment\n255 ' + ((1 - state_lattice) * 255).astype(np.uint8).tobytes())
+    assert np.array_equal(slp.load_lattice(filename), state_lattice)
+
+def test_thresholded_maps_are_cached_outside_the_map_directory(tmp_path, monkeypatch):
+    monkeypatch.setattr(slp, 'occupancy_cache_dir', str(tmp_path / 'cache'))
+    mask = (np.asarray(slp.generate_state_lattice(10, 10, (0.7, 0.3), seed = 3)) * 255).astype(np.uint8)
+    maps = tmp_path / 'maps'
+    maps.mkdir()
+    np.save(str(maps / 'mask.npy'), mask) # 0/255 cells, e.g. an exported mask
+    for _ in range(2): # built, then read from the cache
+        assert np.array_equal(slp.load_lattice(str(maps / 'mask.npy')), mask // 255)
+    assert os.listdir(str(maps)) == ['mask.npy']
+    assert len(os.listdir(str(tmp_path / 'cache'))) == 1
+
+def test_binary_maps_are_scanned_once(tmp_path, monkeypatch):
+    monkeypatch.setattr(slp, 'occupancy_cache_dir', str(tmp_path / 'cache'))
+    state_lattice = np.asarray(slp.generate_state_lattice(10, 10, (0.7, 0.3), seed = 4), dtype = np.uint8)
+    filename = str(tmp_path / 'map.npy')
+    np.save(filename, state_lattice)
+    loaded = slp.load_lattice(filename)
+    assert isinstance(loaded, np.memmap) and loaded.filename == os.path.abspath(filename) # the map itself, not a copy
+    assert np.array_equal(loaded, state_lattice)
+    # the verdict is remembered until the map changes
+    assert len(os.listdir(str(tmp_path / 'cache'))) == 1
+    assert isinstance(slp.load_lattice(filename), np.memmap)
+    np.save(filename, state_lattice * 255)
+    os.utime(filename, (os.path.getmtime(filename) + 10,) * 2)
+    assert np.array_equal(slp.load_lattice(filename), state_lattice)
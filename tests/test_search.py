@@ -0,0 +1,277 @@
+import heapq
+import random
+
+import numpy as np
+
+import slp
+
+# every planner's plan cost must match a plain Dijkstra search on the same
+# graph (these planners are all optimal with the heuristics used here)
+
+def dijkstra(state_graph, start, goal):
+    cost = {start : 0}
+    queue = [(0, start)]
+    while queue:
+        c, state = heapq.heappop(queue)
+        if state == goal:
+            return c
+        if c > cost[state]:
+            continue
+        for succ, step in slp.get_successors(state_graph, state).items():
+            if c + step < cost.get(succ, np.inf):
+                cost[succ] = c + step
+                heapq.heappush(queue, (c + step, succ))
+    return None
+
+# a random map with open start and goal cells, and its obstacle cells in random order
+def scenario(n, seed):
+    rng = random.Random(seed)
+    state_lattice = np.array(slp.generate_state_lattice(n, n, (0.8, 0.2), seed = seed))
+    start = (rng.randrange(n), rng.randrange(n), rng.choice(slp.heading), slp.angle[0])
+    goal = (rng.randrange(n), rng.randrange(n), rng.choice(slp.heading), slp.angle[0])
+    state_lattice = np.asarray(slp.open_cells(state_lattice, [start, goal]))
+    obstacles = [tuple(cell) for cell in np.argwhere(state_lattice == 1).tolist()]
+    rng.shuffle(obstacles)
+    return state_lattice, start, goal, obstacles
+
+def plan_cost(result):
+    return None if result is None else result[1]
+
+def test_dstar_lite_equals_dijkstra():
+    for seed in range(12):
+        state_lattice, start, goal, obstacles = scenario(10, seed)
+        graph = slp.build_csr_state_graph(state_lattice)
+        if seed % 2: # packed states
+            start, goal = graph.state_id(start), graph.state_id(goal)
+        planner = slp.DStar_Lite(start, goal, graph, state_lattice)
+        assert plan_cost(planner.replan(start, return_cost = True)) == dijkstra(graph, start, goal)
+        # learn the obstacles a few at a time while moving along the plan
+        for k in range(0, len(obstacles), 4):
+            cells = obstacles[k:k + 4]
+            graph.remove_cells(cells)
+            result = planner.replan(start, cells, return_cost = True)
+            assert plan_cost(result) == dijkstra(graph, start, goal), (seed, k)
+            if result is None:
+                break
+            if len(result[0]) > 1:
+                start = result[0][1]
+
+def test_heuristic_lut_astar_equals_dijkstra():
+    lut = slp.Heuristic_LUT(slp.build_heuristic_table(5), fallback = slp.chebyshev_distance)
+    for seed in range(12):
+        state_lattice, start, goal, obstacles = scenario(8, seed)
+        graph = slp.build_csr_state_graph(state_lattice)
+        graph.remove_cells(obstacles)
+        assert plan_cost(slp.astar_search(start, goal, graph, state_lattice, lut, return_cost = True)) == dijkstra(graph, start, goal)
+    # on an open map the table is the exact cost inside its radius
+    graph = slp.build_csr_state_graph(np.zeros((11, 11)))
+    goal = (5, 5, slp.heading[0], slp.angle[0])
+    for start in [(x, y, h, a) for x in range(2, 9, 3) for y in range(1, 10, 4) for h in slp.heading for a in slp.angle]:
+        assert lut(start, goal) == dijkstra(graph, start, goal), start
+
+# 8-connected breadth first distances from the goal cell, the reference for the cost fields
+def grid_distances(goal, known_blocked):
+    rows, cols = known_blocked.shape
+    field = np.full((rows, cols), np.inf)
+    if known_blocked[goal]:
+        return field
+    field[goal] = 0
+    frontier = [goal]
+    while frontier:
+        reached = []
+        for (x, y) in frontier:
+            for dx in (-1, 0, 1):
+                for dy in (-1, 0, 1):
+                    if 0 <= x + dx < rows and 0 <= y + dy < cols and not known_blocked[x + dx, y + dy] and field[x + dx, y + dy] == np.inf:
+                        field[x + dx, y + dy] = field[x, y] + 1
+                        reached.append((x + dx, y + dy))
+        frontier = reached
+    return field
+
+def test_cost_field_repair_equals_fresh_build():
+    for seed in range(20):
+        state_lattice, start, goal, obstacles = scenario(15, seed)
+        known_blocked = np.zeros(state_lattice.shape, dtype = bool)
+        field = slp.build_cost_field(goal, known_blocked)
+        for k in range(0, len(obstacles), 7):
+            cells = obstacles[k:k + 7]
+            for cell in cells:
+                known_blocked[cell] = True
+            field = slp.repair_cost_field(field, known_blocked, cells)
+            assert np.array_equal(field, slp.build_cost_field(goal, known_blocked)), (seed, k)
+            assert np.array_equal(field, grid_distances(goal[:2], known_blocked)), (seed, k)
+
+def test_cost_field_astar_equals_dijkstra():
+    for seed in range(12):
+        state_lattice, start, goal, obstacles = scenario(10, seed)
+        graph = slp.build_csr_state_graph(state_lattice)
+        heuristic = slp.Cost_Field_Heuristic(10, 10)
+        for k in range(0, len(obstacles), 5): # the cached field is repaired as cells get blocked
+            graph.remove_cells(obstacles[k:k + 5])
+            heuristic.block_cells(obstacles[k:k + 5])
+            assert plan_cost(slp.astar_search(start, goal, graph, state_lattice, heuristic, return_cost = True)) == dijkstra(graph, start, goal)
+
+def test_bidirectional_astar_equals_dijkstra():
+    for seed in range(16):
+        state_lattice, start, goal, obstacles = scenario(10, seed)
+        known = obstacles[:len(obstacles) * 3 // 4]
+        graph = slp.build_csr_state_graph(state_lattice)
+        graph.remove_cells(known)
+        graphs = [graph]
+        heuristic = slp.chebyshev_distance
+        if seed % 2: # packed states, also on the implicit graph
+            start, goal = graph.state_id(start), graph.state_id(goal)
+            heuristic = slp.Packed_Heuristic(heuristic, graph.ncols)
+            graphs.append(slp.Packed_Lattice_Successors(10, 10, known))
+        for state_graph in graphs:
+            assert plan_cost(slp.bidirectional_astar_search(start, goal, state_graph, state_lattice, heuristic, return_cost = True)) == dijkstra(graph, start, goal), seed
+
+def test_tile_planner_cache_equals_fresh_rebuild():
+    for seed in range(6):
+        state_lattice, start, goal, obstacles = scenario(40, seed)
+        graph = slp.Packed_Lattice_Successors(40, 40)
+        planner = slp.Tile_Planner(graph, 40, 40, tile_size = 8)
+        start, goal = slp.encode_state(start, 40), slp.encode_state(goal, 40)
+        heuristic = slp.Packed_Heuristic(slp.chebyshev_distance, 40)
+        for k in range(0, len(obstacles), len(obstacles) // 4 + 1):
+            cells = obstacles[k:k + len(obstacles) // 4 + 1]
+            graph.remove_cells(cells)
+            planner.block_cells(cells)
+            result = planner.plan(start, goal, heuristic, return_cost = True)
+            # tiles are not optimal, but they find a plan exactly when there is one
+            best = dijkstra(graph, start, goal)
+            assert (result is None) == (best is None)
+            if result is not None:
+                assert result[0][0] == start and result[0][-1] == goal and result[1] >= best
+            fresh = slp.Tile_Planner(graph, 40, 40, tile_size = 8)
+            for tile in list(planner.tile_edges):
+                assert planner.edges(tile) == fresh.edges(tile), (seed, k, tile)
+            for tile in list(planner.tile_nodes):
+                assert planner.nodes(tile) == fresh.nodes(tile), (seed, k, tile)
+            for (tile, side) in list(planner.borders):
+                assert planner.border(tile, side) == fresh.border(tile, side), (seed, k, tile, side)
+
+def test_goal_tree_cache_equals_dijkstra():
+    rng = random.Random(3)
+    for seed in range(6):
+        state_lattice, start, goal, obstacles = scenario(12, seed)
+        graph = slp.Knowledge_Overlay(slp.Packed_Lattice_Successors(12, 12))
+        trees = slp.Goal_Tree_Cache(graph, capacity = 2)
+        goals = [slp.encode_state(goal, 12)] + [rng.randrange(graph.base.num_nodes) for _ in range(2)]
+        for k in range(0, len(obstacles), 6):
+            cells = obstacles[k:k + 6]
+            slp.extract_cells(cells, graph)
+            trees.block_cells(cells) # stale trees are kept while their plans avoid the new cells
+            for _ in range(10):
+                start = rng.randrange(graph.base.num_nodes)
+                goal = rng.choice(goals)
+                if start not in graph or goal not in graph:
+                    continue
+                result = trees.plan(start, goal, return_cost = True)
+                assert plan_cost(result) == dijkstra(graph, start, goal), (seed, k, start, goal)
+                if result is not None:
+                    assert slp.pathcost(result[0], graph) == result[1]
+
+def test_ara_star_bounds_and_optimum_without_budget():
+    for seed in range(10):
+        state_lattice, start, goal, obstacles = scenario(10, seed)
+        graph = slp.build_csr_state_graph(state_lattice)
+        graph.remove_cells(obstacles)
+        solutions = []
+        result = slp.ara_star_search(start, goal, graph, state_lattice, slp.chebyshev_distance, return_cost = True, solutions = solutions)
+        best = dijkstra(graph, start, goal)
+        assert plan_cost(result) == best
+        if best is None:
+            continue
+        assert solutions[-1]['bound'] == 1.0 and all(solution['complete'] for solution in solutions)
+        for solution in solutions: # every plan found on the way is within its bound
+            assert best <= solution['cost'] <= solution['bound'] * best
+        # euclidean_distance is not admissible, so no bound is claimed
+        solutions = []
+        slp.ara_star_search(start, goal, graph, state_lattice, slp.euclidean_distance, solutions = solutions)
+        assert all(solution['bound'] is None for solution in solutions)
+
+def test_ara_star_partial_plan():
+    graph = slp.build_csr_state_graph(np.zeros((20, 20)))
+    start, goal = (0, 0, slp.heading[1], slp.angle[0]), (19, 19, slp.heading[1], slp.angle[0])
+    solutions = []
+    solution_path, cost = slp.ara_star_search(start, goal, graph, None, slp.chebyshev_distance, max_expansions = 10, return_cost = True, solutions = solutions)
+    # no plan to the goal in budget - a path from the start towards it
+    assert solution_path[0] == start and solution_path[-1] != goal
+    assert slp.chebyshev_distance(solution_path[-1], goal) < slp.chebyshev_distance(start, goal)
+    assert cost == slp.pathcost(solution_path, graph)
+    assert solutions[-1]['complete'] is False and solutions[-1]['bound'] is None
+
+def test_arastar_episodes_end_under_a_budget():
+    # these starts and goals sent budgeted searches back and forth around a
+    # local minimum of the heuristic forever
+    for (seed, start, goal) in ((4, (19, 0, 'south', 'center'), (5, 22, 'north', 'center')),
+                                (0, (15, 6, 'north', 'center'), (29, 21, 'north', 'center')),
+                                (2, (17, 8, 'south', 'center'), (7, 24, 'west', 'center'))):
+        state_lattice = slp.generate_rooms_lattice(30, 30, seed = seed)
+        result = slp.run_episode(state_lattice, start, goal, 1, planner = 'arastar', max_expansions = 50)
+        assert result['reached'] == slp.run_episode(state_lattice, start, goal, 1)['reached']
+        if result['reached']:
+            assert result['agent_path'][-1] == goal
+
+def test_indexed_frontier_decrease_key_and_order():
+    rng = random.Random(2)
+    frontier = slp.Frontier_PQ(0, indexed = True)
+    best = {0 : 0}
+    for _ in range(2000):
+        state, cost = rng.randrange(300), rng.randrange(1000)
+        frontier.add(state, cost) # a higher cost for a queued state is ignored
+        best[state] = min(best.get(state, cost), cost)
+    assert frontier.pushes == len(best) and frontier.decrease_keys > 0
+    popped = [frontier.pop() for _ in range(len(best))]
+    # every state comes out once, at its lowest cost, in order
+    assert popped == sorted((cost, state) for state, cost in best.items())
+    assert not frontier.q and not frontier.pos
+    # a popped state can be queued again
+    frontier.add(5, 3)
+    assert frontier.pop() == (3, 5)
+
+def test_indexed_frontier_astar_equals_dijkstra():
+    for seed in range(8):
+        state_lattice, start, goal, obstacles = scenario(10, seed)
+        graph = slp.build_csr_state_graph(state_lattice)
+        graph.remove_cells(obstacles)
+        start, goal = graph.state_id(start), graph.state_id(goal)
+        frontier_stats = {}
+        result = slp.astar_search(start, goal, graph, state_lattice, slp.Packed_Heuristic(slp.chebyshev_distance, 10),
+                                  return_cost = True, indexed_frontier = True, frontier_stats = frontier_stats)
+        assert plan_cost(result) == dijkstra(graph, start, goal)
+        assert frontier_stats['pops'] <= frontier_stats['pushes']
+
+def test_plan_cache_reuses_and_repairs():
+    rng = random.Random(4)
+    heuristic = slp.Packed_Heuristic(slp.chebyshev_distance, 20)
+    repairs = 0
+    for seed in range(30):
+        state_lattice = np.asarray(slp.generate_state_lattice(20, 20, (0.85, 0.15), seed = seed))
+        start, goal = slp.encode_state((0, 0, 'south', 'center'), 20), slp.encode_state((19, 19, 'south', 'center'), 20)
+        graph = slp.Knowledge_Overlay(slp.Packed_Lattice_Successors(20, 20))
+        plan, cost = slp.astar_search(start, goal, graph, None, heuristic, return_cost = True)
+        cache = slp.Plan_Cache()
+        cache.set(plan, graph)
+        # a cell off the plan leaves it as it was, from wherever the agent is on it
+        on_plan = {slp.state_cell(state, 20) for state in plan}
+        off_plan = next(cell for cell in ((x, y) for x in range(20) for y in range(20)) if cell not in on_plan)
+        slp.extract_cells([off_plan], graph)
+        step = rng.randrange(len(plan) - 1)
+        assert cache.repair(plan[step], graph, None, heuristic) == (plan[step:], cost - slp.pathcost(plan[:step + 1], graph), 0)
+        assert cache.last_reused and cache.reuses == 1
+        # a cell on the plan is worked around
+        slp.extract_cells([rng.choice(sorted({slp.state_cell(state, 20) for state in plan[3:-3]}))], graph)
+        result = cache.repair(start, graph, None, heuristic)
+        best = dijkstra(graph, start, goal)
+        if result is None: # given up, the caller replans
+            assert cache.failed_repairs == 1
+            continue
+        repairs += 1
+        repaired, repaired_cost, nexp = result
+        assert not cache.last_reused and cache.repairs == 1 and nexp > 0
+        assert repaired[0] == start and repaired[-1] == goal
+        assert repaired_cost == slp.pathcost(repaired, graph) # every step is still in the graph
+        assert best <= repaired_cost <= 1.5 * best
+    assert repairs > 20
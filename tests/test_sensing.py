@@ -0,0 +1,75 @@
+import random
+
+import numpy as np
+
+import slp
+
+# the vectorized sensing must see what its shape says, and the 'rays' shape
+# exactly what update_knowledge sees
+
+def visible_cells(x, y, nrows, ncols, vision, shape):
+    cells = set()
+    for bx in range(max(0, x - vision), min(nrows, x + vision + 1)):
+        for by in range(max(0, y - vision), min(ncols, y + vision + 1)):
+            dx, dy = bx - x, by - y
+            if (dx, dy) == (0, 0):
+                continue
+            if shape == 'square' or (shape == 'rays' and (dx == 0 or dy == 0 or abs(dx) == abs(dy))) or \
+               (shape == 'circle' and (dx * dx + dy * dy <= vision * vision or max(abs(dx), abs(dy)) == 1)):
+                cells.add((bx, by))
+    return cells
+
+def test_sensing_shapes():
+    for seed in range(10):
+        state_lattice = np.asarray(slp.generate_state_lattice(15, 11, (0.6, 0.4), seed = seed))
+        rng = random.Random(seed)
+        for vision in (1, 2, 3, 5):
+            x, y = rng.randrange(15), rng.randrange(11)
+            for shape in ('rays', 'square', 'circle'):
+                seen = {tuple(cell) for cell in slp.sense_blocked_cells(x, y, state_lattice, vision, shape).tolist()}
+                expected = {cell for cell in visible_cells(x, y, 15, 11, vision, shape) if state_lattice[cell] == 1}
+                assert seen == expected, (seed, vision, shape)
+                # occlusion only hides cells, never the ones next to the agent
+                hidden = {tuple(cell) for cell in slp.sense_blocked_cells(x, y, state_lattice, vision, shape, occlusion = True).tolist()}
+                assert {cell for cell in seen if max(abs(cell[0] - x), abs(cell[1] - y)) == 1} <= hidden <= seen
+
+def test_occlusion_hides_cells_behind_obstacles():
+    state_lattice = np.zeros((9, 9), dtype = np.uint8)
+    state_lattice[4, 5:] = 1 # a wall along the ray east of (4, 4)
+    state_lattice[6, 6] = 1 # behind (5, 5) on the diagonal ray, which is open
+    state_lattice[5, 5] = 0
+    for shape in ('rays', 'square', 'circle'):
+        seen = {tuple(cell) for cell in slp.sense_blocked_cells(4, 4, state_lattice, 4, shape, occlusion = True).tolist()}
+        assert (4, 5) in seen and (4, 6) not in seen and (4, 8) not in seen
+        assert (6, 6) in seen
+
+def test_rays_region_equals_update_knowledge():
+    for seed in range(10):
+        state_lattice = slp.generate_state_lattice(12, 12, (0.7, 0.3), seed = seed)
+        rng = random.Random(seed)
+        base = slp.Packed_Lattice_Successors(12, 12)
+        one_by_one = slp.Knowledge_Overlay(base)
+        region = slp.Knowledge_Overlay(base)
+        dict_graph = slp.assign_edges(state_lattice, slp.build_state_graph(state_lattice))
+        for _ in range(8):
+            state = (rng.randrange(12), rng.randrange(12), slp.heading[0], slp.angle[0])
+            vision = rng.randint(1, 4)
+            one_by_one, expected = slp.update_knowledge(slp.encode_state(state, 12), one_by_one, state_lattice, vision, return_blocked = True)
+            region, found = slp.update_knowledge_region(slp.encode_state(state, 12), region, state_lattice, vision, 'rays', return_blocked = True)
+            dict_graph, in_dict = slp.update_knowledge_region(state, dict_graph, state_lattice, vision, 'rays', return_blocked = True)
+            assert sorted(found) == sorted(expected) == sorted(in_dict)
+            assert one_by_one.blocked == region.blocked
+
+def test_episodes_end_with_every_sensing_shape():
+    # with vision 1, circle sensing used to miss the diagonal cells the
+    # lattice moves go to, and the agent replanned the same plan forever
+    for seed in range(8):
+        state_lattice = slp.generate_state_lattice(12, 12, (0.75, 0.25), seed = seed)
+        start, goal = (0, 0, 'south', 'center'), (11, 11, 'south', 'center')
+        reached = slp.run_episode(state_lattice, start, goal, 1)['reached']
+        for shape in ('rays', 'square', 'circle'):
+            for occlusion in (False, True):
+                result = slp.run_episode(state_lattice, start, goal, 1, sensing = shape, occlusion = occlusion)
+                assert result['reached'] == reached, (seed, shape, occlusion)
+        fleet = slp.run_fleet(state_lattice, [(start, goal), (goal, start)], 1, sensing = 'circle')
+        assert fleet['reached'] == 2 * reached